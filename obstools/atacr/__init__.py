@@ -20,5 +20,5 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from .classes import DayNoise, StaNoise, TFNoise, EventStream
-from .classes import Power, Cross, Rotation
+from .classes import DayNoise, SegmentNoise, StaNoise, TFNoise, EventStream
+from .classes import Power, Cross, Rotation, PartialSpectra
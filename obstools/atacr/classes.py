@@ -22,13 +22,12 @@
 
 
 import sys
-from scipy.signal import stft, detrend
-from scipy.linalg import norm
+from scipy.signal import detrend
 import matplotlib.pyplot as plt
 import numpy as np
 import pickle
-from obspy.core import Stream, Trace, read
-from obstools.atacr import utils, plotting
+from obspy.core import Stream, Trace, UTCDateTime, read
+from obstools.atacr import utils, plotting, store
 from pkg_resources import resource_filename
 from pathlib import Path
 np.seterr(all='ignore')
@@ -129,6 +128,263 @@ class Rotation(object):
         self.direc = direc
 
 
+class PartialSpectra(object):
+    """
+    Container for the spectral matrix of the available components and the
+    conditioned (partial) spectral densities obtained from it, with shape
+    (ncomp, ncomp, nfreq).
+
+    The spectral matrix follows Bendat and Piersol, i.e. ``G[i, j]`` is the
+    average of ``conj(ft_i)*ft_j``. Conditioning the spectral matrix on a
+    component `k` removes from all other components the part that is
+    linearly coherent with `k`, using the Schur complement
+
+    .. math::
+
+       G_{ij \\cdot k} = G_{ij} - G_{ik}G_{kj}/G_{kk}
+
+    for all component pairs and all frequencies at once. Conditioning on
+    several components is done one component at a time (i.e., the steps
+    of a Cholesky factorization), and all intermediate matrices are cached
+    so that they are shared by all transfer functions, compliance and
+    coherence functions that are calculated from the same averaged
+    spectra (see :func:`~obstools.atacr.classes.PartialSpectra.of`).
+
+    The components `1`, `2`, `P` and `Z` form one spectral matrix, and the
+    rotated horizontal component `H` forms another one with `P` and `Z`,
+    which is used whenever `H` is involved.
+
+    Attributes
+    ----------
+    spectra : dict
+        Average power and cross spectra, with the names of the attributes
+        of the :class:`~obstools.atacr.classes.Power`,
+        :class:`~obstools.atacr.classes.Cross` and
+        :class:`~obstools.atacr.classes.Rotation` containers (e.g., `c11`,
+        `c1Z`, `cHP`)
+
+    Examples
+    --------
+
+    Transfer function between P and Z, conditioned on H1 and H2
+
+    >>> from obstools.atacr import DayNoise, PartialSpectra
+    >>> daynoise = DayNoise('demo')
+    Uploading demo data - March 04, 2012, station 7D.M08A
+    >>> daynoise.QC_daily_spectra()
+    >>> daynoise.average_daily_spectra()
+    >>> partial = PartialSpectra.of(daynoise)
+    >>> tf = partial.gain('P', 'Z', given=('1', '2'))
+
+    """
+
+    quantities = ['c11', 'c22', 'cZZ', 'cPP', 'c12', 'c1Z', 'c1P', 'c2Z',
+                  'c2P', 'cZP', 'cHH', 'cHZ', 'cHP']
+    groups = [['1', '2', 'P', 'Z'], ['H', 'P', 'Z']]
+
+    def __init__(self, spectra=None):
+
+        spectra = spectra or {}
+        self.spectra = {key: value for key, value in spectra.items()
+                        if key in self.quantities and value is not None}
+        self._cache = {}
+
+    @classmethod
+    def of(cls, obj):
+        """
+        Method to get the partial spectra of the averaged spectra of an
+        object, which are either stored in `power`, `cross` and `rotation`
+        containers (:class:`~obstools.atacr.classes.DayNoise` and
+        :class:`~obstools.atacr.classes.StaNoise`) or as attributes
+        (:class:`~obstools.atacr.classes.TFNoise` and
+        :class:`~obstools.comply.classes.Comply`). The partial spectra are
+        stored in the object and reused for as long as the averaged spectra
+        are the same arrays, such that objects initialized from the same
+        noise object share them.
+
+        Parameters
+        ----------
+        obj : object
+            Object with averaged spectra
+
+        Returns
+        -------
+        partial : :class:`~obstools.atacr.classes.PartialSpectra`
+            Partial spectra of the object
+
+        """
+
+        if hasattr(obj, 'power'):
+            spectra = {}
+            for container in [obj.power, obj.cross,
+                              getattr(obj, 'rotation', None)]:
+                spectra.update(vars(container) if container else {})
+        else:
+            spectra = vars(obj)
+        spectra = {key: spectra[key] for key in cls.quantities
+                   if spectra.get(key) is not None}
+
+        partial = getattr(obj, '_partial', None)
+        if (partial is None or spectra.keys() != partial.spectra.keys() or
+                any(spectra[key] is not partial.spectra[key]
+                    for key in spectra)):
+            partial = cls(spectra)
+        obj._partial = partial
+
+        return partial
+
+    def _group(self, comps):
+        """
+        Private method to select the spectral matrix that contains all
+        components in `comps`.
+
+        """
+
+        group = self.groups[1] if 'H' in comps else self.groups[0]
+        if any(comp not in group for comp in comps):
+            raise(Exception("Components " + ", ".join(comps) + " are not " +
+                            "in the same spectral matrix"))
+
+        return group
+
+    def _matrix(self, group):
+        """
+        Private method to build the spectral matrix of a group of
+        components from the average power and cross spectra.
+
+        """
+
+        spectra = self.spectra
+        comps = [comp for comp in group if 'c' + 2*comp in spectra]
+        dtype = np.result_type(np.complex64, *[
+            spectra[key] for key in spectra if set(key[1:]) <= set(comps)])
+        G = np.zeros((len(comps), len(comps), len(spectra['cZZ'])),
+                     dtype=dtype)
+        for i, ci in enumerate(comps):
+            for j, cj in enumerate(comps):
+                if 'c' + ci + cj in spectra:
+                    G[i, j] = np.conj(spectra['c' + ci + cj])
+                elif 'c' + cj + ci in spectra:
+                    G[i, j] = spectra['c' + cj + ci]
+                else:
+                    raise(Exception("Missing cross spectra between " +
+                                    "components " + ci + " and " + cj))
+
+        return comps, G
+
+    def conditioned(self, given=(), group=None):
+        """
+        Method to get the spectral matrix conditioned on a set of
+        components.
+
+        Parameters
+        ----------
+        given : tuple, optional
+            Components to condition on, in order
+        group : list, optional
+            Components of the spectral matrix (default is the matrix that
+            contains the components in `given`)
+
+        Returns
+        -------
+        comps : list
+            Available components, i.e. the rows and columns of `G`
+        G : :class:`~numpy.ndarray`
+            Conditioned spectral matrix
+
+        """
+
+        given = tuple(given)
+        if group is None:
+            group = self._group(given)
+        key = (tuple(group), given)
+
+        if key not in self._cache:
+            if not given:
+                self._cache[key] = self._matrix(group)
+            else:
+                comps, G = self.conditioned(given[:-1], group)
+                if given[-1] not in comps:
+                    raise(Exception("Component " + given[-1] + " is not " +
+                                    "available"))
+                k = comps.index(given[-1])
+                self._cache[key] = (
+                    comps, G - G[:, k:k+1]*G[k:k+1, :]/G[k, k].real)
+
+        return self._cache[key]
+
+    def spectrum(self, x, y, given=()):
+        """
+        Method to get the power (`x` = `y`) or cross spectral density
+        between two components, conditioned on a set of components.
+
+        Parameters
+        ----------
+        x, y : str
+            Components
+        given : tuple, optional
+            Components to condition on, in order
+
+        Returns
+        -------
+        : :class:`~numpy.ndarray`
+            Conditioned spectral density (real-valued if `x` = `y`)
+
+        """
+
+        comps, G = self.conditioned(given, self._group((x, y) + tuple(given)))
+        if x not in comps or y not in comps:
+            raise(Exception("Components " + x + " and " + y + " are not " +
+                            "available"))
+        Gxy = G[comps.index(x), comps.index(y)]
+
+        return Gxy.real if x == y else Gxy
+
+    def gain(self, x, y, given=()):
+        """
+        Method to calculate the transfer function (frequency response
+        function) from component `x` to component `y`, conditioned on a set
+        of components.
+
+        Parameters
+        ----------
+        x, y : str
+            Input and output components
+        given : tuple, optional
+            Components to condition on, in order
+
+        Returns
+        -------
+        : :class:`~numpy.ndarray`
+            Conditioned transfer function
+
+        """
+
+        return self.spectrum(x, y, given)/self.spectrum(x, x, given)
+
+    def coherence(self, x, y, given=()):
+        """
+        Method to calculate the coherence between two components,
+        conditioned on a set of components.
+
+        Parameters
+        ----------
+        x, y : str
+            Components
+        given : tuple, optional
+            Components to condition on, in order
+
+        Returns
+        -------
+        : :class:`~numpy.ndarray`
+            Conditioned (partial) coherence
+
+        """
+
+        return np.abs(self.spectrum(x, y, given))**2/(
+            self.spectrum(x, x, given)*self.spectrum(y, y, given))
+
+
 class DayNoise(object):
     r"""
     A DayNoise object contains attributes that associate
@@ -154,6 +410,15 @@ class DayNoise(object):
         Fraction of overlap between adjacent windows
     key : str
         Station key for current object
+    onesided : bool
+        Whether the spectra are calculated for non-negative frequencies
+        only (True) or for the full two-sided frequency axis (False)
+    streaming : bool
+        Whether the spectra are accumulated one chunk of windows at a time
+        (True) instead of storing the Fourier transforms of all windows
+        (False). In streaming mode, the attributes ``ft1``, ``ft2``,
+        ``ftZ`` and ``ftP`` are not stored and the traces are read a
+        second time when averaging the spectra
     dt : float
         Sampling distance in seconds. Obtained from ``trZ`` object
     npts : int
@@ -203,7 +468,7 @@ class DayNoise(object):
     """
 
     def __init__(self, tr1=None, tr2=None, trZ=None, trP=None, window=7200.,
-                 overlap=0.3, key=''):
+                 overlap=0.3, key='', onesided=False, streaming=False):
 
         # Load example data if initializing empty object
         if tr1 == 'demo' or tr1 == 'Demo':
@@ -233,6 +498,8 @@ class DayNoise(object):
         self.window = window
         self.overlap = overlap
         self.key = key
+        self.onesided = onesided
+        self.streaming = streaming
 
         # Get trace attributes
         zstats = self.trZ.stats
@@ -298,9 +565,10 @@ class DayNoise(object):
         ----------
         ftX : :class:`~numpy.ndarray`
             Windowed Fourier transform for the `X` component (can be either
-            1, 2, Z or P)
+            1, 2, Z or P). Set to None if the object is `streaming`
         f : :class:`~numpy.ndarray`
-            Full frequency axis (Hz)
+            Full frequency axis (Hz), or non-negative frequency axis if
+            the object is `onesided`
         goodwins : list
             List of booleans representing whether a window is good (True)
             or not (False)
@@ -327,54 +595,64 @@ class DayNoise(object):
 
         """
 
-        # Points in window
-        ws = int(self.window/self.dt)
+        # Points in window, points to overlap and taper
+        ws, ss, wind = self._window_taper()
 
-        # Number of points to overlap
-        ss = int(self.window*self.overlap/self.dt)
+        # Stack available components
+        if self.ncomp == 2:
+            comps = ['Z', 'P']
+        elif self.ncomp == 3:
+            comps = ['1', '2', 'Z']
+        else:
+            comps = ['1', '2', 'Z', 'P']
+        traces = {'1': self.tr1, '2': self.tr2, 'Z': self.trZ, 'P': self.trP}
+        data = [traces[comp].data for comp in comps]
 
-        # hanning window
-        hanning = np.hanning(2*ss)
-        wind = np.ones(ws)
-        wind[0:ss] = hanning[0:ss]
-        wind[-ss:ws] = hanning[ss:ws]
+        # Positive frequencies for PSD plots
+        faxis = int(ws/2)
+
+        self.ft1 = None
+        self.ft2 = None
+        self.ftZ = None
+        self.ftP = None
+
+        if self.streaming and not (fig_QC or debug):
+            # Only keep the de-meaned log PSDs required for the QC
+            self.f, dsls = self._stream_QC_spectra(
+                data, wind, ws, ss, pd, smooth)
+            self.goodwins, _ = utils.QC_outliers(dsls, tol=tol, alpha=alpha)
+            self.QC = True
+            return
+
+        if self.streaming:
+            # PSDs are kept for the figures, Fourier transforms are not
+            psd = []
+            t = []
+            for f, tc, ft in utils.iter_windowed_fft(
+                    data, self.fs, wind, ws, ss, onesided=self.onesided):
+                psd.append(np.abs(ft[..., 0:faxis])**2*2./self.dt)
+                t.append(tc)
+            psd = np.concatenate(psd, axis=1)
+            t = np.concatenate(t)
 
-        # Get windowed Fourier transforms
-        ft1 = self.ft1 = None
-        ft2 = self.ft2 = None
-        ftZ = self.ftZ = None
-        ftP = self.ftP = None
-
-        # Calculate windowed FFTs and store as transpose
-        f, t, ftZ = stft(
-            self.trZ.data, self.fs, return_onesided=False, boundary=None,
-            padded=False, window=wind, nperseg=ws, noverlap=ss,
-            detrend='constant')
-        ftZ = ftZ * ws
-        self.ftZ = ftZ.T
-        if self.ncomp == 2 or self.ncomp == 4:
-            _f, _t, ftP = stft(
-                self.trP.data, self.fs, return_onesided=False, boundary=None,
-                padded=False, window=wind, nperseg=ws, noverlap=ss,
-                detrend='constant')
-            ftP = ftP * ws
-            self.ftP = ftP.T
-        if self.ncomp == 3 or self.ncomp == 4:
-            _f, _t, ft1 = stft(
-                self.tr1.data, self.fs, return_onesided=False, boundary=None,
-                padded=False, window=wind, nperseg=ws, noverlap=ss,
-                detrend='constant')
-            _f, _t, ft2 = stft(
-                self.tr2.data, self.fs, return_onesided=False, boundary=None,
-                padded=False, window=wind, nperseg=ws, noverlap=ss,
-                detrend='constant')
-            ft1 = ft1 * ws
-            ft2 = ft2 * ws
-            self.ft1 = ft1.T
-            self.ft2 = ft2.T
+        else:
+            # Calculate windowed FFTs for all components at once
+            f, t, ft = utils.windowed_fft(
+                np.array(data), self.fs, wind, ws, ss,
+                onesided=self.onesided)
+            psd = np.abs(ft[..., 0:faxis])**2*2./self.dt
+
+            # Store as views into the contiguous block of Fourier transforms
+            self.ftZ = ft[comps.index('Z')]
+            if self.ncomp == 2 or self.ncomp == 4:
+                self.ftP = ft[comps.index('P')]
+            if self.ncomp == 3 or self.ncomp == 4:
+                self.ft1 = ft[comps.index('1')]
+                self.ft2 = ft[comps.index('2')]
 
         # Store frequency axis
         self.f = f
+        f = f[0:faxis]
 
         # Get spectrograms for single day-long keys
         psd1 = None
@@ -382,21 +660,13 @@ class DayNoise(object):
         psdZ = None
         psdP = None
 
-        # Positive frequencies for PSD plots
-        faxis = int(len(f)/2)
-        f = f[0:faxis]
-
-        psdZ = np.abs(ftZ)**2*2./self.dt
-        psdZ = psdZ[0:faxis, :]
+        psdZ = psd[comps.index('Z')].T
 
         if self.ncomp == 2 or self.ncomp == 4:
-            psdP = np.abs(ftP)**2*2/self.dt
-            psdP = psdP[0:faxis, :]
+            psdP = psd[comps.index('P')].T
         if self.ncomp == 3 or self.ncomp == 4:
-            psd1 = np.abs(ft1)**2*2/self.dt
-            psd1 = psd1[0:faxis, :]
-            psd2 = np.abs(ft2)**2*2/self.dt
-            psd2 = psd2[0:faxis, :]
+            psd1 = psd[comps.index('1')].T
+            psd2 = psd[comps.index('2')].T
 
         if fig_QC:
             if self.ncomp == 2:
@@ -550,52 +820,20 @@ class DayNoise(object):
             plt.show()
 
         # Cycle through to kill high-std-norm windows
-        moveon = False
-        goodwins = np.repeat([True], len(t))
-        indwin = np.argwhere(goodwins == True)
-
-        while moveon == False:
-
-            ubernorm = np.empty((self.ncomp, np.sum(goodwins)))
-            for ind_u, dsl in enumerate(dsls):
-                normvar = np.zeros(np.sum(goodwins))
-                for ii, tmp in enumerate(indwin):
-                    ind = np.copy(indwin)
-                    ind = np.delete(ind, ii)
-                    normvar[ii] = norm(np.std(dsl[:, ind], axis=1), ord=2)
-                ubernorm[ind_u, :] = np.median(normvar) - normvar
-
-            penalty = np.sum(ubernorm, axis=0)
-
-            plt.figure(4)
-            for i in range(self.ncomp):
-                plt.plot(range(0, np.sum(goodwins)), detrend(
-                    ubernorm, type='constant')[i], 'o-')
-            if debug:
+        goodwins, diagnostics = utils.QC_outliers(dsls, tol=tol, alpha=alpha)
+
+        if debug:
+            for ubernorm, penalty in diagnostics:
+                plt.figure(4)
+                for i in range(self.ncomp):
+                    plt.plot(range(0, len(penalty)), detrend(
+                        ubernorm, type='constant')[i], 'o-')
                 plt.show()
-            else:
-                plt.close('all')
-            plt.figure(5)
-            plt.plot(range(0, np.sum(goodwins)),
-                     np.sum(ubernorm, axis=0), 'o-')
-            if debug:
+                plt.figure(5)
+                plt.plot(range(0, len(penalty)), penalty, 'o-')
                 plt.show()
-            else:
-                plt.close('all')
-
-            kill = penalty > tol*np.std(penalty)
-            if np.sum(kill) == 0:
-                self.goodwins = goodwins
-                moveon = True
-
-            trypenalty = penalty[np.argwhere(kill == False)].T[0]
-
-            if utils.ftest(penalty, 1, trypenalty, 1) < alpha:
-                goodwins[indwin[kill == True]] = False
-                indwin = np.argwhere(goodwins == True)
-                moveon = False
-            else:
-                moveon = True
+        else:
+            plt.close('all')
 
         self.goodwins = goodwins
 
@@ -616,6 +854,76 @@ class DayNoise(object):
 
         self.QC = True
 
+    def _window_taper(self):
+        """
+        Private method returning the number of points in each window, the
+        number of points to overlap and the (Hanning-tapered) window.
+
+        """
+
+        # Points in window
+        ws = int(self.window/self.dt)
+
+        # Number of points to overlap
+        ss = int(self.window*self.overlap/self.dt)
+
+        # hanning window
+        hanning = np.hanning(2*ss)
+        wind = np.ones(ws)
+        wind[0:ss] = hanning[0:ss]
+        wind[-ss:ws] = hanning[ss:ws]
+
+        return ws, ss, wind
+
+    def _stream_QC_spectra(self, data, wind, ws, ss, pd, smooth):
+        """
+        Private method to calculate the de-meaned log PSDs used in the QC
+        one chunk of windows at a time. Only the band-limited log PSDs are
+        kept for each window; the Fourier transforms are discarded as soon
+        as they have been reduced.
+
+        Returns
+        -------
+        f : :class:`~numpy.ndarray`
+            Frequency axis (Hz)
+        dsls : :class:`~numpy.ndarray`
+            De-meaned log PSDs of shape (ncomp, nfreq, nwin)
+
+        """
+
+        faxis = int(ws/2)
+        dsl_smooth = []
+        dsl_raw = []
+        haszero = False
+
+        for f, t, ft in utils.iter_windowed_fft(
+                data, self.fs, wind, ws, ss, onesided=self.onesided):
+
+            # Select bandpass frequencies
+            ff = (f[0:faxis] > pd[0]) & (f[0:faxis] < pd[1])
+
+            psd = np.abs(ft[..., 0:faxis])**2*2./self.dt
+            haszero = haszero or (psd == 0.).any()
+
+            # Smoothed log of the PSDs, de-meaned over the band
+            sl_psd = utils.smooth(
+                np.log(psd, where=(psd > 0.)), 50, axis=-1)[..., ff]
+            dsl_smooth.append(
+                sl_psd - np.mean(sl_psd, axis=-1, keepdims=True))
+
+            # Raw log of the PSDs, only used if no PSD is zero
+            if not smooth and not haszero:
+                sl_psd = np.log(psd[..., ff])
+                dsl_raw.append(
+                    sl_psd - np.mean(sl_psd, axis=-1, keepdims=True))
+
+        if smooth or haszero:
+            dsls = dsl_smooth
+        else:
+            dsls = dsl_raw
+
+        return f, np.concatenate(dsls, axis=1).transpose(0, 2, 1)
+
     def average_daily_spectra(self, calc_rotation=True, fig_average=False,
                               fig_coh_ph=False, save=None, form='png'):
         """
@@ -680,83 +988,84 @@ class DayNoise(object):
                   "QC_daily_spectra using default values")
             self.QC_daily_spectra()
 
-        # Extract good windows
-        c11 = None
-        c22 = None
-        cZZ = None
-        cPP = None
-        cZZ = np.abs(
-            np.mean(
-                self.ftZ[self.goodwins, :]*np.conj(self.ftZ[self.goodwins, :]),
-                axis=0))
-        if self.ncomp == 2 or self.ncomp == 4:
-            cPP = np.abs(
-                np.mean(
-                    self.ftP[self.goodwins, :]*np.conj(
-                        self.ftP[self.goodwins, :]), axis=0))
-        if self.ncomp == 3 or self.ncomp == 4:
-            c11 = np.abs(
-                np.mean(
-                    self.ft1[self.goodwins, :]*np.conj(
-                        self.ft1[self.goodwins, :]), axis=0))
-            c22 = np.abs(
-                np.mean(
-                    self.ft2[self.goodwins, :]*np.conj(
-                        self.ft2[self.goodwins, :]), axis=0))
-
-        # Extract bad windows
+        # Available components
+        if self.ncomp == 2:
+            comps = ['Z', 'P']
+        elif self.ncomp == 3:
+            comps = ['1', '2', 'Z']
+        else:
+            comps = ['1', '2', 'Z', 'P']
+
+        # Weights for averages over good and bad windows
+        ngood = np.sum(self.goodwins)
+        nbad = np.sum(~self.goodwins)
+        weights = [self.goodwins/ngood]
+        if nbad > 0:
+            weights.append(~self.goodwins/nbad)
+        weights = np.array(weights)
+
+        if getattr(self, 'streaming', False):
+            # Second pass over the traces, accumulating the weighted
+            # spectral matrix one chunk of windows at a time
+            ws, ss, wind = self._window_taper()
+            traces = {'1': self.tr1, '2': self.tr2, 'Z': self.trZ,
+                      'P': self.trP}
+            S = None
+            k0 = 0
+            for f, t, ft in utils.iter_windowed_fft(
+                    [traces[comp].data for comp in comps], self.fs, wind,
+                    ws, ss, onesided=self.onesided):
+                k1 = k0 + ft.shape[1]
+                Sk = utils.spectral_matrix(list(ft), weights[:, k0:k1])
+                if S is None:
+                    S = Sk
+                else:
+                    S += Sk
+                k0 = k1
+
+        else:
+            # Spectral matrix for good (and bad) windows in a single pass
+            fts = {'1': self.ft1, '2': self.ft2, 'Z': self.ftZ,
+                   'P': self.ftP}
+            S = utils.spectral_matrix([fts[comp] for comp in comps], weights)
+        ind = {comp: i for i, comp in enumerate(comps)}
+
+        def _power(k, comp):
+            if comp not in ind:
+                return None
+            return np.abs(S[k, ind[comp], ind[comp]])
+
+        def _cross(comp1, comp2):
+            if comp1 not in ind or comp2 not in ind:
+                return None
+            # Copy, such that the spectral matrix can be released
+            return S[0, ind[comp1], ind[comp2]].copy()
+
+        # Power spectra of good windows
+        c11 = _power(0, '1')
+        c22 = _power(0, '2')
+        cZZ = _power(0, 'Z')
+        cPP = _power(0, 'P')
+
+        # Power spectra of bad windows
         bc11 = None
         bc22 = None
         bcZZ = None
         bcPP = None
-        if np.sum(~self.goodwins) > 0:
-            bcZZ = np.abs(
-                np.mean(
-                    self.ftZ[~self.goodwins, :]*np.conj(
-                        self.ftZ[~self.goodwins, :]), axis=0))
-            if self.ncomp == 2 or self.ncomp == 4:
-                bcPP = np.abs(
-                    np.mean(
-                        self.ftP[~self.goodwins, :]*np.conj(
-                            self.ftP[~self.goodwins, :]), axis=0))
-            if self.ncomp == 3 or self.ncomp == 4:
-                bc11 = np.abs(
-                    np.mean(
-                        self.ft1[~self.goodwins, :]*np.conj(
-                            self.ft1[~self.goodwins, :]), axis=0))
-                bc22 = np.abs(
-                    np.mean(
-                        self.ft2[~self.goodwins, :]*np.conj(
-                            self.ft2[~self.goodwins, :]), axis=0))
-
-        # Calculate mean of all good windows if component combinations exist
-        c12 = None
-        c1Z = None
-        c2Z = None
-        c1P = None
-        c2P = None
-        cZP = None
-        if self.ncomp == 3 or self.ncomp == 4:
-            c12 = np.mean(
-                self.ft1[self.goodwins, :] *
-                np.conj(self.ft2[self.goodwins, :]), axis=0)
-            c1Z = np.mean(
-                self.ft1[self.goodwins, :] *
-                np.conj(self.ftZ[self.goodwins, :]), axis=0)
-            c2Z = np.mean(
-                self.ft2[self.goodwins, :] *
-                np.conj(self.ftZ[self.goodwins, :]), axis=0)
-        if self.ncomp == 4:
-            c1P = np.mean(
-                self.ft1[self.goodwins, :] *
-                np.conj(self.ftP[self.goodwins, :]), axis=0)
-            c2P = np.mean(
-                self.ft2[self.goodwins, :] *
-                np.conj(self.ftP[self.goodwins, :]), axis=0)
-        if self.ncomp == 2 or self.ncomp == 4:
-            cZP = np.mean(
-                self.ftZ[self.goodwins, :] *
-                np.conj(self.ftP[self.goodwins, :]), axis=0)
+        if nbad > 0:
+            bc11 = _power(1, '1')
+            bc22 = _power(1, '2')
+            bcZZ = _power(1, 'Z')
+            bcPP = _power(1, 'P')
+
+        # Cross spectra of good windows
+        c12 = _cross('1', '2')
+        c1Z = _cross('1', 'Z')
+        c2Z = _cross('2', 'Z')
+        c1P = _cross('1', 'P')
+        c2P = _cross('2', 'P')
+        cZP = _cross('Z', 'P')
+        del S
 
         # Store as attributes
         self.power = Power(c11, c22, cZZ, cPP)
@@ -777,9 +1086,8 @@ class DayNoise(object):
 
         if calc_rotation and self.ncomp >= 3:
             cHH, cHZ, cHP, coh, ph, direc, tilt, coh_value, phase_value = \
-                utils.calculate_tilt(
-                    self.ft1, self.ft2, self.ftZ, self.ftP, self.f,
-                    self.goodwins)
+                utils.solve_tilt(
+                    c11, c22, cZZ, c12, c1Z, c2Z, self.f, c1P=c1P, c2P=c2P)
             self.rotation = Rotation(
                 cHH, cHZ, cHP, coh, ph, tilt, coh_value, phase_value, direc)
 
@@ -801,14 +1109,19 @@ class DayNoise(object):
 
         self.av = True
 
-    def save(self, filename):
+    def save(self, filename, form='pkl'):
         """
-        Method to save the object to file using `~Pickle`.
+        Method to save the object to file using `~Pickle` or the binary
+        store format of :mod:`~obstools.atacr.store`.
 
         Parameters
         ----------
         filename : str
             File name
+        form : str, optional
+            File format, either 'pkl' (pickle) or 'spec' (binary store, which
+            can be memory mapped when loaded with
+            :func:`~obstools.atacr.store.load`)
 
         Examples
         --------
@@ -843,9 +1156,201 @@ class DayNoise(object):
         del self.trZ
         del self.trP
 
-        file = open(str(filename), 'wb')
-        pickle.dump(self, file)
-        file.close()
+        # Partial spectra are recalculated when needed
+        if hasattr(self, '_partial'):
+            del self._partial
+
+        if form == 'spec':
+            store.save(self, filename)
+        else:
+            file = open(str(filename), 'wb')
+            pickle.dump(self, file)
+            file.close()
+
+
+class SegmentNoise(object):
+    r"""
+    A SegmentNoise object contains continuous traces spanning an arbitrary
+    length of time (e.g., several days or weeks) and splits them into
+    segments of fixed length, each processed as a
+    :class:`~obstools.atacr.classes.DayNoise` object. Windows slide
+    continuously over the whole span, including across midnight, such that
+    no data are lost at the boundaries between segments, and each window
+    belongs to the segment in which it starts. Segments are aligned on
+    midnight of the first day, such that with the default length of one
+    day the segments are the days of the span, which can be averaged into
+    a :class:`~obstools.atacr.classes.StaNoise` object as usual.
+
+    Note
+    ----
+    The traces of each segment are views of the traces of the span and
+    extend up to one window past the end of the segment. A span of exactly
+    one day gives the same windows, and therefore the same averaged
+    spectra, as a DayNoise object of that day. The `tkey` of each segment
+    is the day in which it starts (``year.julday``) if the segments are
+    whole days, and otherwise also includes the start time of the segment
+    (``year.julday.HHMMSS``), such that segments shorter than a day have
+    distinct keys in a :class:`~obstools.atacr.classes.StaNoise` object.
+    The traces must have been
+    processed as one continuous stream (see
+    :func:`~obstools.atacr.sds.SDSStation.get_span`): joining day-long
+    traces that were processed separately (e.g., the SAC files of the
+    download scripts) gives windows across midnight that contain the
+    tapered ends of both days.
+
+    Attributes
+    ----------
+    tr1, tr2, trZ, trP : :class:`~obspy.core.Trace` object
+        Corresponding trace objects for components H1, H2, HZ and HP.
+        Traces can be empty (i.e., ``Trace()``) for missing components.
+    window : float
+        Length of time window in seconds
+    overlap : float
+        Fraction of overlap between adjacent windows
+    key : str
+        Station key for current object
+    cadence : float
+        Length of the segments in seconds
+    onesided : bool
+        Whether the spectra of the segments are calculated for
+        non-negative frequencies only
+    streaming : bool
+        Whether the spectra of the segments are accumulated one chunk of
+        windows at a time
+    dt : float
+        Sampling distance in seconds. Obtained from ``trZ`` object
+    npts : int
+        Number of points in time series. Obtained from ``trZ`` object
+    fs : float
+        Sampling frequency (in Hz). Obtained from ``trZ`` object
+
+    Examples
+    --------
+
+    Calculate the daily spectra of a week of continuous data and average
+    them into a StaNoise object
+
+    >>> from obstools.atacr import SegmentNoise, StaNoise
+    >>> segnoise = SegmentNoise(tr1, tr2, trZ, trP, key='7D.M08A')
+    >>> stanoise = StaNoise()
+    >>> for daynoise in segnoise:
+    ...     daynoise.QC_daily_spectra()
+    ...     daynoise.average_daily_spectra()
+    ...     stanoise.append(daynoise)
+
+    """
+
+    def __init__(self, tr1=None, tr2=None, trZ=None, trP=None, window=7200.,
+                 overlap=0.3, key='', cadence=86400., onesided=False,
+                 streaming=False):
+
+        # Check that all traces are valid Trace objects
+        for tr in [tr1, tr2, trZ, trP]:
+            if not isinstance(tr, Trace):
+                raise(Exception("Error initializing SegmentNoise object - "
+                                + str(tr)+" is not a Trace object"))
+        if cadence <= 0.:
+            raise(Exception("Error initializing SegmentNoise object - " +
+                            "the length of the segments should be positive"))
+
+        # Unpack everything
+        self.tr1 = tr1
+        self.tr2 = tr2
+        self.trZ = trZ
+        self.trP = trP
+        self.window = window
+        self.overlap = overlap
+        self.key = key
+        self.cadence = cadence
+        self.onesided = onesided
+        self.streaming = streaming
+
+        # Get trace attributes
+        zstats = self.trZ.stats
+        self.dt = zstats.delta
+        self.npts = zstats.npts
+        self.fs = zstats.sampling_rate
+
+    def __iter__(self):
+
+        return self.segments()
+
+    def windows(self):
+        """
+        Method to get the start of all windows of the span, and the segment
+        in which each window starts.
+
+        Returns
+        -------
+        starts : :class:`~numpy.ndarray`
+            Index of the first point of each window
+        segs : :class:`~numpy.ndarray`
+            Index of the segment of each window, counted from midnight of
+            the first day
+
+        """
+
+        # Points in window and step between windows, as in DayNoise
+        ws = int(self.window/self.dt)
+        ss = int(self.window*self.overlap/self.dt)
+        starts = np.arange(0, self.npts - ws + 1, ws - ss)
+
+        # Integer nanoseconds, such that windows starting at the boundary
+        # of a segment are not assigned to the previous one
+        t0 = self.trZ.stats.starttime
+        offset = t0.ns - UTCDateTime(t0.date).ns
+        tns = offset + np.round(starts*self.dt*1.e9).astype(np.int64)
+        segs = tns // int(round(self.cadence*1.e9))
+
+        return starts, segs
+
+    def segments(self):
+        """
+        Generator of the segments of the span, as
+        :class:`~obstools.atacr.classes.DayNoise` objects whose windows are
+        the windows of the span that start within each segment, and whose
+        `year`, `julday` and `tkey` attributes refer to the start of the
+        segment. Segments without any window are skipped.
+
+        Yields
+        ------
+        daynoise : :class:`~obstools.atacr.classes.DayNoise`
+            DayNoise object of a segment, ready for the quality control and
+            averaging of its spectra
+
+        """
+
+        ws = int(self.window/self.dt)
+        starts, segs = self.windows()
+
+        def _slice(tr, i0, i1):
+            # Empty traces stay empty, other traces are sliced without copy
+            if tr.stats.npts == 0:
+                return Trace()
+            stats = tr.stats.copy()
+            stats.starttime = tr.stats.starttime + i0*tr.stats.delta
+            stats.npts = i1 - i0
+            return Trace(data=tr.data[i0:i1], header=stats)
+
+        t0 = UTCDateTime(self.trZ.stats.starttime.date)
+        for seg in np.unique(segs):
+            select = starts[segs == seg]
+            i0 = select[0]
+            i1 = select[-1] + ws
+            daynoise = DayNoise(
+                *[_slice(tr, i0, i1)
+                  for tr in [self.tr1, self.tr2, self.trZ, self.trP]],
+                window=self.window, overlap=self.overlap, key=self.key,
+                onesided=self.onesided, streaming=self.streaming)
+
+            # Key of the segment, from its start time
+            tseg = t0 + seg*self.cadence
+            daynoise.year = tseg.year
+            daynoise.julday = tseg.julday
+            daynoise.tkey = str(tseg.year) + '.' + str(tseg.julday)
+            if self.cadence % 86400. != 0.:
+                daynoise.tkey += '.' + tseg.strftime('%H%M%S')
+            yield daynoise
 
 
 class StaNoise(object):
@@ -877,6 +1382,19 @@ class StaNoise(object):
         Whether or not the object has been initialized - `False` unless one
         of the methods have been called. When `True`, the `daylist` attribute
         is deleted from memory
+    cube : str
+        File name of the memory-mapped spectral cube, or None. If given,
+        the averaged spectra of each
+        :class:`~obstools.atacr.classes.DayNoise` object are written to a
+        ``.npy`` array of shape (quantity, freq, day) on disk as soon as
+        the object is added, instead of keeping the `daylist` in memory.
+        The spectral attributes are then views into this cube, and the QC
+        and averaging methods process it in blocks of fixed size. Days are
+        added with `append()` or ``+=`` only: since they are not kept in
+        memory, the object cannot be iterated over, added with ``+`` or
+        used to `extend()` another object
+    ndays : int
+        Maximum number of days stored in the `cube`
 
     Examples
     --------
@@ -901,6 +1419,11 @@ class StaNoise(object):
     >>> stanoise = StaNoise()
     >>> stanoise.append(daynoise)
 
+    Accumulate the daily spectra into a memory-mapped cube on disk
+
+    >>> stanoise = StaNoise(cube='sta_cube.npy', ndays=365)
+    >>> stanoise += daynoise
+
     Import demo noise data with 4 DayNoise objects
 
     >>> from obstools.atacr import StaNoise
@@ -916,7 +1439,15 @@ class StaNoise(object):
 
     """
 
-    def __init__(self, daylist=None):
+    # Spectral quantities stored in the cube, in order
+    cube_quantities = ['c11', 'c22', 'cZZ', 'cPP', 'c12', 'c1Z', 'c1P',
+                       'c2Z', 'c2P', 'cZP', 'cHH', 'cHZ', 'cHP']
+
+    # Number of days buffered before writing to the cube, and number of
+    # days or frequencies processed at once when reading from it
+    cube_block = 64
+
+    def __init__(self, daylist=None, cube=None, ndays=None):
 
         def _load_dn(day):
             exmpl_path = Path(resource_filename('obstools', 'examples'))
@@ -936,6 +1467,19 @@ class StaNoise(object):
         self.initialized = False
         self.QC = False
         self.av = False
+        self.cube = None
+        self.incremental = False
+
+        if cube is not None:
+            if not ndays:
+                raise(Exception("The maximum number of days 'ndays' is " +
+                                "required to use a spectral cube"))
+            self.cube = str(cube)
+            self.ndays = int(ndays)
+            self._cube = None
+            self._buffer = []
+            self._nday = 0
+            self.nwins = []
 
         if isinstance(daylist, DayNoise):
             daylist = [daylist]
@@ -947,23 +1491,46 @@ class StaNoise(object):
         if not daylist == 'demo' and daylist:
             self.daylist.extend(daylist)
 
+        if self.cube is not None:
+            daylist = self.daylist
+            self.daylist = []
+            for dn in daylist:
+                self.append(dn)
+
     def __add__(self, other):
 
         if isinstance(other, DayNoise):
             other = StaNoise([other])
         if not isinstance(other, StaNoise):
             raise TypeError
+        if self.cube is not None or other.cube is not None:
+            raise TypeError("StaNoise objects with a spectral cube cannot " +
+                            "be added - use append() or +=")
         daylist = self.daylist + other.daylist
         return self.__class__(daylist=daylist)
 
+    def __iadd__(self, other):
+
+        if isinstance(other, DayNoise):
+            return self.append(other)
+        if not isinstance(other, StaNoise):
+            raise TypeError
+        return self.extend(other)
+
     def __iter__(self):
 
-        return List(self.daylist).__iter__()
+        if self.cube is not None:
+            raise TypeError("The DayNoise objects of a StaNoise object " +
+                            "with a spectral cube are not kept in memory")
+        return iter(self.daylist)
 
     def append(self, daynoise):
 
         if isinstance(daynoise, DayNoise):
-            self.daylist.append(daynoise)
+            if self.cube is not None:
+                self._cube_append(daynoise)
+            else:
+                self.daylist.append(daynoise)
         else:
             msg = 'Append only supports a single DayNoise object as argument'
             raise TypeError(msg)
@@ -977,9 +1544,15 @@ class StaNoise(object):
                 if not isinstance(_i, DayNoise):
                     msg = 'Extend only accepts a list of Daynoise objects.'
                     raise TypeError(msg)
-            self.daylist.extend(daynoise_list)
+            for dn in list(daynoise_list):
+                self.append(dn)
         elif isinstance(daynoise_list, StaNoise):
-            self.daylist.extend(daynoise_list.daylist)
+            if daynoise_list.cube is not None:
+                msg = 'Extend does not support a StaNoise object with a ' +\
+                    'spectral cube as argument.'
+                raise TypeError(msg)
+            for dn in list(daynoise_list.daylist):
+                self.append(dn)
         else:
             msg = 'Extend only supports a list of DayNoise objects as ' +\
                 'argument.'
@@ -1015,6 +1588,10 @@ class StaNoise(object):
         tf_list : Dict
             Dictionary of possible transfer functions given the available
             components.
+        onesided : bool
+            Whether the spectra are one-sided (True) or two-sided (False).
+            If any of the :class:`~obstools.atacr.classes.DayNoise` objects
+            is one-sided, all of them are converted to one-sided spectra
         c11 : `numpy.ndarray`
             Power spectra for component `H1`. Other identical attributes
             are available for
@@ -1057,6 +1634,10 @@ class StaNoise(object):
 
         """
 
+        if self.cube is not None:
+            self._cube_init()
+            return
+
         # First, check that the StaNoise object contains at least two
         # DayNoise objects
         if len(self.daylist) < 2:
@@ -1070,6 +1651,14 @@ class StaNoise(object):
             if not dn.av:
                 dn.average_daily_spectra()
 
+        # Convert to one-sided spectra if any of the DayNoise objects is
+        # one-sided
+        self.onesided = any(
+            [getattr(dn, 'onesided', False) for dn in self.daylist])
+        if self.onesided:
+            for dn in self.daylist:
+                utils.to_onesided(dn)
+
         # Then unpack the DayNoise objects
         self.c11 = np.array([dn.power.c11 for dn in self.daylist]).T
         self.c22 = np.array([dn.power.c22 for dn in self.daylist]).T
@@ -1091,6 +1680,18 @@ class StaNoise(object):
         self.ncomp = np.min([dn.ncomp for dn in self.daylist])
         self.key = self.daylist[0].key
 
+        self._set_tf_list()
+
+        # Remove DayNoise objects from memory
+        del self.daylist
+
+    def _set_tf_list(self):
+        """
+        Private method to build the list of available transfer functions
+        and reset the processing flags once the object is initialized.
+
+        """
+
         # Build list of available transfer functions for future use
         if self.ncomp == 2:
             self.tf_list = {'ZP': True, 'Z1': False, 'Z2-1': False,
@@ -1106,9 +1707,396 @@ class StaNoise(object):
         self.QC = False
         self.av = False
 
-        # Remove DayNoise objects from memory
+    def _cube_append(self, daynoise):
+        """
+        Private method to unpack the average spectra of a
+        :class:`~obstools.atacr.classes.DayNoise` object into the spectral
+        cube. Days are buffered in memory and written to disk in blocks of
+        `cube_block` days.
+
+        """
+
+        if self.initialized:
+            raise(Exception("Object has been initialized already - " +
+                            "DayNoise objects cannot be added"))
+        if self._nday + len(self._buffer) >= self.ndays:
+            raise(Exception("Spectral cube " + self.cube + " is full (" +
+                            str(self.ndays) + " days)"))
+
+        if not daynoise.QC:
+            daynoise.QC_daily_spectra()
+        if not daynoise.av:
+            daynoise.average_daily_spectra()
+
+        spectra = dict(vars(daynoise.power))
+        spectra.update(vars(daynoise.cross))
+        spectra.update(vars(daynoise.rotation))
+        spectra = {key: spectra[key] for key in self.cube_quantities
+                   if spectra.get(key) is not None}
+
+        if self._cube is None:
+            # The first day defines the frequency axis and metadata
+            self.onesided = getattr(daynoise, 'onesided', False)
+            self.f = daynoise.f
+            self.direc = daynoise.rotation.direc
+            self.tilt = daynoise.rotation.tilt
+            self.key = daynoise.key
+            self.ncomp = daynoise.ncomp
+            self._cube = np.lib.format.open_memmap(
+                self.cube, mode='w+',
+                dtype=np.result_type(np.complex64, *spectra.values()),
+                shape=(len(self.cube_quantities), len(self.f), self.ndays))
+        elif getattr(daynoise, 'onesided', False) != self.onesided:
+            if not self.onesided:
+                raise(Exception("Cannot add one-sided spectra to a " +
+                                "two-sided spectral cube"))
+            return self._cube_append(utils.to_onesided(daynoise))
+        self.ncomp = min(self.ncomp, daynoise.ncomp)
+
+        day = np.zeros(self._cube.shape[:2], dtype=self._cube.dtype)
+        for i, quantity in enumerate(self.cube_quantities):
+            if quantity in spectra:
+                day[i] = spectra[quantity]
+        self._buffer.append(day)
+        self.nwins.append(np.sum(daynoise.goodwins))
+
+        if len(self._buffer) == self.cube_block:
+            self._cube_flush()
+
+    def _cube_flush(self):
+        """
+        Private method to write the buffered days to the spectral cube.
+
+        """
+
+        if self._buffer:
+            nbuf = len(self._buffer)
+            self._cube[:, :, self._nday:self._nday + nbuf] = np.stack(
+                self._buffer, axis=-1)
+            self._nday += nbuf
+            self._buffer = []
+
+    def _cube_init(self):
+        """
+        Private method to initialize the object from the spectral cube. The
+        spectral attributes are views into the memory-mapped cube.
+
+        """
+
+        self._cube_flush()
+        if self._nday < 2:
+            raise(Exception(
+                "StaNoise requires at least two DayNoise objects to execute " +
+                "its methods"))
+        self._cube.flush()
+
+        cube = self._cube[:, :, 0:self._nday]
+        for i, quantity in enumerate(self.cube_quantities):
+            if quantity in ['c11', 'c22', 'cZZ', 'cPP', 'cHH']:
+                setattr(self, quantity, cube[i].real)
+            else:
+                setattr(self, quantity, cube[i])
+        self.nwins = np.array(self.nwins)
+
+        self._set_tf_list()
+
+        # Remove (empty) list of DayNoise objects
         del self.daylist
 
+    def _quantities(self):
+        """
+        Private method to list the spectral quantities that are available
+        for the number of components of the object.
+
+        """
+
+        if self.ncomp == 2:
+            return ['cZZ', 'cPP', 'cZP']
+        elif self.ncomp == 3:
+            return ['c11', 'c22', 'cZZ', 'c12', 'c1Z', 'c2Z', 'cHH', 'cHZ']
+        else:
+            return list(self.cube_quantities)
+
+    def _set_average(self, spectra):
+        """
+        Private method to store the average spectra (dictionary of
+        quantities) in the `power`, `cross` and `rotation` containers.
+
+        """
+
+        av = dict.fromkeys(self.cube_quantities)
+        av.update(spectra)
+        self.power = Power(av['c11'], av['c22'], av['cZZ'], av['cPP'])
+        self.cross = Cross(av['c12'], av['c1Z'], av['c1P'], av['c2Z'],
+                           av['c2P'], av['cZP'])
+        self.rotation = Rotation(av['cHH'], av['cHZ'], av['cHP'])
+
+    def update(self, daynoise, pd=[0.004, 0.2], tol=2.0, alpha=0.05):
+        """
+        Method to add :class:`~obstools.atacr.classes.DayNoise` objects to
+        the station average without reprocessing the spectra of the
+        previous days. The object keeps the daily spectra, running sums of
+        the spectra over good days (weighted by their number of good
+        windows) and, as quality control state, the de-meaned log PSDs of
+        each day within the passband. Each call repeats the quality control
+        of all days on the stored log PSDs, which costs O(ndays*nband), and
+        corrects the running sums for the days whose status has changed.
+        Many days should therefore be added in a single call (e.g., from a
+        generator, such that only one DayNoise object is held in memory at
+        a time), as the quality control is then only repeated once. The
+        resulting `gooddays`, `power`, `cross` and `rotation` attributes are
+        the same as with
+        :func:`~obstools.atacr.classes.StaNoise.QC_sta_spectra` and
+        :func:`~obstools.atacr.classes.StaNoise.average_sta_spectra`.
+
+        Parameters
+        ----------
+        daynoise : :class:`~obstools.atacr.classes.DayNoise` or iterable
+            Daily spectra to add, as a single object or an iterable of
+            objects
+        pd : list
+            Frequency corners of passband for calculating the spectra
+        tol : float
+            Tolerance threshold. If spectrum > std*tol, window is flagged as
+            bad
+        alpha : float
+            Confidence interval for f-test
+
+        Attributes
+        ----------
+        incremental : bool
+            Whether the object is updated incrementally (True)
+        tkeys : list
+            Keys (year.julday) of the days in the station average
+        gooddays : :class:`~numpy.ndarray`
+            Array of booleans representing whether a day is good (True) or
+            not (False)
+        stamps : dict
+            Modification stamps of the files of the days, keyed by day, as
+            set by the caller (e.g., by ``atacr_clean_spectra`` to find the
+            days whose spectra were calculated again)
+
+        Examples
+        --------
+        Build the station average, then add and remove days
+
+        >>> from obstools.atacr import StaNoise
+        >>> daylist = list(StaNoise('demo'))
+        Uploading demo data - March 01 to 04, 2012, station 7D.M08A
+        >>> stanoise = StaNoise()
+        >>> stanoise.update(daylist[:3])
+        >>> stanoise.update(daylist[3])
+        >>> stanoise.tkeys
+        ['2012.61', '2012.62', '2012.63', '2012.64']
+        >>> stanoise.remove('2012.61')
+
+        """
+
+        if self.cube is not None:
+            raise(Exception("Incremental updates are not available with " +
+                            "a spectral cube"))
+
+        qc_params = [list(pd), tol, alpha]
+        if not getattr(self, 'incremental', False):
+            if self.initialized:
+                raise(Exception("Object has been initialized already - " +
+                                "it cannot be updated incrementally"))
+            daylist = self.daylist
+            del self.daylist
+            self.incremental = True
+            self.qc_params = qc_params
+            self.tkeys = []
+            self.nwins = np.array([], dtype=int)
+            self.gooddays = np.array([], dtype=bool)
+            self._ncomps = []
+            self._spectra = []
+            self._dsl = []
+            self._sums = {}
+            self._wsum = 0
+            self._nsub = 0
+            self.stamps = {}
+            for dn in daylist:
+                self._absorb(dn)
+
+        elif qc_params != self.qc_params:
+            # New quality control parameters: recompute the log PSDs
+            self.qc_params = qc_params
+            self._dsl = [self._day_dsl(spectra) for spectra in self._spectra]
+
+        if isinstance(daynoise, DayNoise):
+            daynoise = [daynoise]
+        for dn in daynoise:
+            self._absorb(dn)
+        self._refresh()
+
+    def remove(self, tkey):
+        """
+        Method to remove days from a station average that is updated
+        incrementally (see :func:`~obstools.atacr.classes.StaNoise.update`).
+        The quality control is repeated once per call.
+
+        Parameters
+        ----------
+        tkey : str or list of str
+            Key(s) (year.julday) of the day(s) to remove, as in the `tkey`
+            attribute of :class:`~obstools.atacr.classes.DayNoise`
+
+        """
+
+        if not getattr(self, 'incremental', False):
+            raise(Exception("Days can only be removed from an object that " +
+                            "is updated incrementally"))
+        tkeys = [tkey] if isinstance(tkey, str) else list(tkey)
+        for tkey in tkeys:
+            if tkey not in self.tkeys:
+                raise(Exception("Day " + str(tkey) + " is not in the " +
+                                "station average"))
+
+        for tkey in tkeys:
+            iday = self.tkeys.index(tkey)
+            if self.gooddays[iday]:
+                self._accumulate(iday, -1)
+            del self.tkeys[iday]
+            del self._ncomps[iday]
+            del self._spectra[iday]
+            del self._dsl[iday]
+            self.nwins = np.delete(self.nwins, iday)
+            self.gooddays = np.delete(self.gooddays, iday)
+            getattr(self, 'stamps', {}).pop(tkey, None)
+        if self._ncomps:
+            self.ncomp = min(self._ncomps)
+
+        self._refresh()
+
+    def _day_dsl(self, spectra):
+        """
+        Private method to calculate the de-meaned, smoothed log PSDs of a
+        single day within the passband, as in
+        :func:`~obstools.atacr.classes.StaNoise.QC_sta_spectra`.
+
+        """
+
+        pd = self.qc_params[0]
+        ff = (self.f > pd[0]) & (self.f < pd[1])
+        dsl = {}
+        for comp in ['c11', 'c22', 'cZZ', 'cPP']:
+            if comp in spectra:
+                sl = utils.smooth(np.log(spectra[comp]), 50)
+                dsl[comp] = sl[ff] - np.mean(sl[ff])
+
+        return dsl
+
+    def _absorb(self, daynoise):
+        """
+        Private method to store the spectra and quality control state of a
+        new day. The day is added to the running sums by
+        :func:`~obstools.atacr.classes.StaNoise._refresh` if it is good.
+
+        """
+
+        if not daynoise.QC:
+            daynoise.QC_daily_spectra()
+        if not daynoise.av:
+            daynoise.average_daily_spectra()
+        if daynoise.tkey in self.tkeys:
+            raise(Exception("Day " + daynoise.tkey + " is already in the " +
+                            "station average"))
+
+        if not self.tkeys:
+            self.onesided = getattr(daynoise, 'onesided', False)
+            self.f = daynoise.f
+            self.direc = daynoise.rotation.direc
+            self.tilt = daynoise.rotation.tilt
+            self.key = daynoise.key
+        elif getattr(daynoise, 'onesided', False) != self.onesided:
+            if not self.onesided:
+                raise(Exception("Cannot add one-sided spectra to a " +
+                                "two-sided station average"))
+            utils.to_onesided(daynoise)
+        self.ncomp = min(self._ncomps + [daynoise.ncomp])
+
+        spectra = dict(vars(daynoise.power))
+        spectra.update(vars(daynoise.cross))
+        spectra.update(vars(daynoise.rotation))
+        spectra = {key: spectra[key] for key in self.cube_quantities
+                   if spectra.get(key) is not None}
+        missing = [key for key in self._quantities() if key not in spectra]
+        if missing:
+            raise(Exception("Day " + daynoise.tkey + " is missing spectra " +
+                            ", ".join(missing)))
+
+        self.tkeys.append(daynoise.tkey)
+        self.nwins = np.append(self.nwins, np.sum(daynoise.goodwins))
+        self.gooddays = np.append(self.gooddays, False)
+        self._ncomps.append(daynoise.ncomp)
+        self._spectra.append(spectra)
+        self._dsl.append(self._day_dsl(spectra))
+
+    def _accumulate(self, iday, sign):
+        """
+        Private method to add (`sign=1`) or subtract (`sign=-1`) the spectra
+        of a day to the running sums, weighted by its number of windows.
+
+        """
+
+        weight = sign*self.nwins[iday]
+        for key, spectrum in self._spectra[iday].items():
+            if key in self._sums:
+                self._sums[key] += weight*spectrum
+            else:
+                self._sums[key] = weight*spectrum
+        self._wsum += weight
+        if sign < 0:
+            self._nsub = getattr(self, '_nsub', 0) + 1
+
+    def _refresh(self):
+        """
+        Private method to repeat the quality control on the stored log PSDs,
+        correct the running sums for days whose status has changed and
+        update the average spectra. The running sums are recomputed from
+        the daily spectra when the status of more than a few days changes,
+        or after a number of subtractions, such that rounding errors do not
+        accumulate.
+
+        """
+
+        self.initialized = True
+        self.QC = False
+        self.av = False
+        if not self.tkeys:
+            self._sums = {}
+            self._wsum = 0
+            self._nsub = 0
+            return
+
+        comps = [comp for comp in ['c11', 'c22', 'cZZ', 'cPP']
+                 if comp in self._quantities()]
+        if len(self.tkeys) < 2:
+            gooddays = np.ones(len(self.tkeys), dtype=bool)
+        else:
+            dsls = [np.array([dsl[comp] for dsl in self._dsl]).T
+                    for comp in comps]
+            gooddays, diagnostics = utils.QC_outliers(
+                dsls, tol=self.qc_params[1], alpha=self.qc_params[2])
+
+        changed = np.flatnonzero(gooddays != self.gooddays)
+        if len(changed) > 4 or getattr(self, '_nsub', 0) > 16:
+            self._sums = {}
+            self._wsum = 0
+            for iday in np.flatnonzero(gooddays):
+                self._accumulate(iday, 1)
+            self._nsub = 0
+        else:
+            for iday in changed:
+                self._accumulate(iday, 1 if gooddays[iday] else -1)
+        self.gooddays = gooddays
+
+        self._set_average({key: self._sums[key]/self._wsum
+                           for key in self._quantities()})
+        self._set_tf_list()
+        self.QC = True
+        self.av = True
+
     def QC_sta_spectra(self, pd=[0.004, 0.2], tol=2.0, alpha=0.05,
                        fig_QC=False, debug=False, save=None, form='png'):
         """
@@ -1168,116 +2156,61 @@ class StaNoise(object):
         # Extract only positive frequencies
         faxis = self.f > 0
 
-        # Smooth out the log of the PSDs
-        sl_cZZ = None
-        sl_c11 = None
-        sl_c22 = None
-        sl_cPP = None
-        sl_cZZ = utils.smooth(np.log(self.cZZ), 50, axis=0)
-        if self.ncomp == 2 or self.ncomp == 4:
-            sl_cPP = utils.smooth(np.log(self.cPP), 50, axis=0)
-        if self.ncomp == 3 or self.ncomp == 4:
-            sl_c11 = utils.smooth(np.log(self.c11), 50, axis=0)
-            sl_c22 = utils.smooth(np.log(self.c22), 50, axis=0)
-
-        # Remove mean of the log PSDs
-        dsl_cZZ = sl_cZZ[ff, :] - np.mean(sl_cZZ[ff, :], axis=0)
+        # Smooth out the log of the PSDs and remove their mean, in blocks of
+        # days so that the spectra of the cube are never loaded at once.
+        # The smoothed PSDs themselves are only kept for the figures
         if self.ncomp == 2:
-            dsl_cPP = sl_cPP[ff, :] - np.mean(sl_cPP[ff, :], axis=0)
-            dsls = [dsl_cZZ, dsl_cPP]
+            comps = ['cZZ', 'cPP']
         elif self.ncomp == 3:
-            dsl_c11 = sl_c11[ff, :] - np.mean(sl_c11[ff, :], axis=0)
-            dsl_c22 = sl_c22[ff, :] - np.mean(sl_c22[ff, :], axis=0)
-            dsls = [dsl_c11, dsl_c22, dsl_cZZ]
+            comps = ['c11', 'c22', 'cZZ']
         else:
-            dsl_c11 = sl_c11[ff, :] - np.mean(sl_c11[ff, :], axis=0)
-            dsl_c22 = sl_c22[ff, :] - np.mean(sl_c22[ff, :], axis=0)
-            dsl_cPP = sl_cPP[ff, :] - np.mean(sl_cPP[ff, :], axis=0)
-            dsls = [dsl_c11, dsl_c22, dsl_cZZ, dsl_cPP]
+            comps = ['c11', 'c22', 'cZZ', 'cPP']
+        keep = fig_QC or debug
+        ndays = len(self.nwins)
+        dsls = []
+        sls = {'c11': None, 'c22': None, 'cZZ': None, 'cPP': None}
+        for comp in comps:
+            cxx = getattr(self, comp)
+            dsl = np.empty((np.sum(ff), ndays))
+            if keep:
+                sls[comp] = np.empty((len(self.f), ndays))
+            for d0 in range(0, ndays, self.cube_block):
+                d1 = min(d0 + self.cube_block, ndays)
+                sl = utils.smooth(np.log(cxx[:, d0:d1]), 50, axis=0)
+                dsl[:, d0:d1] = sl[ff, :] - np.mean(sl[ff, :], axis=0)
+                if keep:
+                    sls[comp][:, d0:d1] = sl
+            dsls.append(dsl)
 
-        if self.ncomp == 2:
+        if debug:
+            colors = {'c11': 'r', 'c22': 'b', 'cZZ': 'g', 'cPP': 'k'}
             plt.figure(2)
-            plt.subplot(2, 1, 1)
-            plt.semilogx(self.f[faxis], sl_cZZ[faxis], 'g', lw=0.5)
-            plt.subplot(2, 1, 2)
-            plt.semilogx(self.f[faxis], sl_cPP[faxis], 'k', lw=0.5)
+            for i, comp in enumerate(comps):
+                plt.subplot(len(comps), 1, i+1)
+                plt.semilogx(self.f[faxis], sls[comp][faxis],
+                             colors[comp], lw=0.5)
             plt.tight_layout()
-        elif self.ncomp == 3:
-            plt.figure(2)
-            plt.subplot(3, 1, 1)
-            plt.semilogx(self.f[faxis], sl_c11[faxis], 'r', lw=0.5)
-            plt.subplot(3, 1, 2)
-            plt.semilogx(self.f[faxis], sl_c22[faxis], 'b', lw=0.5)
-            plt.subplot(3, 1, 3)
-            plt.semilogx(self.f[faxis], sl_cZZ[faxis], 'g', lw=0.5)
-            plt.tight_layout()
-        else:
-            plt.figure(2)
-            plt.subplot(4, 1, 1)
-            plt.semilogx(self.f[faxis], sl_c11[faxis], 'r', lw=0.5)
-            plt.subplot(4, 1, 2)
-            plt.semilogx(self.f[faxis], sl_c22[faxis], 'b', lw=0.5)
-            plt.subplot(4, 1, 3)
-            plt.semilogx(self.f[faxis], sl_cZZ[faxis], 'g', lw=0.5)
-            plt.subplot(4, 1, 4)
-            plt.semilogx(self.f[faxis], sl_cPP[faxis], 'k', lw=0.5)
-            plt.tight_layout()
-        if debug:
             plt.show()
 
-        # Cycle through to kill high-std-norm windows
-        moveon = False
-        gooddays = np.repeat([True], self.cZZ.shape[1])
-        indwin = np.argwhere(gooddays == True)
-
-        while moveon == False:
-            ubernorm = np.empty((self.ncomp, np.sum(gooddays)))
-            for ind_u, dsl in enumerate(dsls):
-                normvar = np.zeros(np.sum(gooddays))
-                for ii, tmp in enumerate(indwin):
-                    ind = np.copy(indwin)
-                    ind = np.delete(ind, ii)
-                    normvar[ii] = norm(np.std(dsl[:, ind], axis=1), ord=2)
-                ubernorm[ind_u, :] = np.median(normvar) - normvar
-
-            penalty = np.sum(ubernorm, axis=0)
-
-            plt.figure(4)
-            for i in range(self.ncomp):
-                plt.plot(range(0, np.sum(gooddays)), detrend(
-                    ubernorm, type='constant')[i], 'o-')
-            if debug:
+        # Cycle through to kill high-std-norm days
+        gooddays, diagnostics = utils.QC_outliers(dsls, tol=tol, alpha=alpha)
+
+        if debug:
+            for ubernorm, penalty in diagnostics:
+                plt.figure(4)
+                for i in range(self.ncomp):
+                    plt.plot(range(0, len(penalty)), detrend(
+                        ubernorm, type='constant')[i], 'o-')
                 plt.show()
-            else:
-                plt.close(4)
-            plt.figure(5)
-            plt.plot(range(0, np.sum(gooddays)),
-                     np.sum(ubernorm, axis=0), 'o-')
-            if debug:
+                plt.figure(5)
+                plt.plot(range(0, len(penalty)), penalty, 'o-')
                 plt.show()
-            else:
-                plt.close(5)
-
-            kill = penalty > tol*np.std(penalty)
-            if np.sum(kill) == 0:
-                self.gooddays = gooddays
-                self.QC = True
-                moveon = True
-
-            trypenalty = penalty[np.argwhere(kill == False)].T[0]
-
-            if utils.ftest(penalty, 1, trypenalty, 1) < alpha:
-                gooddays[indwin[kill == True]] = False
-                indwin = np.argwhere(gooddays == True)
-                moveon = False
-            else:
-                moveon = True
 
         self.gooddays = gooddays
         self.QC = True
 
         if fig_QC:
-            power = Power(sl_c11, sl_c22, sl_cZZ, sl_cPP)
+            power = Power(sls['c11'], sls['c22'], sls['cZZ'], sls['cPP'])
             plot = plotting.fig_QC(self.f, power, gooddays,
                                    self.ncomp, key=self.key)
             if save:
@@ -1331,83 +2264,18 @@ class StaNoise(object):
                 "using default values")
             self.QC_sta_spectra()
 
-        # Power spectra
-        c11 = None
-        c22 = None
-        cZZ = None
-        cPP = None
-        cZZ = np.sum(self.cZZ[:, self.gooddays]*self.nwins[self.gooddays],
-                     axis=1)/np.sum(self.nwins[self.gooddays])
-        if self.ncomp == 2 or self.ncomp == 4:
-            cPP = np.sum(self.cPP[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-        if self.ncomp == 3 or self.ncomp == 4:
-            c11 = np.sum(self.c11[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-            c22 = np.sum(self.c22[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
+        # Average spectra of good days
+        self._set_average({key: self._average_days(
+            getattr(self, key), self.gooddays) for key in self._quantities()})
 
         # Bad days - for plotting
-        bc11 = None
-        bc22 = None
-        bcZZ = None
-        bcPP = None
+        bad = {}
         if np.sum(~self.gooddays) > 0:
-            bcZZ = np.sum(
-                self.cZZ[:, ~self.gooddays]*self.nwins[~self.gooddays],
-                axis=1)/np.sum(self.nwins[~self.gooddays])
-            if self.ncomp == 2 or self.ncomp == 4:
-                bcPP = np.sum(
-                    self.cPP[:, ~self.gooddays]*self.nwins[~self.gooddays],
-                    axis=1)/np.sum(self.nwins[~self.gooddays])
-            if self.ncomp == 3 or self.ncomp == 4:
-                bc11 = np.sum(
-                    self.c11[:, ~self.gooddays]*self.nwins[~self.gooddays],
-                    axis=1)/np.sum(self.nwins[~self.gooddays])
-                bc22 = np.sum(
-                    self.c22[:, ~self.gooddays]*self.nwins[~self.gooddays],
-                    axis=1)/np.sum(self.nwins[~self.gooddays])
-
-        # Cross spectra
-        c12 = None
-        c1Z = None
-        c2Z = None
-        c1P = None
-        c2P = None
-        cZP = None
-        if self.ncomp == 3 or self.ncomp == 4:
-            c12 = np.sum(self.c12[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-            c1Z = np.sum(self.c1Z[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-            c2Z = np.sum(self.c2Z[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-        if self.ncomp == 4:
-            c1P = np.sum(self.c1P[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-            c2P = np.sum(self.c2P[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-        if self.ncomp == 2 or self.ncomp == 4:
-            cZP = np.sum(self.cZP[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-
-        # Rotated component
-        cHH = None
-        cHZ = None
-        cHP = None
-        if self.ncomp == 3 or self.ncomp == 4:
-            cHH = np.sum(self.cHH[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-            cHZ = np.sum(self.cHZ[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-        if self.ncomp == 4:
-            cHP = np.sum(self.cHP[:, self.gooddays]*self.nwins[self.gooddays],
-                         axis=1)/np.sum(self.nwins[self.gooddays])
-
-        self.power = Power(c11, c22, cZZ, cPP)
-        self.cross = Cross(c12, c1Z, c1P, c2Z, c2P, cZP)
-        self.rotation = Rotation(cHH, cHZ, cHP)
-        bad = Power(bc11, bc22, bcZZ, bcPP)
+            bad = {key: self._average_days(getattr(self, key), ~self.gooddays)
+                   for key in ['c11', 'c22', 'cZZ', 'cPP']
+                   if key in self._quantities()}
+        bad = Power(bad.get('c11'), bad.get('c22'), bad.get('cZZ'),
+                    bad.get('cPP'))
 
         if fig_average:
             plot = plotting.fig_average(
@@ -1424,14 +2292,40 @@ class StaNoise(object):
 
         self.av = True
 
-    def save(self, filename):
+    def _average_days(self, cxx, days):
         """
-        Method to save the object to file using `~Pickle`.
+        Private method to average the daily spectra `cxx` over the selected
+        `days`, weighted by their number of good windows. The sum is carried
+        out in blocks of frequencies to bound memory use when `cxx` is a view
+        into the spectral cube.
+
+        """
+
+        nwins = self.nwins[days]
+        nf = self.cube_block*16
+        av = [np.sum(cxx[i:i + nf][:, days]*nwins, axis=1)
+              for i in range(0, cxx.shape[0], nf)]
+
+        return np.concatenate(av)/np.sum(nwins)
+
+    def save(self, filename, form='pkl', state=False):
+        """
+        Method to save the object to file using `~Pickle` or the binary
+        store format of :mod:`~obstools.atacr.store`.
 
         Parameters
         ----------
         filename : str
             File name
+        form : str, optional
+            File format, either 'pkl' (pickle) or 'spec' (binary store, which
+            can be memory mapped when loaded with
+            :func:`~obstools.atacr.store.load`)
+        state : bool, optional
+            For objects updated incrementally, whether to keep the daily
+            spectra, running sums and quality control state, so that the
+            loaded object can be updated further. Otherwise, they are
+            removed to save disk space
 
         Examples
         --------
@@ -1460,21 +2354,41 @@ class StaNoise(object):
             print("Warning: saving before having calculated the average " +
                   "spectra")
 
-        # Remove traces to save disk space
-        del self.c11
-        del self.c22
-        del self.cZZ
-        del self.cPP
-        del self.c12
-        del self.c1Z
-        del self.c1P
-        del self.c2Z
-        del self.c2P
-        del self.cZP
-
-        file = open(filename, 'wb')
-        pickle.dump(self, file)
-        file.close()
+        if getattr(self, 'incremental', False):
+            # Remove daily spectra to save disk space
+            if not state:
+                del self._spectra
+                del self._dsl
+                del self._sums
+                self.incremental = False
+        else:
+            # Remove traces to save disk space
+            del self.c11
+            del self.c22
+            del self.cZZ
+            del self.cPP
+            del self.c12
+            del self.c1Z
+            del self.c1P
+            del self.c2Z
+            del self.c2P
+            del self.cZP
+
+        # The spectral cube remains on disk
+        if self.cube is not None:
+            del self._cube
+            del self._buffer
+
+        # Partial spectra are recalculated when needed
+        if hasattr(self, '_partial'):
+            del self._partial
+
+        if form == 'spec':
+            store.save(self, filename)
+        else:
+            file = open(filename, 'wb')
+            pickle.dump(self, file)
+            file.close()
 
 
 class TFNoise(object):
@@ -1505,6 +2419,9 @@ class TFNoise(object):
     tf_list : Dict
         Dictionary of possible transfer functions given the available
         components.
+    onesided : bool
+        Whether the spectra and transfer functions are one-sided (True) or
+        two-sided (False)
 
     Examples
     --------
@@ -1571,6 +2488,8 @@ class TFNoise(object):
         self.cZP = objnoise.cross.cZP
         self.tilt = objnoise.rotation.tilt
         self.tf_list = objnoise.tf_list
+        self.onesided = getattr(objnoise, 'onesided', False)
+        self._partial = PartialSpectra.of(objnoise)
 
     class TfDict(dict):
 
@@ -1622,74 +2541,48 @@ class TFNoise(object):
 
         transfunc = self.TfDict()
 
+        # Conditioned spectra, shared with other objects initialized from
+        # the same noise object
+        partial = PartialSpectra.of(self)
+
         for key, value in self.tf_list.items():
 
             if key == 'ZP':
                 if value:
-                    tf_ZP = {'TF_ZP': self.cZP/self.cPP}
+                    tf_ZP = {'TF_ZP': partial.gain('P', 'Z')}
                     transfunc.add('ZP', tf_ZP)
 
             elif key == 'Z1':
                 if value:
-                    tf_Z1 = {'TF_Z1': np.conj(self.c1Z)/self.c11}
+                    tf_Z1 = {'TF_Z1': partial.gain('1', 'Z')}
                     transfunc.add('Z1', tf_Z1)
 
             elif key == 'Z2-1':
                 if value:
-                    lc1c2 = np.conj(self.c12)/self.c11
-                    coh_12 = utils.coherence(self.c12, self.c11, self.c22)
-                    gc2c2_c1 = self.c22*(1. - coh_12)
-                    gc2cZ_c1 = np.conj(self.c2Z) - np.conj(lc1c2*self.c1Z)
-                    lc2cZ_c1 = gc2cZ_c1/gc2c2_c1
-                    tf_Z2_1 = {'TF_21': lc1c2, 'TF_Z2-1': lc2cZ_c1}
+                    tf_Z2_1 = {'TF_21': partial.gain('1', '2'),
+                               'TF_Z2-1': partial.gain('2', 'Z', ('1',))}
                     transfunc.add('Z2-1', tf_Z2_1)
 
             elif key == 'ZP-21':
                 if value:
-                    lc1cZ = np.conj(self.c1Z)/self.c11
-                    lc1c2 = np.conj(self.c12)/self.c11
-                    lc1cP = np.conj(self.c1P)/self.c11
-
-                    coh_12 = utils.coherence(self.c12, self.c11, self.c22)
-                    coh_1P = utils.coherence(self.c1P, self.c11, self.cPP)
-
-                    gc2c2_c1 = self.c22*(1. - coh_12)
-                    gcPcP_c1 = self.cPP*(1. - coh_1P)
-
-                    gc2cZ_c1 = np.conj(self.c2Z) - np.conj(lc1c2*self.c1Z)
-                    gcPcZ_c1 = self.cZP - np.conj(lc1cP*self.c1Z)
-
-                    gc2cP_c1 = np.conj(self.c2P) - np.conj(lc1c2*self.c1P)
-
-                    lc2cP_c1 = gc2cP_c1/gc2c2_c1
-                    lc2cZ_c1 = gc2cZ_c1/gc2c2_c1
-
-                    coh_c2cP_c1 = utils.coherence(gc2cP_c1, gc2c2_c1,
-                                                  gcPcP_c1)
-
-                    gcPcP_c1c2 = gcPcP_c1*(1. - coh_c2cP_c1)
-                    gcPcZ_c1c2 = gcPcZ_c1 - np.conj(lc2cP_c1)*gc2cZ_c1
-
-                    lcPcZ_c2c1 = gcPcZ_c1c2/gcPcP_c1c2
-
-                    tf_ZP_21 = {'TF_Z1': lc1cZ, 'TF_21': lc1c2,
-                                'TF_P1': lc1cP, 'TF_P2-1': lc2cP_c1,
-                                'TF_Z2-1': lc2cZ_c1, 'TF_ZP-21': lcPcZ_c2c1}
+                    tf_ZP_21 = {'TF_Z1': partial.gain('1', 'Z'),
+                                'TF_21': partial.gain('1', '2'),
+                                'TF_P1': partial.gain('1', 'P'),
+                                'TF_P2-1': partial.gain('2', 'P', ('1',)),
+                                'TF_Z2-1': partial.gain('2', 'Z', ('1',)),
+                                'TF_ZP-21': partial.gain('P', 'Z',
+                                                         ('1', '2'))}
                     transfunc.add('ZP-21', tf_ZP_21)
 
             elif key == 'ZH':
                 if value:
-                    tf_ZH = {'TF_ZH': np.conj(self.cHZ)/self.cHH}
+                    tf_ZH = {'TF_ZH': partial.gain('H', 'Z')}
                     transfunc.add('ZH', tf_ZH)
 
             elif key == 'ZP-H':
                 if value:
-                    lcHcP = np.conj(self.cHP)/self.cHH
-                    coh_HP = utils.coherence(self.cHP, self.cHH, self.cPP)
-                    gcPcP_cH = self.cPP*(1. - coh_HP)
-                    gcPcZ_cH = self.cZP - np.conj(lcHcP*self.cHZ)
-                    lcPcZ_cH = gcPcZ_cH/gcPcP_cH
-                    tf_ZP_H = {'TF_PH': lcHcP, 'TF_ZP-H': lcPcZ_cH}
+                    tf_ZP_H = {'TF_PH': partial.gain('H', 'P'),
+                               'TF_ZP-H': partial.gain('P', 'Z', ('H',))}
                     transfunc.add('ZP-H', tf_ZP_H)
 
             else:
@@ -1697,14 +2590,19 @@ class TFNoise(object):
 
             self.transfunc = transfunc
 
-    def save(self, filename):
+    def save(self, filename, form='pkl'):
         """
-        Method to save the object to file using `~Pickle`.
+        Method to save the object to file using `~Pickle` or the binary
+        store format of :mod:`~obstools.atacr.store`.
 
         Parameters
         ----------
         filename : str
             File name
+        form : str, optional
+            File format, either 'pkl' (pickle) or 'spec' (binary store, which
+            can be memory mapped when loaded with
+            :func:`~obstools.atacr.store.load`)
 
         Examples
         --------
@@ -1758,9 +2656,13 @@ class TFNoise(object):
         del self.c2Z
         del self.c2P
         del self.cZP
-        file = open(filename, 'wb')
-        pickle.dump(self, file)
-        file.close()
+        del self._partial
+        if form == 'spec':
+            store.save(self, filename)
+        else:
+            file = open(filename, 'wb')
+            pickle.dump(self, file)
+            file.close()
 
 
 class EventStream(object):
@@ -1953,6 +2855,12 @@ class EventStream(object):
            :align: center
 
 
+        .. note::
+            If the transfer functions are one-sided (see
+            :class:`~obstools.atacr.classes.DayNoise`), the corrections are
+            carried out with real-input FFTs over non-negative frequencies
+            only.
+
         .. warning::
             If the noise window and event window are not identical, they cannot
             be compared on the same frequency axis and the code will exit. Make
@@ -1961,122 +2869,135 @@ class EventStream(object):
 
         """
 
+        self.correct_events([self], tfnoise)
+
+    @staticmethod
+    def correct_events(evstreams, tfnoise, nchunk=8):
+        """
+        Method to apply the transfer functions of a single
+        :class:`~obstools.atacr.classes.TFNoise` object to a list of
+        :class:`~obstools.atacr.classes.EventStream` objects at once. Events
+        are grouped by window length, sampling and available components.
+        For each group, in chunks of `nchunk` events, the Fourier transforms
+        are carried out on stacked arrays and the terms that are shared by
+        several corrections (e.g., the horizontal component H2 cleaned from
+        H1, or the rotated horizontal component) are only computed once (see
+        :func:`~obstools.atacr.utils.correct_spectra`). The `correct`
+        attribute of each object is the same as obtained with
+        :func:`~obstools.atacr.classes.EventStream.correct_data`.
+
+        Parameters
+        ----------
+        evstreams : list
+            List of :class:`~obstools.atacr.classes.EventStream` objects
+        tfnoise : :class:`~obstools.atacr.classes.TFNoise`
+            Object that contains the noise transfer functions used in the
+            correction
+        nchunk : int, optional
+            Number of events transformed at once, which bounds memory use
+            for long catalogues
+
+        Examples
+        --------
+
+        Following from the example outlined in method
+        :func:`~obstools.atacr.classes.EventStream.correct_data`
+
+        >>> from obstools.atacr import EventStream
+        >>> evstreams = [EventStream('demo'), EventStream('demo')]
+        Uploading demo earthquake data - March 09, 2012, station 7D.M08A
+        Uploading demo earthquake data - March 09, 2012, station 7D.M08A
+        >>> EventStream.correct_events(evstreams, tfnoise_sta)
+
+        """
+
         if not tfnoise.transfunc:
             raise(
                 Exception("Error: Object TFNoise has no transfunc " +
                           "attribute - aborting"))
 
-        correct = self.CorrectDict()
-
-        # Extract list and transfer functions available
-        tf_list = tfnoise.tf_list
-        transfunc = tfnoise.transfunc
+        # One-sided transfer functions only require the non-negative
+        # frequencies of the real-valued traces
+        onesided = getattr(tfnoise, 'onesided', False)
 
-        # Extract traces
-        trZ = self.trZ
-        tr1 = self.tr1
-        tr2 = self.tr2
-        trP = self.trP
+        groups = {}
+        for evstream in evstreams:
+            groups.setdefault(
+                (evstream.npts, evstream.dt, evstream.ncomp), []).append(
+                    evstream)
 
-        # Get Fourier spectra
-        ft1 = None
-        ft2 = None
-        ftZ = None
-        ftP = None
+        chunks = []
+        for (npts, dt, ncomp), group in groups.items():
+            for i in range(0, len(group), nchunk):
+                chunks.append((npts, dt, ncomp, group[i:i + nchunk]))
 
-        ft1 = None
-        ft2 = None
-        ftZ = None
-        ftP = None
+        for npts, dt, ncomp, group in chunks:
 
-        ftZ = np.fft.fft(trZ, n=self.npts)
-        if self.ncomp == 2 or self.ncomp == 4:
-            ftP = np.fft.fft(trP, n=self.npts)
-        if self.ncomp == 3 or self.ncomp == 4:
-            ft1 = np.fft.fft(tr1, n=self.npts)
-            ft2 = np.fft.fft(tr2, n=self.npts)
+            if onesided:
+                f = np.fft.rfftfreq(npts, d=dt)
+            else:
+                f = np.fft.fftfreq(npts, d=dt)
+
+            if not np.allclose(f, tfnoise.f):
+                raise(Exception(
+                    'Frequency axes are different: ', f, tfnoise.f,
+                    ' - the noise and event windows are not the same, ' +
+                    'aborting'))
+
+            # Stacked Fourier spectra of all events in group
+            def _fft(comp):
+                data = np.array([getattr(evstream, comp).data
+                                 for evstream in group], dtype=float)
+                if onesided:
+                    return np.fft.rfft(data, n=npts)
+                return np.fft.fft(data, n=npts)
+
+            ft1 = None
+            ft2 = None
+            ftP = None
+            ftZ = _fft('trZ')
+            if ncomp == 2 or ncomp == 4:
+                ftP = _fft('trP')
+            if ncomp == 3 or ncomp == 4:
+                ft1 = _fft('tr1')
+                ft2 = _fft('tr2')
+
+            # Available corrections
+            ev_list = group[0].ev_list
+            keys = [key for key, value in tfnoise.tf_list.items()
+                    if value and ev_list[key]]
+
+            corrspec = utils.correct_spectra(
+                ftZ, ft1, ft2, ftP, tfnoise.transfunc, keys,
+                tilt=tfnoise.tilt)
+
+            # Stacked inverse transforms of all corrections
+            if corrspec:
+                spec = np.array(list(corrspec.values()))
+                if onesided:
+                    corrtime = np.fft.irfft(spec, n=npts)
+                else:
+                    corrtime = np.real(np.fft.ifft(spec))
 
-        f = np.fft.fftfreq(self.npts, d=self.dt)
+            for iev, evstream in enumerate(group):
+                correct = EventStream.CorrectDict()
+                for ikey, key in enumerate(corrspec):
+                    correct.add(key, corrtime[ikey, iev])
+                evstream.correct = correct
 
-        if not np.allclose(f, tfnoise.f):
-            raise(Exception(
-                'Frequency axes are different: ', f, tfnoise.f,
-                ' - the noise and event windows are not the same, aborting'))
-
-        for key, value in tf_list.items():
-
-            if key == 'ZP' and self.ev_list[key]:
-                if value and tf_list[key]:
-                    TF_ZP = transfunc[key]['TF_ZP']
-                    corrspec = ftZ - TF_ZP*ftP
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('ZP', corrtime)
-
-            if key == 'Z1' and self.ev_list[key]:
-                if value and tf_list[key]:
-                    TF_Z1 = transfunc[key]['TF_Z1']
-                    corrspec = ftZ - TF_Z1*ft1
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('Z1', corrtime)
-
-            if key == 'Z2-1' and self.ev_list[key]:
-                if value and tf_list[key]:
-                    TF_Z1 = transfunc['Z1']['TF_Z1']
-                    TF_21 = transfunc[key]['TF_21']
-                    TF_Z2_1 = transfunc[key]['TF_Z2-1']
-                    corrspec = ftZ - TF_Z1*ft1 - (ft2 - ft1*TF_21)*TF_Z2_1
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('Z2-1', corrtime)
-
-            if key == 'ZP-21' and self.ev_list[key]:
-                if value and tf_list[key]:
-                    TF_Z1 = transfunc[key]['TF_Z1']
-                    TF_21 = transfunc[key]['TF_21']
-                    TF_Z2_1 = transfunc[key]['TF_Z2-1']
-                    TF_P1 = transfunc[key]['TF_P1']
-                    TF_P2_1 = transfunc[key]['TF_P2-1']
-                    TF_ZP_21 = transfunc[key]['TF_ZP-21']
-                    corrspec = ftZ - TF_Z1*ft1 - \
-                        (ft2 - ft1*TF_21)*TF_Z2_1 - \
-                        (ftP - ft1*TF_P1 -
-                         (ft2 - ft1*TF_21)*TF_P2_1)*TF_ZP_21
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('ZP-21', corrtime)
-
-            if key == 'ZH' and self.ev_list[key]:
-                if value and tf_list[key]:
-
-                    # Rotate horizontals
-                    ftH = utils.rotate_dir(ft1, ft2, tfnoise.tilt)
-
-                    TF_ZH = transfunc[key]['TF_ZH']
-                    corrspec = ftZ - TF_ZH*ftH
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('ZH', corrtime)
-
-            if key == 'ZP-H' and self.ev_list[key]:
-                if value and tf_list[key]:
-
-                    # Rotate horizontals
-                    ftH = utils.rotate_dir(ft1, ft2, tfnoise.tilt)
-
-                    TF_ZH = transfunc['ZH']['TF_ZH']
-                    TF_PH = transfunc[key]['TF_PH']
-                    TF_ZP_H = transfunc[key]['TF_ZP-H']
-                    corrspec = ftZ - TF_ZH*ftH - (ftP - ftH*TF_PH)*TF_ZP_H
-                    corrtime = np.real(np.fft.ifft(corrspec))
-                    correct.add('ZP-H', corrtime)
-
-        self.correct = correct
-
-    def save(self, filename):
-        """
-        Method to save the object to file using `~Pickle`.
+    def save(self, filename, form='pkl'):
+        """
+        Method to save the object to file using `~Pickle` or the binary
+        store format of :mod:`~obstools.atacr.store`.
 
         Parameters
         ----------
         filename : str
             File name
+        form : str, optional
+            File format, either 'pkl' (pickle) or 'spec' (binary store, which
+            can be memory mapped when loaded with
+            :func:`~obstools.atacr.store.load`)
 
         Examples
         --------
@@ -2099,6 +3020,9 @@ class EventStream(object):
             print("Warning: saving EventStream object before having done " +
                   "the corrections")
 
-        file = open(filename, 'wb')
-        pickle.dump(self, file)
-        file.close()
+        if form == 'spec':
+            store.save(self, filename)
+        else:
+            file = open(filename, 'wb')
+            pickle.dump(self, file)
+            file.close()
@@ -0,0 +1,203 @@
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+:mod:`~obstools.atacr.download` contains the tools used by the download
+scripts to send requests concurrently to data centers. Requests spend most
+of their time waiting on the network, so they are sent from a pool of
+threads, with a bounded number of concurrent requests per data center and
+retries with exponential backoff for transient errors.
+
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from obspy.clients.fdsn.header import (
+    FDSNNoDataException, FDSNBadRequestException, FDSNUnauthorizedException,
+    FDSNForbiddenException)
+
+# Errors that are not resolved by repeating a request
+PERMANENT_ERRORS = (FDSNNoDataException, FDSNBadRequestException,
+                    FDSNUnauthorizedException, FDSNForbiddenException)
+
+
+class RequestPool(object):
+    """
+    A RequestPool object runs tasks that send requests to data centers in a
+    pool of threads. Each task calls
+    :func:`~obstools.atacr.download.RequestPool.request` for every request,
+    which bounds the number of concurrent requests to each data center and
+    repeats failed requests with exponential backoff.
+
+    Parameters
+    ----------
+    nrequests : int, optional
+        Maximum number of concurrent requests per data center
+    retries : int, optional
+        Number of times a failed request is repeated
+    backoff : float, optional
+        Waiting time (sec) before the first repeated request. The waiting
+        time is doubled for every further attempt, with random jitter of
+        +/- 50% such that requests that failed together are not repeated
+        together
+    nthreads : int, optional
+        Number of threads running tasks. Defaults to twice `nrequests`,
+        such that tasks can prepare or process data while others wait for
+        a request
+
+    Examples
+    --------
+
+    Download three days of data with at most two concurrent requests
+
+    >>> from obspy import UTCDateTime
+    >>> from obspy.clients.fdsn import Client
+    >>> from obstools.atacr.download import RequestPool
+    >>> pool = RequestPool(nrequests=2)
+    >>> client = pool.request('IRIS', Client, 'IRIS')
+    >>> def get_day(t1):
+    ...     return pool.request(
+    ...         'IRIS', client.get_waveforms, network='7D', station='M08A',
+    ...         location='*', channel='BHZ', starttime=t1,
+    ...         endtime=t1 + 86400.)
+    >>> days = [(UTCDateTime('2012-03-01') + i*86400.,) for i in range(3)]
+    >>> for task, st, error in pool.imap(get_day, days):
+    ...     print(task[0].date, error)
+
+    """
+
+    def __init__(self, nrequests=4, retries=3, backoff=2., nthreads=None):
+
+        if nrequests < 1:
+            raise(Exception("The number of concurrent requests should be " +
+                            "a positive integer"))
+        self.nrequests = nrequests
+        self.retries = retries
+        self.backoff = backoff
+        self.nthreads = nthreads or 2*nrequests
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, center):
+        """
+        Private method to get the semaphore bounding the number of
+        concurrent requests to a data center.
+
+        """
+
+        with self._lock:
+            if center not in self._semaphores:
+                self._semaphores[center] = threading.BoundedSemaphore(
+                    self.nrequests)
+            return self._semaphores[center]
+
+    def request(self, center, func, *args, **kwargs):
+        """
+        Method to send a request to a data center, waiting for a free slot
+        if the maximum number of concurrent requests is reached. Failed
+        requests are repeated, unless the error is permanent (e.g., no data
+        or unauthorized access). The slot is released while waiting to
+        repeat a request.
+
+        Parameters
+        ----------
+        center : str
+            Name or URL of the data center
+        func : callable
+            Function sending the request (e.g.,
+            :meth:`~obspy.clients.fdsn.client.Client.get_waveforms`)
+        args, kwargs
+            Arguments passed to `func`
+
+        Returns
+        -------
+        : object
+            Returned value of `func`
+
+        """
+
+        semaphore = self._semaphore(center)
+        for attempt in range(self.retries + 1):
+            with semaphore:
+                try:
+                    return func(*args, **kwargs)
+                except PERMANENT_ERRORS:
+                    raise
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+            time.sleep(self.backoff*2**attempt*random.uniform(0.5, 1.5))
+
+    def imap(self, func, tasks, ninflight=None):
+        """
+        Method to run `func` for each item of `tasks` in the pool of
+        threads. Tasks are consumed lazily from the iterable and results
+        are returned as soon as they are available (i.e., not necessarily
+        in order), such that the number of tasks and results held in memory
+        is bounded. Exceptions raised by `func` are returned instead of
+        being raised.
+
+        Parameters
+        ----------
+        func : callable
+            Function to apply
+        tasks : iterable
+            Iterable of tuples of positional arguments passed to `func`
+        ninflight : int, optional
+            Maximum number of submitted tasks whose results have not been
+            consumed. Defaults to the number of threads
+
+        Yields
+        ------
+        task : tuple
+            Arguments of the completed task
+        result : object
+            Returned value of `func`, or None if it failed
+        error : :class:`Exception`
+            Exception raised by `func`, or None if it succeeded
+
+        """
+
+        if ninflight is None:
+            ninflight = self.nthreads
+
+        tasks = iter(tasks)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.nthreads) as executor:
+            while True:
+                # Top up the queue of submitted tasks
+                if len(pending) < ninflight:
+                    for task in tasks:
+                        pending[executor.submit(func, *task)] = task
+                        if len(pending) >= ninflight:
+                            break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        yield task, future.result(), None
+                    else:
+                        yield task, None, error
@@ -0,0 +1,421 @@
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+:mod:`~obstools.atacr.sds` contains the tools to read noise data directly
+from a SeisComP Data Structure (SDS) archive of MiniSEED files, such as
+
+``ROOT/YEAR/NET/STA/CHAN.D/NET.STA.LOC.CHAN.D.YEAR.JDAY``
+
+instead of the day-long SAC files written by the download scripts. The
+records of each file are indexed by time from their headers only, such that
+arbitrary time windows are read by seeking to the records that overlap the
+window, without reading the whole files.
+
+"""
+
+import io
+import os
+from pathlib import Path
+from collections import OrderedDict
+import numpy as np
+from obspy import read, Stream, Trace, UTCDateTime
+from obspy.io.mseed.util import get_record_information
+from obstools.atacr import utils
+
+
+class SDSArchive(object):
+    """
+    An SDSArchive object reads waveforms from an SDS archive of MiniSEED
+    files, using an index of the records of each file.
+
+    Parameters
+    ----------
+    root : str
+        Root folder of the SDS archive
+    sds_type : str, optional
+        Data type of the archive (e.g., 'D' for data)
+    fileborder : float, optional
+        Maximum time (sec) by which the records of a day file may start
+        before midnight, or extend into the next day, such that the
+        neighbouring day files are also searched near midnight
+    cache_size : int, optional
+        Maximum number of file indices kept in memory
+
+    Attributes
+    ----------
+    indices : :class:`~collections.OrderedDict`
+        Indices of the most recently read files
+
+    Examples
+    --------
+
+    Read two hours of vertical component data across midnight
+
+    >>> from obspy import UTCDateTime
+    >>> from obstools.atacr.sds import SDSArchive
+    >>> archive = SDSArchive('/path/to/SDS')
+    >>> st = archive.get_waveforms(
+    ...     '7D', 'M08A', '', 'BHZ', UTCDateTime('2012-03-08T23:00:00'),
+    ...     UTCDateTime('2012-03-09T01:00:00'))
+
+    """
+
+    def __init__(self, root, sds_type='D', fileborder=30., cache_size=64):
+
+        self.root = Path(root)
+        if not self.root.is_dir():
+            raise(Exception("SDS archive " + str(root) + " does not exist"))
+        self.sds_type = sds_type
+        self.fileborder = fileborder
+        self.cache_size = cache_size
+        self.indices = OrderedDict()
+
+    def __getstate__(self):
+        # Indices are not sent to worker processes
+        state = self.__dict__.copy()
+        state['indices'] = OrderedDict()
+        return state
+
+    def files(self, network, station, location, channel, starttime,
+              endtime):
+        """
+        Method to list the files of the archive that may contain data
+        within a time window. The channel may contain wildcards.
+
+        Returns
+        -------
+        files : list of :class:`~pathlib.Path` object
+            Existing files, sorted by channel and day
+
+        """
+
+        t1 = UTCDateTime(starttime.date) - self.fileborder
+        t2 = endtime + self.fileborder
+
+        files = []
+        day = UTCDateTime(t1.date)
+        while day <= t2:
+            path = self.root / str(day.year) / network / station
+            pattern = '.'.join([network, station, location, channel,
+                                self.sds_type, str(day.year),
+                                str(day.julday).zfill(3)])
+            files.extend(path.glob(channel + '.' + self.sds_type + '/' +
+                                   pattern))
+            day += 86400.
+
+        return sorted(files, key=lambda f: (f.parent.name, f.name))
+
+    def index(self, filename):
+        """
+        Method to index the records of a MiniSEED file from their headers.
+        The index is kept in memory until the file is modified.
+
+        Parameters
+        ----------
+        filename : :class:`~pathlib.Path` object
+            MiniSEED file
+
+        Returns
+        -------
+        index : :class:`~numpy.ndarray`
+            Structured array with the start and end times (ns) and the
+            offset and length (bytes) of each record
+
+        """
+
+        key = str(filename)
+        stat = os.stat(filename)
+        if key in self.indices and \
+                self.indices[key][0] == (stat.st_mtime_ns, stat.st_size):
+            self.indices.move_to_end(key)
+            return self.indices[key][1]
+
+        records = []
+        with open(filename, 'rb') as f:
+            offset = 0
+            while offset < stat.st_size:
+                info = get_record_information(f, offset=offset)
+                records.append((info['starttime'].ns, info['endtime'].ns,
+                                offset, info['record_length']))
+                offset += info['record_length']
+        index = np.array(records, dtype=[
+            ('starttime', np.int64), ('endtime', np.int64),
+            ('offset', np.int64), ('length', np.int64)])
+
+        self.indices[key] = ((stat.st_mtime_ns, stat.st_size), index)
+        if len(self.indices) > self.cache_size:
+            self.indices.popitem(last=False)
+
+        return index
+
+    def read_records(self, filename, starttime, endtime):
+        """
+        Method to read the records of a file that overlap a time window.
+        Consecutive records are read at once.
+
+        Returns
+        -------
+        st : :class:`~obspy.core.Stream` object
+            Stream object with the data of the records (not trimmed)
+
+        """
+
+        index = self.index(filename)
+        select = np.flatnonzero((index['endtime'] >= starttime.ns) &
+                                (index['starttime'] <= endtime.ns))
+        st = Stream()
+        if len(select) == 0:
+            return st
+
+        # Split into runs of consecutive records
+        offsets = index['offset'][select]
+        lengths = index['length'][select]
+        breaks = np.flatnonzero(offsets[1:] != offsets[:-1] + lengths[:-1])
+        with open(filename, 'rb') as f:
+            for run in np.split(np.arange(len(select)), breaks + 1):
+                f.seek(offsets[run[0]])
+                buf = f.read(offsets[run[-1]] + lengths[run[-1]] -
+                             offsets[run[0]])
+                st += read(io.BytesIO(buf), format='MSEED')
+
+        return st
+
+    def get_waveforms(self, network, station, location, channel, starttime,
+                      endtime):
+        """
+        Method to read waveforms within a time window. The channel may
+        contain wildcards, and contiguous records are merged into single
+        traces.
+
+        Parameters
+        ----------
+        network, station, location, channel : str
+            SEED codes of the data
+        starttime, endtime : :class:`~obspy.core.UTCDateTime` object
+            Time window
+
+        Returns
+        -------
+        st : :class:`~obspy.core.Stream` object
+            Stream object trimmed to the time window
+
+        """
+
+        st = Stream()
+        for filename in self.files(network, station, location, channel,
+                                   starttime, endtime):
+            st += self.read_records(filename, starttime, endtime)
+
+        # Merge contiguous records, keep gaps as separate traces
+        st.merge(method=1)
+        st = st.split()
+        st.trim(starttime, endtime)
+
+        return st
+
+
+class SDSStation(object):
+    """
+    An SDSStation object reads the day-long noise data of a station from an
+    SDS archive, as an alternative to the folders of day-long SAC files
+    read by :func:`~obstools.atacr.utils.get_data` (which reads from an
+    SDSStation object when given one instead of a folder). If an inventory
+    is given, the archive is assumed to contain raw data, which are
+    processed on the fly as by the download scripts (see
+    :func:`~obstools.atacr.utils.preprocess_stream`). Otherwise the archive
+    is assumed to contain processed data.
+
+    Parameters
+    ----------
+    archive : :class:`~obstools.atacr.sds.SDSArchive`
+        SDS archive
+    sta : :class:`~stdb.StDbElement`
+        Station metadata (network, station, location and channel codes)
+    inventory : :class:`~obspy.core.inventory.inventory.Inventory`, optional
+        Station metadata with responses, for raw data
+    new_sampling_rate : float, optional
+        Sampling rate (Hz) of the processed data, for raw data
+    pre_filt : list, optional
+        Four corner frequencies (Hz) of the deconvolution pre-filter, for
+        raw data
+    units : str, optional
+        Output units of the seismic data ('DISP', 'VEL' or 'ACC'), for raw
+        data
+
+    """
+
+    def __init__(self, archive, sta, inventory=None, new_sampling_rate=5.,
+                 pre_filt=[0.001, 0.005, 45., 50.], units='DISP'):
+
+        self.archive = archive
+        self.network = sta.network
+        self.station = sta.station
+        self.location = ''
+        if len(sta.location) > 0:
+            self.location = sta.location[0].replace('--', '')
+        self.channel = sta.channel.upper()
+        self.inventory = inventory
+        self.new_sampling_rate = new_sampling_rate
+        self.pre_filt = pre_filt
+        self.units = units
+
+    def __str__(self):
+        return str(self.archive.root) + " (" + ".".join(
+            [self.network, self.station, self.location,
+             self.channel + "?"]) + ")"
+
+    def get_day(self, t1, t2):
+        """
+        Method to read the data of the four components for a time window,
+        as full-length traces.
+
+        Returns
+        -------
+        traces : dict
+            Trace objects keyed by component ('1', '2', 'Z' and 'H'). Missing
+            components are not included. Empty if the vertical component
+            is missing or incomplete
+
+        """
+
+        return self._process(self._read(t1, t2), t1, t2)
+
+    def _read(self, t1, t2):
+        """
+        Private method to read the waveforms of the four components for a
+        time window.
+
+        """
+
+        st = Stream()
+        for channel in [self.channel + '[12Z]', '?DH']:
+            st += self.archive.get_waveforms(
+                self.network, self.station, self.location, channel, t1, t2)
+
+        # Keep the highest sampling rate if there is more than one channel
+        stp = st.select(component='H')
+        if len(stp) > 0:
+            sr = max(tr.stats.sampling_rate for tr in stp)
+            for tr in stp:
+                if tr.stats.sampling_rate < sr:
+                    st.remove(tr)
+
+        return st
+
+    def _process(self, st, t1, t2):
+        """
+        Private method to process (or check) the waveforms read for a time
+        window into full-length traces, as returned by
+        :func:`~obstools.atacr.sds.SDSStation.get_day`.
+
+        """
+
+        if len(st.select(component='Z')) == 0:
+            return {}
+
+        if self.inventory is not None:
+            is_ok, st = utils.preprocess_stream(
+                st, t1, t2, self.new_sampling_rate, pre_filt=self.pre_filt,
+                units=self.units, inventory=self.inventory)
+        else:
+            # Processed seismic and pressure data may have different
+            # sampling rates, which are matched by get_data
+            stp = st.select(component='H')
+            is_ok, st = utils.QC_streams(
+                t1, t2, st.select(component='[12Z]'))
+            if is_ok and len(stp) > 0:
+                is_ok, stp = utils.QC_streams(t1, t2, stp)
+                if is_ok:
+                    st += stp
+        if not is_ok:
+            return {}
+
+        return {tr.stats.channel[-1]: tr for tr in st}
+
+    def get_span(self, tstart, tend):
+        """
+        Method to read the data of the four components for a time span of
+        several days, processed as one continuous stream, e.g., to
+        calculate spectra with windows that cross midnight (see
+        :class:`~obstools.atacr.classes.SegmentNoise`). This requires raw
+        data (i.e., an inventory), since days of processed data are
+        detrended, filtered and tapered separately, which distorts the data
+        around midnight. The raw data are read with a margin on both sides
+        that is trimmed after processing, such that the taper applied when
+        removing the responses does not extend into the span.
+
+        Returns
+        -------
+        traces : dict
+            Trace objects keyed by component ('1', '2', 'Z' and 'H'), as
+            returned by :func:`~obstools.atacr.sds.SDSStation.get_day`
+
+        """
+
+        if self.inventory is None:
+            raise(Exception("Continuous spans of processed data cannot be " +
+                            "read - an inventory is required"))
+
+        # Margin (whole minutes) longer than the taper at each end, limited
+        # to the available data and aligned on the processed samples
+        pad = 60.*np.ceil(0.05*(tend - tstart)/60.)
+        st = self._read(tstart - pad, tend + pad)
+        dt = 1./self.new_sampling_rate
+        pad1 = min([pad] + [tstart - tr.stats.starttime for tr in st])
+        pad2 = min([pad] + [tr.stats.endtime + tr.stats.delta - tend
+                            for tr in st])
+        t1 = tstart - max(dt*np.floor(pad1/dt), 0.)
+        t2 = tend + max(dt*np.floor(pad2/dt), 0.)
+        st.trim(t1, t2)
+        traces = self._process(st, t1, t2)
+        for tr in traces.values():
+            tr.trim(tstart, tend - tr.stats.delta)
+
+        return traces
+
+    def get_data(self, tstart, tend):
+        """
+        Method to read all available days of data within a time range, with
+        the same returned values as :func:`~obstools.atacr.utils.get_data`
+        (including the resampling of components with different sampling
+        rates).
+
+        """
+
+        trN1 = Stream()
+        trN2 = Stream()
+        trNZ = Stream()
+        trNP = Stream()
+
+        t1 = tstart
+        while t1 < tend:
+            traces = self.get_day(t1, t1 + 3600.*24.)
+            if 'Z' in traces:
+                trNZ.append(traces['Z'])
+                trN1.append(traces.get('1', Trace()))
+                trN2.append(traces.get('2', Trace()))
+                trNP.append(traces.get('H', Trace()))
+            t1 += 3600.*24.
+
+        utils.match_sampling_rates(trN1, trN2, trNZ, trNP)
+
+        return trN1, trN2, trNZ, trNP
@@ -0,0 +1,364 @@
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+:mod:`~obstools.atacr.sources` contains the sources of waveforms, station
+metadata and event catalogs used by the download scripts. All sources have
+the same methods as the FDSN :class:`~obspy.clients.fdsn.client.Client`
+(`get_waveforms`, `get_stations` and `get_events`), such that the scripts
+work the same with a data center, with a local SDS archive, or with
+requests recorded and replayed from disk (e.g., to run or benchmark the
+scripts offline).
+
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import threading
+from pathlib import Path
+from obspy import Stream, read_inventory, read_events
+from obspy.core.inventory import Inventory
+from obspy.clients.fdsn.header import FDSNNoDataException
+
+
+class WaveformSource(object):
+    """
+    Base class for the sources of data of the download scripts. Sources
+    implement the following methods, with the arguments and returned
+    values of the corresponding methods of
+    :class:`~obspy.clients.fdsn.client.Client`. Requests for which there
+    are no data raise :class:`~obspy.clients.fdsn.header.
+    FDSNNoDataException`.
+
+    """
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime, attach_response=False):
+        """
+        Method to get waveforms as a :class:`~obspy.core.Stream` object.
+        Channels may be given as a comma-separated list.
+
+        """
+
+        raise(NotImplementedError)
+
+    def get_stations(self, network="*", station="*", location="*",
+                     channel="*", starttime=None, endtime=None,
+                     level="response"):
+        """
+        Method to get station metadata as an
+        :class:`~obspy.core.inventory.inventory.Inventory` object.
+
+        """
+
+        raise(NotImplementedError)
+
+    def get_events(self, starttime=None, endtime=None, minmagnitude=None,
+                   maxmagnitude=None):
+        """
+        Method to get events as a :class:`~obspy.core.event.Catalog`
+        object.
+
+        """
+
+        raise(NotImplementedError)
+
+
+class FDSNSource(WaveformSource):
+    """
+    Source sending requests to a data center with the FDSN
+    :class:`~obspy.clients.fdsn.client.Client`. The client is only created
+    (which sends requests to discover the services of the data center) on
+    the first request.
+
+    Parameters
+    ----------
+    server : str
+        Name or URL of the data center (e.g., 'IRIS')
+    user : str, optional
+        User name, to access restricted data
+    password : str, optional
+        Password, to access restricted data
+
+    """
+
+    def __init__(self, server="IRIS", user=None, password=None):
+
+        self.server = server
+        self.user = user
+        self.password = password
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from obspy.clients.fdsn import Client
+                self._client = Client(
+                    self.server, user=self.user, password=self.password)
+            return self._client
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime, attach_response=False):
+        return self.client.get_waveforms(
+            network=network, station=station, location=location,
+            channel=channel, starttime=starttime, endtime=endtime,
+            attach_response=attach_response)
+
+    def get_stations(self, network="*", station="*", location="*",
+                     channel="*", starttime=None, endtime=None,
+                     level="response"):
+        return self.client.get_stations(
+            network=network, station=station, location=location,
+            channel=channel, starttime=starttime, endtime=endtime,
+            level=level)
+
+    def get_events(self, starttime=None, endtime=None, minmagnitude=None,
+                   maxmagnitude=None):
+        return self.client.get_events(
+            starttime=starttime, endtime=endtime,
+            minmagnitude=minmagnitude, maxmagnitude=maxmagnitude)
+
+
+class SDSSource(WaveformSource):
+    """
+    Source reading waveforms from a local SeisComP Data Structure (SDS)
+    archive of MiniSEED files (see :class:`~obstools.atacr.sds.SDSArchive`),
+    with station metadata and events read from StationXML and QuakeML
+    files.
+
+    Parameters
+    ----------
+    sds_root : str
+        Root folder of the SDS archive
+    inventory : list of str, optional
+        StationXML files with the station metadata
+    catalog : list of str, optional
+        QuakeML files with the events
+
+    """
+
+    def __init__(self, sds_root, inventory=[], catalog=[]):
+
+        from obstools.atacr.sds import SDSArchive
+
+        self.archive = SDSArchive(sds_root)
+        self.inventory = Inventory(networks=[], source='obstools')
+        for xmlfile in inventory:
+            self.inventory += read_inventory(xmlfile)
+        self.catalog = None
+        for qmlfile in catalog:
+            if self.catalog is None:
+                self.catalog = read_events(qmlfile)
+            else:
+                self.catalog += read_events(qmlfile)
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime, attach_response=False):
+
+        location = location.replace('--', '')
+        st = Stream()
+        for cha in channel.split(','):
+            st += self.archive.get_waveforms(
+                network, station, location, cha, starttime, endtime)
+        if len(st) == 0:
+            raise(FDSNNoDataException(
+                "No data in SDS archive for " + ".".join(
+                    [network, station, location, channel])))
+
+        if attach_response:
+            for tr in st:
+                tr.stats.response = self.inventory.get_response(
+                    tr.id, tr.stats.starttime)
+
+        return st
+
+    def get_stations(self, network="*", station="*", location="*",
+                     channel="*", starttime=None, endtime=None,
+                     level="response"):
+
+        location = location.replace('--', '')
+        inv = Inventory(networks=[], source=self.inventory.source)
+        for cha in channel.split(','):
+            inv += self.inventory.select(
+                network=network, station=station, location=location,
+                channel=cha, starttime=starttime, endtime=endtime)
+        if len(inv.get_contents()['channels']) == 0:
+            raise(FDSNNoDataException(
+                "No station metadata for " + ".".join(
+                    [network, station, location, channel])))
+
+        return inv
+
+    def get_events(self, starttime=None, endtime=None, minmagnitude=None,
+                   maxmagnitude=None):
+
+        if self.catalog is None:
+            raise(FDSNNoDataException("No event catalog"))
+
+        filters = []
+        if starttime is not None:
+            filters.append("time >= " + str(starttime))
+        if endtime is not None:
+            filters.append("time <= " + str(endtime))
+        if minmagnitude is not None:
+            filters.append("magnitude >= " + str(minmagnitude))
+        if maxmagnitude is not None:
+            filters.append("magnitude <= " + str(maxmagnitude))
+        cat = self.catalog.filter(*filters)
+        if len(cat) == 0:
+            raise(FDSNNoDataException("No events in catalog"))
+
+        return cat
+
+
+class ReplaySource(WaveformSource):
+    """
+    Source replaying requests recorded on disk. Requests that were not
+    recorded are sent to another source (if any) and their results (or the
+    absence of data) are recorded, such that running a script once with
+    access to a data center records all the requests needed to run it again
+    offline. A latency can be added to replayed requests, to emulate the
+    response time of a data center.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the recorded requests
+    source : :class:`~obstools.atacr.sources.WaveformSource`, optional
+        Source of the requests that were not recorded. If None, requests
+        that were not recorded raise
+        :class:`~obspy.clients.fdsn.header.FDSNNoDataException`
+    latency : float, optional
+        Time (sec) added to each replayed request
+
+    """
+
+    def __init__(self, path, source=None, latency=0.):
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.source = source
+        self.latency = latency
+
+    def _request(self, method, **kwargs):
+        """
+        Private method to replay or record a request.
+
+        """
+
+        # Recorded requests are identified by method and arguments
+        key = method + repr(sorted((name, str(value))
+                                   for name, value in kwargs.items()))
+        filename = self.path / (
+            method + '_' + hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+        if filename.exists():
+            if self.latency > 0.:
+                time.sleep(self.latency)
+            with open(filename, 'rb') as f:
+                result = pickle.load(f)
+        elif self.source is None:
+            raise(FDSNNoDataException(
+                "Request not recorded in " + str(self.path)))
+        else:
+            try:
+                result = getattr(self.source, method)(**kwargs)
+            except FDSNNoDataException as e:
+                result = e
+            # Write to a temporary file first, such that concurrent
+            # requests never read partial files
+            tmpfile = filename.with_suffix(
+                '.{0}.tmp'.format(threading.get_ident()))
+            with open(tmpfile, 'wb') as f:
+                pickle.dump(result, f)
+            os.replace(tmpfile, filename)
+
+        if isinstance(result, FDSNNoDataException):
+            raise(result)
+        return result
+
+    def get_waveforms(self, network, station, location, channel,
+                      starttime, endtime, attach_response=False):
+        return self._request(
+            'get_waveforms', network=network, station=station,
+            location=location, channel=channel, starttime=starttime,
+            endtime=endtime, attach_response=attach_response)
+
+    def get_stations(self, network="*", station="*", location="*",
+                     channel="*", starttime=None, endtime=None,
+                     level="response"):
+        return self._request(
+            'get_stations', network=network, station=station,
+            location=location, channel=channel, starttime=starttime,
+            endtime=endtime, level=level)
+
+    def get_events(self, starttime=None, endtime=None, minmagnitude=None,
+                   maxmagnitude=None):
+        return self._request(
+            'get_events', starttime=starttime, endtime=endtime,
+            minmagnitude=minmagnitude, maxmagnitude=maxmagnitude)
+
+
+def get_source(server="IRIS", user=None, password=None, sds_path=None,
+               inventory=[], catalog=[], replay_path=None, latency=0.):
+    """
+    Function to create the source of data of the download scripts.
+
+    Parameters
+    ----------
+    server : str, optional
+        Name or URL of the data center
+    user : str, optional
+        User name, to access restricted data
+    password : str, optional
+        Password, to access restricted data
+    sds_path : str, optional
+        Root folder of a local SDS archive, read instead of the data center
+    inventory : list of str, optional
+        StationXML files with the station metadata of the SDS archive
+    catalog : list of str, optional
+        QuakeML files with the events, for the SDS archive
+    replay_path : str, optional
+        Folder in which requests are recorded and from which they are
+        replayed
+    latency : float, optional
+        Time (sec) added to each replayed request
+
+    Returns
+    -------
+    source : :class:`~obstools.atacr.sources.WaveformSource`
+        Source of data
+
+    """
+
+    if sds_path is not None:
+        source = SDSSource(sds_path, inventory=inventory, catalog=catalog)
+    else:
+        source = FDSNSource(server, user=user, password=password)
+
+    if replay_path is not None:
+        source = ReplaySource(replay_path, source=source, latency=latency)
+
+    return source
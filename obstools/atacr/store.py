@@ -0,0 +1,618 @@
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+:mod:`~obstools.atacr.store` contains functions to save and load the
+objects of `~obstools.atacr.classes` and `~obstools.comply.classes` in a
+compact binary format, as an alternative to `~pickle`.
+
+A file starts with a fixed-size preamble (magic string, format version and
+header length), followed by a JSON header and by the raw contents of all
+arrays. The header describes the object (class, scalar attributes and
+metadata) and the type, shape and position of each array, which are
+aligned on 64-byte boundaries. Arrays are therefore loaded without copy
+through a memory map of the file, and single quantities (e.g.,
+``'power/cZZ'``) can be read without loading the rest of the object.
+
+The module also provides :class:`~obstools.atacr.store.TFRegistry`, an
+index of the transfer function files of a station by date, which keeps
+the most recently loaded objects in memory.
+
+"""
+
+import json
+import pickle
+import threading
+import weakref
+import importlib
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from pathlib import Path
+import numpy as np
+from obspy import UTCDateTime, Trace
+from obspy.core.util import AttribDict
+
+# File signature and format version
+MAGIC = b'OBSTSPEC'
+VERSION = 1
+
+# Alignment of arrays (in bytes) within the file
+ALIGN = 64
+
+# Size of the preamble: magic string, version and header length
+_PREAMBLE = len(MAGIC) + 4 + 8
+
+# Arrays smaller than this (bytes) are copied in memory instead of being
+# memory mapped, and files without larger arrays are not memory mapped
+MMAP_MIN_BYTES = 2**20
+
+# Maximum number of files memory mapped at the same time. Each memory map
+# keeps a file descriptor open until all its arrays are released, so
+# further files are read in memory instead
+MAX_MMAPS = 256
+
+# Number of files currently memory mapped
+_nmaps = [0]
+_nmaps_lock = threading.Lock()
+
+# File extensions of the output formats, in order of preference
+FORMATS = ['spec', 'pkl']
+
+
+def _aligned(n):
+    return -(-n//ALIGN)*ALIGN
+
+
+def _join(name, key):
+    return name + '/' + key if name else key
+
+
+def _encode(value, name, arrays):
+    """
+    Recursively converts `value` to a JSON-compatible tree, collecting the
+    arrays in the dictionary `arrays` under their path `name`.
+
+    """
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError("Cannot store object array " + name)
+        arrays[name] = value
+        return {'__type__': 'array', 'name': name}
+    if isinstance(value, UTCDateTime):
+        return {'__type__': 'UTCDateTime', 'value': str(value)}
+    if isinstance(value, Trace):
+        return {'__type__': 'Trace',
+                'data': _encode(value.data, _join(name, 'data'), arrays),
+                'stats': _encode(
+                    {key: val for key, val in value.stats.items()
+                     if key != 'endtime'}, _join(name, 'stats'), arrays)}
+    if isinstance(value, AttribDict):
+        return {'__type__': 'AttribDict',
+                'items': _encode(dict(value), name, arrays)}
+    if isinstance(value, dict):
+        items = {}
+        for key, val in value.items():
+            if not isinstance(key, str):
+                raise TypeError("Cannot store non-string key " + str(key))
+            items[key] = _encode(val, _join(name, key), arrays)
+        if type(value) is dict:
+            return items if '__type__' not in items else \
+                {'__type__': 'dict', 'items': items}
+        return {'__type__': 'dict', 'class': _qualname(value),
+                'items': items}
+    if isinstance(value, (list, tuple)):
+        return {'__type__': type(value).__name__,
+                'items': [_encode(val, _join(name, str(i)), arrays)
+                          for i, val in enumerate(value)]}
+    if hasattr(value, '__dict__'):
+        return {'__type__': 'object', 'class': _qualname(value),
+                'attrs': _encode(vars(value), name, arrays)}
+
+    raise TypeError("Cannot store attribute " + name + " of type " +
+                    type(value).__name__)
+
+
+def _decode(tree, arrays):
+    """
+    Recursively rebuilds the objects from a tree produced by
+    :func:`~obstools.atacr.store._encode`.
+
+    """
+
+    if isinstance(tree, list):
+        return [_decode(val, arrays) for val in tree]
+    if not isinstance(tree, dict):
+        return tree
+    kind = tree.get('__type__')
+    if kind is None:
+        return {key: _decode(val, arrays) for key, val in tree.items()}
+    if kind == 'array':
+        return arrays(tree['name'])
+    if kind == 'UTCDateTime':
+        return UTCDateTime(tree['value'])
+    if kind == 'Trace':
+        return Trace(data=_decode(tree['data'], arrays),
+                     header=_decode(tree['stats'], arrays))
+    if kind == 'AttribDict':
+        return AttribDict(_decode(tree['items'], arrays))
+    if kind == 'list':
+        return [_decode(val, arrays) for val in tree['items']]
+    if kind == 'tuple':
+        return tuple(_decode(val, arrays) for val in tree['items'])
+    if kind == 'dict':
+        items = {key: _decode(val, arrays)
+                 for key, val in tree['items'].items()}
+        if 'class' not in tree:
+            return items
+        obj = _class(tree['class'])()
+        obj.update(items)
+        return obj
+    if kind == 'object':
+        cls = _class(tree['class'])
+        obj = cls.__new__(cls)
+        obj.__dict__.update(_decode(tree['attrs'], arrays))
+        return obj
+
+    raise ValueError("Unknown type " + str(kind) + " in header")
+
+
+def _qualname(value):
+    cls = type(value)
+    return cls.__module__ + ':' + cls.__qualname__
+
+
+def _class(qualname):
+    """
+    Imports a class from its qualified name. Only classes defined in
+    `obstools` can be rebuilt.
+
+    """
+
+    module, name = qualname.split(':')
+    if module.split('.')[0] != 'obstools':
+        raise ValueError("Cannot rebuild class " + qualname)
+    obj = importlib.import_module(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def save(obj, filename):
+    """
+    Function to save an object to file in the binary store format.
+
+    Parameters
+    ----------
+    obj : object
+        Object to save, e.g. :class:`~obstools.atacr.classes.DayNoise`,
+        :class:`~obstools.atacr.classes.StaNoise`,
+        :class:`~obstools.atacr.classes.TFNoise`,
+        :class:`~obstools.atacr.classes.EventStream` or
+        :class:`~obstools.comply.classes.Comply`
+    filename : str
+        File name
+
+    """
+
+    arrays = {}
+    tree = _encode(obj, '', arrays)
+
+    # Position of each array relative to the start of the data block
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        table[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                       'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps(
+        {'version': VERSION, 'object': tree, 'arrays': table}).encode()
+    start = _aligned(_PREAMBLE + len(header))
+
+    with open(str(filename), 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint32(VERSION).tobytes())
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + table[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+
+
+def read_header(filename):
+    """
+    Function to read the header of a file saved in the binary store format.
+
+    Parameters
+    ----------
+    filename : str
+        File name
+
+    Returns
+    -------
+    header : dict
+        Dictionary with the format `version`, the encoded `object` and the
+        table of `arrays` (dtype, shape and offset of each array)
+    start : int
+        Position of the data block in the file (bytes)
+
+    """
+
+    with open(str(filename), 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(str(filename) + " is not a spectral store file")
+        version = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        if version > VERSION:
+            raise ValueError("Unsupported store version " + str(version))
+        nheader = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(nheader).decode())
+
+    return header, _aligned(_PREAMBLE + nheader)
+
+
+def is_store(filename):
+    """
+    Function to check whether a file is in the binary store format.
+
+    """
+
+    with open(str(filename), 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _nbytes(entry):
+    return int(np.prod(entry['shape']))*np.dtype(entry['dtype']).itemsize
+
+
+def _release():
+    with _nmaps_lock:
+        _nmaps[0] -= 1
+
+
+def _reader(filename, table, start, mmap):
+    """
+    Returns a function that reads an array from its name, either as a view
+    into a (copy-on-write) memory map of the file or as an in-memory copy.
+    Only arrays of at least `MMAP_MIN_BYTES` are memory mapped, and only
+    while fewer than `MAX_MMAPS` files are memory mapped.
+
+    """
+
+    if mmap:
+        mmap = any(_nbytes(entry) >= MMAP_MIN_BYTES
+                   for entry in table.values())
+    if mmap:
+        with _nmaps_lock:
+            mmap = _nmaps[0] < MAX_MMAPS
+            if mmap:
+                _nmaps[0] += 1
+
+    if mmap:
+        try:
+            buf = np.memmap(str(filename), dtype=np.uint8, mode='c')
+        except Exception:
+            _release()
+            raise
+        weakref.finalize(buf, _release)
+    else:
+        with open(str(filename), 'rb') as f:
+            buf = np.frombuffer(f.read(), dtype=np.uint8).copy()
+
+    def _read(name):
+        entry = table[name]
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        nbytes = _nbytes(entry)
+        if nbytes == 0:
+            return np.empty(shape, dtype=dtype)
+        i0 = start + entry['offset']
+        array = buf[i0:i0 + nbytes].view(dtype).reshape(shape)
+        if mmap and nbytes < MMAP_MIN_BYTES:
+            array = np.array(array)
+        return array
+
+    return _read
+
+
+def read(filename, name, mmap=True):
+    """
+    Function to read a single array from a file saved in the binary store
+    format, without rebuilding the object.
+
+    Parameters
+    ----------
+    filename : str
+        File name
+    name : str
+        Path of the array within the object, e.g. ``'f'``, ``'power/cZZ'``
+        or ``'transfunc/ZP/TF_ZP'``
+    mmap : bool, optional
+        Whether to return a view into a memory map of the file (True) or
+        an in-memory copy (False)
+
+    Returns
+    -------
+    array : :class:`~numpy.ndarray`
+        Requested array
+
+    """
+
+    header, start = read_header(filename)
+    if name not in header['arrays']:
+        raise KeyError(
+            "Array " + name + " not found in " + str(filename) +
+            ". Available arrays: " + ", ".join(header['arrays']))
+
+    return _reader(filename, header['arrays'], start, mmap)(name)
+
+
+def load(filename, mmap=True):
+    """
+    Function to load an object from file. Files in the binary store format
+    are rebuilt with arrays that are views into a (copy-on-write) memory
+    map of the file; other files are loaded with `~pickle`.
+
+    Each memory mapped file keeps a file descriptor open until all of its
+    arrays are released. Arrays smaller than `MMAP_MIN_BYTES` are
+    therefore copied in memory (files with only small arrays, such as
+    averaged spectra, are not memory mapped at all), and at most
+    `MAX_MMAPS` files are memory mapped at the same time, such that many
+    files can be loaded at once without running out of file descriptors.
+
+    Parameters
+    ----------
+    filename : str
+        File name
+    mmap : bool, optional
+        Whether to memory map the arrays (True) or to read them in memory
+        (False)
+
+    Returns
+    -------
+    obj : object
+        Loaded object
+
+    """
+
+    if not is_store(filename):
+        with open(str(filename), 'rb') as f:
+            return pickle.load(f)
+
+    header, start = read_header(filename)
+    arrays = _reader(filename, header['arrays'], start, mmap)
+
+    return _decode(header['object'], arrays)
+
+
+def find(prefix):
+    """
+    Function to find the file saved under a name in any of the output
+    formats (i.e., with extension ``.spec`` or ``.pkl``), such that the
+    scripts read the files written in either format.
+
+    Parameters
+    ----------
+    prefix : :class:`~pathlib.Path`
+        File name without extension, e.g.
+        ``SPECTRA/7D.M08A/2012.061.spectra``
+
+    Returns
+    -------
+    filename : :class:`~pathlib.Path`
+        Existing file, or None. If the file exists in both formats (e.g.,
+        after overwriting it in the other format), the most recent one
+
+    """
+
+    found = None
+    for form in FORMATS:
+        filename = Path(str(prefix) + '.' + form)
+        if filename.is_file() and (
+                found is None or
+                filename.stat().st_mtime_ns > found.stat().st_mtime_ns):
+            found = filename
+    return found
+
+
+def glob(path, pattern):
+    """
+    Function to list the files of a folder whose name without extension
+    matches a pattern, in any of the output formats. Files saved in both
+    formats are only listed once, as by
+    :func:`~obstools.atacr.store.find`.
+
+    Parameters
+    ----------
+    path : :class:`~pathlib.Path`
+        Folder
+    pattern : str
+        Pattern of the file names without extension, e.g. ``'*spectra'``
+
+    Returns
+    -------
+    filenames : list of :class:`~pathlib.Path`
+        Existing files, sorted by name
+
+    """
+
+    prefixes = set()
+    for form in FORMATS:
+        for filename in Path(path).glob(pattern + '.' + form):
+            prefixes.add(filename.parent / filename.name[:-len(form) - 1])
+    files = [find(prefix) for prefix in sorted(prefixes)]
+    return [filename for filename in files if filename is not None]
+
+
+class TFRegistry(object):
+    """
+    A TFRegistry object indexes once all transfer function files of a
+    station (e.g., in folder ``TF_STA/<key>``) by date, and loads them with
+    a bounded least-recently-used cache. File names start with either the
+    day (``YYYY.JJJ.``) of daily transfer functions or the date range
+    (``YYYY.JJJ-YYYY.JJJ.``) of station averages, followed by
+    ``transfunc``.
+
+    Station averages are sorted by start date, along with the running
+    maximum of their end dates, so that the files covering a given time are
+    found by bisection without scanning the whole list. Daily files are
+    found from a dictionary of days.
+
+    Parameters
+    ----------
+    path : str or :class:`~pathlib.Path`
+        Folder containing the transfer function files
+    maxsize : int, optional
+        Maximum number of objects kept in memory
+
+    Attributes
+    ----------
+    sta : list
+        List of (start, end, file) tuples for station averages, sorted by
+        start date
+    day : dict
+        Dictionary of daily transfer function files, with keys
+        ``'YYYY.JJJ'``
+
+    Examples
+    --------
+
+    >>> from obstools.atacr.store import TFRegistry
+    >>> registry = TFRegistry('TF_STA/7D.M08A')
+    >>> for transfile in registry.find(evstream.evtime, 'sta'):
+    ...     tfnoise = registry.load(transfile)
+
+    """
+
+    def __init__(self, path, maxsize=8):
+
+        self.maxsize = maxsize
+        self.day = {}
+        self._cache = OrderedDict()
+        self._failed = set()
+
+        sta = []
+        for filename in glob(path, '*transfunc'):
+
+            # Skip hidden files and folders
+            if filename.name[0] == '.' or not filename.is_file():
+                continue
+
+            tfprefix = filename.name.split('transfunc')[0]
+            try:
+                if len(tfprefix) > 9:
+                    date1, date2 = tfprefix.rstrip('.').split('-')
+                    sta.append((UTCDateTime(date1.replace('.', '-')),
+                                UTCDateTime(date2.replace('.', '-')),
+                                filename))
+                else:
+                    year, jday = tfprefix.rstrip('.').split('.')
+                    self.day[str(int(year)).zfill(4) + '.' +
+                             str(int(jday)).zfill(3)] = filename
+            except Exception:
+                continue
+
+        self.sta = sorted(sta, key=lambda item: item[0])
+        self._starts = [item[0] for item in self.sta]
+        self._maxends = list(accumulate(
+            [item[1] for item in self.sta], max))
+
+    def __len__(self):
+
+        return len(self.sta) + len(self.day)
+
+    def find(self, time, kind='sta'):
+        """
+        Method to find the transfer function files that apply to a given
+        time.
+
+        Parameters
+        ----------
+        time : :class:`~obspy.core.UTCDateTime`
+            Time (e.g., origin time of an event)
+        kind : str, optional
+            Either 'sta' (station averages whose date range includes
+            `time`) or 'day' (daily transfer functions for the day of
+            `time`)
+
+        Returns
+        -------
+        files : list
+            List of :class:`~pathlib.Path` objects
+
+        """
+
+        if kind == 'day':
+            tkey = str(time.year).zfill(4) + '.' + str(time.julday).zfill(3)
+            return [self.day[tkey]] if tkey in self.day else []
+
+        files = []
+        for i in range(bisect_right(self._starts, time) - 1, -1, -1):
+            if self._maxends[i] < time:
+                break
+            if self.sta[i][1] >= time:
+                files.append(self.sta[i][2])
+
+        return sorted(files)
+
+    def load(self, filename):
+        """
+        Method to load a transfer function file with
+        :func:`~obstools.atacr.store.load`. The most recently used objects
+        are kept in memory, and files that cannot be loaded are not read
+        again.
+
+        Parameters
+        ----------
+        filename : :class:`~pathlib.Path`
+            File name, as returned by
+            :func:`~obstools.atacr.store.TFRegistry.find`
+
+        Returns
+        -------
+        tfnoise : :class:`~obstools.atacr.classes.TFNoise`
+            Loaded object
+
+        """
+
+        if filename in self._cache:
+            self._cache.move_to_end(filename)
+            return self._cache[filename]
+        if filename in self._failed:
+            raise IOError("File " + str(filename) + " cannot be loaded")
+
+        try:
+            tfnoise = load(filename)
+        except Exception:
+            self._failed.add(filename)
+            raise
+
+        self._cache[filename] = tfnoise
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        return tfnoise
@@ -27,9 +27,18 @@ class methods of `~obstools.atacr.classes`.
 
 
 import os
+import re
+import json
+import pickle
+import hashlib
 import math
+import queue
+import threading
+import time
 import numpy as np
-import fnmatch
+from pathlib import Path
+from collections import OrderedDict
+from scipy.ndimage import uniform_filter1d
 from matplotlib import pyplot as plt
 from obspy.core import read, Stream, Trace, AttribDict, UTCDateTime
 
@@ -56,26 +65,62 @@ def traceshift(trace, tt):
 
     """
 
-    # Define frequencies
-    nt = trace.stats.npts
-    dt = trace.stats.delta
-    freq = np.fft.fftfreq(nt, d=dt)
+    return streamshift(Stream(traces=[trace]), [tt])[0]
 
-    # Fourier transform
-    ftrace = np.fft.fft(trace.data)
 
-    # Shift
-    for i in range(len(freq)):
-        ftrace[i] = ftrace[i]*np.exp(-2.*np.pi*1j*freq[i]*tt)
+def streamshift(st, tt):
+    """
+    Function to shift all traces of a stream in time by a (fractional)
+    number of samples. The phase shift is applied in the frequency domain
+    to the real Fourier transforms of all traces with the same number of
+    samples and sampling interval at once.
+
+
+    Parameters
+    ----------
+
+    st : :class:`~obspy.core.Stream` object
+        Stream object to update
+    tt : float or list
+        Time shift in seconds, either the same for all traces or one per
+        trace
+
+    Returns
+    -------
+
+    rst : :class:`~obspy.core.Stream` object
+        Updated stream object, with shifted copies of the traces
+
+
+    """
+
+    tt = np.broadcast_to(np.asarray(tt, dtype=float), (len(st),))
+    rst = st.copy()
+
+    # Group traces with the same time sampling
+    groups = {}
+    for i, tr in enumerate(rst):
+        groups.setdefault((tr.stats.npts, tr.stats.delta), []).append(i)
+
+    for (nt, dt), ind in groups.items():
+
+        # Fourier transform of all traces
+        data = np.array([rst[i].data for i in ind], dtype=float)
+        ftdata = np.fft.rfft(data, axis=-1)
+
+        # Shift
+        freq = np.fft.rfftfreq(nt, d=dt)
+        ftdata *= np.exp(-2.*np.pi*1j*np.outer(tt[ind], freq))
 
-    # Back Fourier transform and return as trace
-    rtrace = trace.copy()
-    rtrace.data = np.real(np.fft.ifft(ftrace))
+        # Back Fourier transform
+        data = np.fft.irfft(ftdata, n=nt, axis=-1)
+        for k, i in enumerate(ind):
+            rst[i].data = data[k]
 
-    # Update start time
-    rtrace.stats.starttime -= tt
+            # Update start time
+            rst[i].stats.starttime -= tt[i]
 
-    return rtrace
+    return rst
 
 
 def QC_streams(start, end, st):
@@ -115,9 +160,7 @@ def QC_streams(start, end, st):
         print("*   True start: "+str(start))
         print("* -> Shifting traces to true start")
         delay = [tr.stats.starttime - start for tr in st]
-        st_shifted = Stream(
-            traces=[traceshift(tr, dt) for tr, dt in zip(st, delay)])
-        st = st_shifted.copy()
+        st = streamshift(st, delay)
 
     # Try trimming
     dt = st[0].stats.delta
@@ -196,18 +239,334 @@ def update_stats(tr, stla, stlo, stel, cha, evla=None, evlo=None):
     return tr
 
 
-def get_data(datapath, tstart, tend):
+# Maximum number of evaluated instrument responses kept in memory by
+# :func:`~obstools.atacr.utils.remove_response`
+RESPONSE_CACHE_SIZE = 16
+
+# Evaluated instrument responses, keyed by SEED id, epoch, number of
+# samples, sampling interval and deconvolution settings
+_responses = OrderedDict()
+
+
+def response_epoch(tr, inventory=None):
+    """
+    Function to identify the epoch of the instrument response of a trace.
+    With an inventory, the epoch is the start and end dates of the channel
+    that was recording at the start of the trace. Responses attached to the
+    traces (e.g., from :meth:`~obspy.clients.fdsn.client.Client.
+    get_waveforms` with `attach_response=True`) carry no dates, and a
+    fingerprint of their content is used instead, such that the same
+    response attached to different traces has the same epoch.
+
+    Parameters
+    ----------
+    tr : :class:`~obspy.core.Trace` object
+        Trace object
+    inventory : :class:`~obspy.core.inventory.inventory.Inventory`, optional
+        Station metadata with the response of the trace
+
+    Returns
+    -------
+    epoch : tuple or str
+        Identifier of the response epoch: start and end dates (in ns) of
+        the channel, or fingerprint of the attached response
+
+    """
+
+    if inventory is None:
+        return hashlib.sha1(pickle.dumps(tr.stats.response)).hexdigest()
+
+    stats = tr.stats
+    inv = inventory.select(
+        network=stats.network, station=stats.station,
+        location=stats.location, channel=stats.channel,
+        time=stats.starttime)
+    for net in inv:
+        for sta in net:
+            for cha in sta:
+                return tuple(None if t is None else t.ns
+                             for t in (cha.start_date, cha.end_date))
+
+    raise(Exception("No matching response information found for " + tr.id))
+
+
+def remove_response(st, pre_filt=None, output='VEL', inventory=None,
+                    water_level=60.):
+    """
+    Function to remove the instrument response of all traces in a stream.
+    This is equivalent to
+    :meth:`~obspy.core.stream.Stream.remove_response` with the default
+    tapering and zero-mean options, but the tapers and the inverted complex
+    frequency response are cached by SEED id, response epoch (see
+    :func:`~obstools.atacr.utils.response_epoch`), number of samples,
+    sampling interval and deconvolution settings. The response is then
+    evaluated once per epoch and reused for the following traces (e.g., the
+    following days of the same channel), to which it is applied directly in
+    the frequency domain.
+
+    Parameters
+    ----------
+    st : :class:`~obspy.core.Stream` object
+        Stream object with attached responses (if `inventory` is None).
+        Traces are updated in place
+    pre_filt : list, optional
+        Four corner frequencies (Hz) of the deconvolution pre-filter
+    output : str, optional
+        Output units of the seismograms ('DISP', 'VEL' or 'ACC')
+    inventory : :class:`~obspy.core.inventory.inventory.Inventory`, optional
+        Station metadata with the responses of the traces
+    water_level : float, optional
+        Water level (dB) for the inversion of the instrument response
+
+    Returns
+    -------
+    st : :class:`~obspy.core.Stream` object
+        Stream object with instrument responses removed
+
+    """
+
+    from obspy.core.inventory import PolynomialResponseStage
+    from obspy.signal.invsim import (cosine_taper, cosine_sac_taper,
+                                     invert_spectrum)
+    from obspy.signal.util import _npts2nfft
+
+    for tr in st:
+
+        npts = tr.stats.npts
+        key = (tr.id, response_epoch(tr, inventory), npts, tr.stats.delta,
+               None if pre_filt is None else tuple(pre_filt), output,
+               water_level)
+
+        if key in _responses:
+            _responses.move_to_end(key)
+        else:
+            if inventory is None:
+                response = tr.stats.response
+            else:
+                response = inventory.get_response(
+                    tr.id, tr.stats.starttime)
+
+            # Polynomial responses are handled by obspy
+            if not response.response_stages or isinstance(
+                    response.response_stages[0], PolynomialResponseStage):
+                tr.remove_response(inventory=inventory, pre_filt=pre_filt,
+                                   output=output, water_level=water_level)
+                continue
+
+            nfft = _npts2nfft(npts)
+            taper = cosine_taper(npts, 0.05, sactaper=True,
+                                 halfcosine=False)
+            freq_response, freqs = response.get_evalresp_response(
+                tr.stats.delta, nfft, output=output)
+            freq_taper = None
+            if pre_filt:
+                freq_taper = cosine_sac_taper(freqs, flimit=pre_filt)
+            invert_spectrum(freq_response, water_level)
+            _responses[key] = (nfft, taper, freq_taper, freq_response)
+            if len(_responses) > RESPONSE_CACHE_SIZE:
+                _responses.popitem(last=False)
+
+        nfft, taper, freq_taper, freq_response = _responses[key]
+
+        # Same sequence of operations as obspy
+        data = tr.data.astype(np.float64)
+        data -= data.mean()
+        data *= taper
+        data = np.fft.rfft(data, n=nfft)
+        if freq_taper is not None:
+            data *= freq_taper
+        data *= freq_response
+        data[-1] = abs(data[-1]) + 0.0j
+        tr.data = np.fft.irfft(data)[0:npts]
+
+    return st
+
+
+def preprocess_stream(st, start, end, new_sampling_rate, pre_filt=None,
+                      units='DISP', inventory=None):
+    """
+    Function to pre-process raw seismic and pressure data: the traces are
+    detrended, low-pass filtered and resampled, checked with
+    :func:`~obstools.atacr.utils.QC_streams`, and their instrument
+    responses are removed with
+    :func:`~obstools.atacr.utils.remove_response`. This is the processing
+    applied to the data by the download scripts.
+
+    Parameters
+    ----------
+    st : :class:`~obspy.core.Stream` object
+        Stream object with raw seismic (components 1, 2 and/or Z) and
+        pressure (component H) traces
+    start : :class:`~obspy.core.UTCDateTime` object
+        Start time of requested stream
+    end : :class:`~obspy.core.UTCDateTime` object
+        End time of requested stream
+    new_sampling_rate : float
+        Sampling rate (Hz) of the processed data
+    pre_filt : list, optional
+        Four corner frequencies (Hz) of the deconvolution pre-filter
+    units : str, optional
+        Output units of the seismic data ('DISP', 'VEL' or 'ACC')
+    inventory : :class:`~obspy.core.inventory.inventory.Inventory`, optional
+        Station metadata, if the responses are not attached to the traces
+
+    Returns
+    -------
+    (pass): bool
+        Whether the QC test has passed
+    st : :class:`~obspy.core.Stream` object
+        Processed stream object
+
+    """
+
+    # Detrend, filter
+    st.detrend('demean')
+    st.detrend('linear')
+    st.filter('lowpass', freq=0.5*new_sampling_rate,
+              corners=2, zerophase=True)
+    st.resample(new_sampling_rate)
+
+    # Check streams
+    is_ok, st = QC_streams(start, end, st)
+    if not is_ok:
+        return False, None
+
+    # Remove responses
+    sth = st.select(component='1') + st.select(component='2') + \
+        st.select(component='Z')
+    remove_response(sth, pre_filt=pre_filt, output=units,
+                    inventory=inventory)
+    stp = st.select(component='H')
+    remove_response(stp, pre_filt=pre_filt, inventory=inventory)
+
+    return True, st
+
+
+# In-memory copies of the SAC catalogs, keyed by folder
+_catalogs = {}
+
+# Modification times more recent than this (ns) are not trusted, since
+# files may still be added within the resolution of the file system clock
+CATALOG_RACY = 2*10**9
+
+# Default folder of the catalogs cached to disk by the scripts, in the user
+# cache folder (outside of the data folders)
+CATALOG_CACHE = Path(os.environ.get('XDG_CACHE_HOME') or
+                     Path.home() / '.cache') / 'obstools' / 'catalogs'
+
+
+def sac_catalog(path, cache_dir=None):
+    """
+    Function to index the SAC files of a folder by year, Julian day and
+    component, such that the files for a given day (or event) are found
+    in constant time instead of matching the name of every file in the
+    folder. File names are expected to contain a time stamp of the form
+    ``YYYY.JJJ.`` and to end with the component (``1``, ``2``, ``Z`` or
+    ``H``) followed by ``.SAC``, as written by the download scripts.
+
+    The catalog is kept in memory, and optionally cached to disk in a
+    separate folder (never in the data folder). It is rebuilt only when
+    the modification time of the folder changes, i.e. when files are added,
+    removed or renamed. Catalogs of folders modified within the last
+    seconds are not cached, since files added within the resolution of the
+    file system clock would not change the modification time.
+
+    Parameters
+    ----------
+    path : :class:`~pathlib.Path` object
+        Path to data folder
+    cache_dir : :class:`~pathlib.Path` object, optional
+        Folder in which the catalogs are cached to disk, to be reused by
+        other processes. Catalogs are only kept in memory if None
+
+    Returns
+    -------
+    catalog : dict
+        Dictionary of sorted lists of file names, keyed by
+        (year, julday, component)
+
+    """
+
+    path = Path(path)
+    if not path.is_dir():
+        return {}
+
+    # Modification time read before listing the folder, such that files
+    # added while listing change it again and invalidate the catalog
+    key = str(path.resolve())
+    mtime = os.stat(path).st_mtime_ns
+    if key in _catalogs and _catalogs[key][0] == mtime:
+        return _catalogs[key][1]
+
+    # Try cached catalog on disk
+    catfile = None
+    if cache_dir is not None:
+        catfile = Path(cache_dir) / (
+            hashlib.sha1(key.encode()).hexdigest() + '.json')
+    if catfile is not None and catfile.is_file():
+        try:
+            with open(catfile, 'r') as f:
+                cached = json.load(f)
+            if cached['path'] == key and cached['mtime'] == mtime:
+                catalog = {}
+                for entry, names in cached['files'].items():
+                    year, julday, comp = entry.split('.')
+                    catalog[(int(year), int(julday), comp)] = names
+                _catalogs[key] = (mtime, catalog)
+                return catalog
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Build catalog from file names
+    catalog = {}
+    for name in sorted(os.listdir(path)):
+        if not name.endswith('.SAC'):
+            continue
+        stamp = re.search(r'(\d{4})\.(\d{3})\.', name)
+        if stamp is None:
+            continue
+        entry = (int(stamp.group(1)), int(stamp.group(2)), name[-5])
+        catalog.setdefault(entry, []).append(name)
+
+    # Folders modified too recently are listed again on the next call
+    if time.time_ns() - mtime < CATALOG_RACY:
+        return catalog
+
+    # Write catalog file, atomically for concurrent processes
+    if catfile is not None:
+        try:
+            catfile.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = catfile.with_suffix(
+                '.{0}.tmp'.format(os.getpid()))
+            with open(tmpfile, 'w') as f:
+                json.dump({'version': 2, 'path': key, 'mtime': mtime,
+                           'files': {str(year)+'.'+str(julday)+'.'+comp: names
+                                     for (year, julday, comp), names in
+                                     catalog.items()}}, f)
+            os.replace(tmpfile, catfile)
+        except OSError:
+            pass
+
+    _catalogs[key] = (mtime, catalog)
+
+    return catalog
+
+
+def get_data(datapath, tstart, tend, cache_dir=None):
     """
     Function to grab all available noise data given a path and data time range
 
     Parameters
     ----------
-    datapath : str
-        Path to noise data folder
+    datapath : str or :class:`~obstools.atacr.sds.SDSStation`
+        Path to noise data folder, or station of an SDS archive
     tstart : :class:`~obspy.class.UTCDateTime`
         Start time for query
     tend : :class:`~obspy.class.UTCDateTime`
         End time for query
+    cache_dir : :class:`~pathlib.Path` object, optional
+        Folder in which the catalog of the data folder is cached to disk
+        (see :func:`~obstools.atacr.utils.sac_catalog`)
 
     Returns
     -------
@@ -217,11 +576,19 @@ def get_data(datapath, tstart, tend):
 
     """
 
+    # Data read directly from an archive
+    if hasattr(datapath, 'get_data'):
+        return datapath.get_data(tstart, tend)
+
     # Define empty streams
     trN1 = Stream()
     trN2 = Stream()
     trNZ = Stream()
     trNP = Stream()
+    streams = {'1': trN1, '2': trN2, 'Z': trNZ, 'H': trNP}
+
+    # Index of available files
+    catalog = sac_catalog(datapath, cache_dir=cache_dir)
 
     # Time iterator
     t1 = tstart
@@ -229,25 +596,11 @@ def get_data(datapath, tstart, tend):
     # Cycle through each day within time range
     while t1 < tend:
 
-        # Time stamp used in file name
-        tstamp = str(t1.year).zfill(4)+'.'+str(t1.julday).zfill(3)+'.'
-
-        # Cycle through directory and load files
-        p = datapath.glob('*.*')
-        files = [x for x in p if x.is_file()]
-        for file in files:
-            if fnmatch.fnmatch(str(file), '*' + tstamp + '*1.SAC'):
-                tr = read(str(file))
-                trN1.append(tr[0])
-            elif fnmatch.fnmatch(str(file), '*' + tstamp + '*2.SAC'):
-                tr = read(str(file))
-                trN2.append(tr[0])
-            elif fnmatch.fnmatch(str(file), '*' + tstamp + '*Z.SAC'):
-                tr = read(str(file))
-                trNZ.append(tr[0])
-            elif fnmatch.fnmatch(str(file), '*' + tstamp + '*H.SAC'):
-                tr = read(str(file))
-                trNP.append(tr[0])
+        # Load files for current day
+        for comp, st in streams.items():
+            for name in catalog.get((t1.year, t1.julday, comp), []):
+                tr = read(str(Path(datapath) / name))
+                st.append(tr[0])
 
         # Increase increment
         t1 += 3600.*24.
@@ -262,24 +615,125 @@ def get_data(datapath, tstart, tend):
         for i in range(ntr):
             trNP.append(Trace())
 
-    if ntr > 0:
-        # Check that all sampling rates are equal - otherwise resample
-        if trNZ[0].stats.sampling_rate != trNP[0].stats.sampling_rate:
-
-            # These checks assume that all seismic data have the same sampling
-            if trNZ[0].stats.sampling_rate < trNP[0].stats.sampling_rate:
-                trNP.resample(trNZ[0].stats.sampling_rate, no_filter=False)
-            else:
-                trNZ.resample(trNP[0].stats.sampling_rate, no_filter=False)
-                if trN1:
-                    trN1.resample(trNP[0].stats.sampling_rate, no_filter=False)
-                if trN2:
-                    trN2.resample(trNP[0].stats.sampling_rate, no_filter=False)
+    match_sampling_rates(trN1, trN2, trNZ, trNP)
 
     return trN1, trN2, trNZ, trNP
 
 
-def get_event(eventpath, tstart, tend):
+def match_sampling_rates(trN1, trN2, trNZ, trNP):
+    """
+    Function to resample the seismic or pressure data in place, such that
+    all components have the same sampling rate. The component with the
+    higher sampling rate is resampled to the lower one.
+
+    Parameters
+    ----------
+    trN1, trN2, trNZ, trNP : :class:`~obspy.core.Stream` object
+        Day-long traces for components H1, H2, HZ and HP. Traces are empty
+        for missing components
+
+    """
+
+    if len(trNZ) == 0 or trNP[0].stats.npts == 0:
+        return
+
+    # Check that all sampling rates are equal - otherwise resample
+    if trNZ[0].stats.sampling_rate != trNP[0].stats.sampling_rate:
+
+        # These checks assume that all seismic data have the same sampling
+        if trNZ[0].stats.sampling_rate < trNP[0].stats.sampling_rate:
+            trNP.resample(trNZ[0].stats.sampling_rate, no_filter=False)
+        else:
+            trNZ.resample(trNP[0].stats.sampling_rate, no_filter=False)
+            if trN1:
+                trN1.resample(trNP[0].stats.sampling_rate, no_filter=False)
+            if trN2:
+                trN2.resample(trNP[0].stats.sampling_rate, no_filter=False)
+
+
+def iter_data(datapath, tstart, tend, prefetch=0, cache_dir=None):
+    """
+    Generator version of :func:`~obstools.atacr.utils.get_data` that loads
+    and yields the noise data one day at a time, such that the memory used
+    does not grow with the length of the time range. Days without vertical
+    component data are skipped.
+
+    Parameters
+    ----------
+    datapath : str or :class:`~obstools.atacr.sds.SDSStation`
+        Path to noise data folder, or station of an SDS archive
+    tstart : :class:`~obspy.class.UTCDateTime`
+        Start time for query
+    tend : :class:`~obspy.class.UTCDateTime`
+        End time for query
+    prefetch : int, optional
+        Number of days read ahead in a background thread, such that reading
+        the next days overlaps with the processing of the current one. Days
+        are read in the calling thread if 0
+    cache_dir : :class:`~pathlib.Path` object, optional
+        Folder in which the catalog of the data folder is cached to disk
+        (see :func:`~obstools.atacr.utils.sac_catalog`)
+
+    Yields
+    ------
+    tr1, tr2, trZ, trP : :class:`~obspy.core.Trace` object
+        Corresponding trace objects for components H1, H2, HZ and HP for a
+        single day. Traces are empty for missing components.
+
+    """
+
+    def _days():
+        t1 = tstart
+        while t1 < tend:
+            trN1, trN2, trNZ, trNP = get_data(
+                datapath, t1, t1 + 3600.*24., cache_dir=cache_dir)
+            if len(trNZ) > 0:
+                yield trN1[0], trN2[0], trNZ[0], trNP[0]
+            t1 += 3600.*24.
+
+    if prefetch <= 0:
+        yield from _days()
+        return
+
+    # Read ahead in a background thread through a bounded queue
+    done = object()
+    days = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                days.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _reader():
+        try:
+            for day in _days():
+                if not _put(day):
+                    return
+        except Exception as e:
+            _put(e)
+        _put(done)
+
+    thread = threading.Thread(target=_reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            day = days.get()
+            if day is done:
+                break
+            if isinstance(day, Exception):
+                raise day
+            yield day
+    finally:
+        stop.set()
+        thread.join()
+
+
+def get_event(eventpath, tstart, tend, cache_dir=None):
     """
     Function to grab all available earthquake data given a path and data time
     range
@@ -292,6 +746,9 @@ def get_event(eventpath, tstart, tend):
         Start time for query
     tend : :class:`~obspy.class.UTCDateTime`
         End time for query
+    cache_dir : :class:`~pathlib.Path` object, optional
+        Folder in which the catalog of the data folder is cached to disk
+        (see :func:`~obstools.atacr.utils.sac_catalog`)
 
     Returns
     -------
@@ -301,13 +758,17 @@ def get_event(eventpath, tstart, tend):
 
     """
 
+    # Index of available files
+    catalog = sac_catalog(eventpath, cache_dir=cache_dir)
+
     # Find out how many events from Z.SAC files
-    eventfiles = list(eventpath.glob('*Z.SAC'))
+    eventfiles = [name for (year, julday, comp), names in
+                  sorted(catalog.items()) if comp == 'Z' for name in names]
     if not eventfiles:
         raise(Exception("No event found in folder "+str(eventpath)))
 
     # Extract events from time stamps
-    prefix = [file.name.split('.') for file in eventfiles]
+    prefix = [name.split('.') for name in eventfiles]
     evstamp = [p[0]+'.'+p[1]+'.'+p[2]+'.'+p[3]+'.' for p in prefix]
     evDateTime = [UTCDateTime(p[0]+'-'+p[1]+'T'+p[2]+":"+p[3]) for p in prefix]
 
@@ -316,27 +777,18 @@ def get_event(eventpath, tstart, tend):
     tr2 = Stream()
     trZ = Stream()
     trP = Stream()
+    streams = {'1': tr1, '2': tr2, 'Z': trZ, 'H': trP}
 
     # Cycle over all available files in time range
     for event, tstamp in zip(evDateTime, evstamp):
         if event >= tstart and event <= tend:
 
-            # Cycle through directory and load files
-            p = list(eventpath.glob('*.SAC'))
-            files = [x for x in p if x.is_file()]
-            for file in files:
-                if fnmatch.fnmatch(str(file), '*' + tstamp + '*1.SAC'):
-                    tr = read(str(file))
-                    tr1.append(tr[0])
-                elif fnmatch.fnmatch(str(file), '*' + tstamp + '*2.SAC'):
-                    tr = read(str(file))
-                    tr2.append(tr[0])
-                elif fnmatch.fnmatch(str(file), '*' + tstamp + '*Z.SAC'):
-                    tr = read(str(file))
-                    trZ.append(tr[0])
-                elif fnmatch.fnmatch(str(file), '*' + tstamp + '*H.SAC'):
-                    tr = read(str(file))
-                    trP.append(tr[0])
+            # Load files for current event from those of the same day
+            for comp, st in streams.items():
+                for name in catalog.get((event.year, event.julday, comp), []):
+                    if tstamp in name:
+                        tr = read(str(Path(eventpath) / name))
+                        st.append(tr[0])
 
     # Fill with empty traces if components are not found
     ntr = len(trZ)
@@ -365,9 +817,337 @@ def get_event(eventpath, tstart, tend):
     return tr1, tr2, trZ, trP
 
 
+def imap_bounded(func, tasks, workers=1, ninflight=None):
+    """
+    Function to apply `func` to each item of `tasks` in a pool of worker
+    processes, while keeping the number of submitted but unfinished tasks
+    bounded. Tasks are consumed lazily from the iterable, such that the
+    memory used by pending arguments and results does not grow with the
+    total number of tasks. Exceptions raised by `func` are returned instead
+    of being raised, such that a single failing task does not interrupt the
+    others.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply. Must be defined at the module level (picklable)
+        if `workers` > 1
+    tasks : iterable
+        Iterable of tuples of positional arguments passed to `func`
+    workers : int, optional
+        Number of worker processes. Tasks are processed serially in the
+        current process if `workers` is 1
+    ninflight : int, optional
+        Maximum number of tasks submitted at any time. Defaults to twice
+        the number of workers
+
+    Yields
+    ------
+    task : tuple
+        Arguments of the completed task
+    result : object
+        Returned value of `func`, or None if it failed
+    error : :class:`Exception`
+        Exception raised by `func`, or None if it succeeded
+
+    """
+
+    if workers <= 1:
+        for task in tasks:
+            try:
+                yield task, func(*task), None
+            except Exception as e:
+                yield task, None, e
+        return
+
+    from concurrent.futures import (ProcessPoolExecutor, wait,
+                                    FIRST_COMPLETED)
+
+    if ninflight is None:
+        ninflight = 2*workers
+
+    tasks = iter(tasks)
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # Top up the queue of submitted tasks
+            for task in tasks:
+                pending[executor.submit(func, *task)] = task
+                if len(pending) >= ninflight:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield task, future.result(), None
+                else:
+                    yield task, None, error
+
+
+def windowed_fft(data, fs, wind, ws, ss, onesided=False):
+    """
+    Function to calculate the windowed (short-time) Fourier transforms of
+    several components at once. The traces are cut into overlapping
+    windows, detrended (mean removed) and tapered before a single
+    real-input FFT is taken over all components and windows. The result is
+    equivalent to :func:`~scipy.signal.stft` with ``boundary=None``,
+    ``padded=False`` and ``detrend='constant'``, multiplied by the number
+    of points in the window.
+
+    Parameters
+    ----------
+    data : :class:`~numpy.ndarray`
+        Real-valued array of shape (ncomp, npts) of stacked traces
+    fs : float
+        Sampling frequency (Hz)
+    wind : :class:`~numpy.ndarray`
+        Taper function of length `ws`
+    ws : int
+        Number of points in window
+    ss : int
+        Number of points to overlap between adjacent windows
+    onesided : bool, optional
+        Whether to return only the non-negative frequencies (True) or the
+        full two-sided spectra (False)
+
+    Returns
+    -------
+    f : :class:`~numpy.ndarray`
+        Full frequency axis (Hz), or non-negative frequency axis if
+        `onesided`
+    t : :class:`~numpy.ndarray`
+        Time at the center of each window (sec)
+    ft : :class:`~numpy.ndarray`
+        Contiguous complex array of shape (ncomp, nwin, nfreq) with the
+        Fourier transform of each window and component, where nfreq is
+        `ws` (two-sided) or `ws//2 + 1` (one-sided)
+
+    """
+
+    step = ws - ss
+    npts = data.shape[-1]
+    outdtype = np.result_type(data, np.complex64)
+
+    # Sliding windows (views), detrended and tapered
+    segs = np.lib.stride_tricks.sliding_window_view(
+        data, ws, axis=-1)[..., ::step, :]
+    segs = (segs - np.mean(segs, axis=-1, keepdims=True)) * \
+        wind.astype(segs.dtype)
+
+    # Single real-input FFT over all components and windows
+    rft = np.fft.rfft(segs, axis=-1)
+    nr = rft.shape[-1]
+    t = np.arange(ws/2, npts - ws/2 + 1, step)/fs
+
+    if onesided:
+        ft = rft.astype(outdtype, copy=False)
+        ft *= ws/np.sum(wind)
+        f = np.fft.rfftfreq(ws, d=1./fs)
+        return f, t, ft
+
+    # Fill negative frequencies from Hermitian symmetry
+    ft = np.empty(segs.shape, dtype=outdtype)
+    ft[..., :nr] = rft
+    ft[..., nr:] = np.conj(rft[..., 1:ws-nr+1][..., ::-1])
+    ft *= ws/np.sum(wind)
+
+    f = np.fft.fftfreq(ws, d=1./fs)
+
+    return f, t, ft
+
+
+def iter_windowed_fft(data, fs, wind, ws, ss, onesided=False, nchunk=16):
+    """
+    Generator version of :func:`~obstools.atacr.utils.windowed_fft` that
+    yields the windowed Fourier transforms in chunks of consecutive
+    windows. Only the samples spanned by the current chunk are copied, such
+    that the memory used is proportional to `nchunk` rather than to the
+    total number of windows.
+
+    Parameters
+    ----------
+    data : list
+        List of ncomp real-valued :class:`~numpy.ndarray` of equal length
+        (e.g., the ``data`` attribute of each trace)
+    fs : float
+        Sampling frequency (Hz)
+    wind : :class:`~numpy.ndarray`
+        Taper function of length `ws`
+    ws : int
+        Number of points in window
+    ss : int
+        Number of points to overlap between adjacent windows
+    onesided : bool, optional
+        Whether to return only the non-negative frequencies (True) or the
+        full two-sided spectra (False)
+    nchunk : int, optional
+        Number of windows per chunk
+
+    Yields
+    ------
+    f : :class:`~numpy.ndarray`
+        Frequency axis (Hz)
+    t : :class:`~numpy.ndarray`
+        Time at the center of each window in the chunk (sec)
+    ft : :class:`~numpy.ndarray`
+        Complex array of shape (ncomp, nchunk, nfreq) with the Fourier
+        transforms of the windows in the chunk
+
+    """
+
+    step = ws - ss
+    npts = len(data[0])
+    nwin = (npts - ws)//step + 1
+
+    for k0 in range(0, nwin, nchunk):
+        k1 = min(k0 + nchunk, nwin)
+        seg = np.array([d[k0*step:(k1 - 1)*step + ws] for d in data])
+        f, t, ft = windowed_fft(seg, fs, wind, ws, ss, onesided=onesided)
+        yield f, t + k0*step/fs, ft
+
+
+def to_onesided(obj):
+    """
+    Function to convert the spectral attributes of an object calculated
+    for the full (two-sided) frequency axis to their one-sided
+    (non-negative frequency) form. This is used to convert
+    :class:`~obstools.atacr.classes.DayNoise`,
+    :class:`~obstools.atacr.classes.StaNoise`,
+    :class:`~obstools.atacr.classes.TFNoise` or
+    :class:`~obstools.comply.classes.Comply` objects loaded from existing
+    pickles, which were calculated with two-sided spectra. Objects that are
+    already one-sided are returned unchanged.
+
+    Parameters
+    ----------
+    obj : object
+        Object with a two-sided frequency axis `f` and spectral attributes
+
+    Returns
+    -------
+    obj : object
+        Updated object, with attribute `onesided` set to True
+
+    """
+
+    # StaNoise objects that have not been initialized
+    if hasattr(obj, 'daylist'):
+        for dn in obj.daylist:
+            to_onesided(dn)
+        return obj
+
+    if getattr(obj, 'onesided', False):
+        return obj
+
+    nfft = len(obj.f)
+    nr = nfft//2 + 1
+
+    def _cut(x, axis=0):
+        if not isinstance(x, np.ndarray) or x.ndim == 0:
+            return x
+        if x.shape[axis] != nfft:
+            return x
+        if axis == 0:
+            return x[0:nr].copy()
+        else:
+            return x[..., 0:nr].copy()
+
+    specs = ['c11', 'c22', 'cZZ', 'cPP', 'c12', 'c1Z', 'c1P', 'c2Z', 'c2P',
+             'cZP', 'cHH', 'cHZ', 'cHP']
+
+    # Windowed Fourier transforms (DayNoise)
+    for name in ['ft1', 'ft2', 'ftZ', 'ftP']:
+        if hasattr(obj, name):
+            setattr(obj, name, _cut(getattr(obj, name), axis=-1))
+
+    # Unpacked spectral quantities (StaNoise, TFNoise, Comply)
+    for name in specs:
+        if hasattr(obj, name):
+            setattr(obj, name, _cut(getattr(obj, name)))
+
+    # Containers for averaged spectra
+    for name in ['power', 'cross', 'rotation']:
+        if hasattr(obj, name):
+            container = getattr(obj, name)
+            for spec in specs:
+                if hasattr(container, spec):
+                    setattr(container, spec, _cut(getattr(container, spec)))
+
+    # Transfer functions (TFNoise)
+    if getattr(obj, 'transfunc', None):
+        for tf in obj.transfunc.values():
+            for key in tf:
+                tf[key] = _cut(tf[key])
+
+    # Compliance and coherence functions (Comply)
+    if getattr(obj, 'complyfunc', None):
+        for key in obj.complyfunc:
+            obj.complyfunc[key] = [_cut(x) for x in obj.complyfunc[key]]
+
+    # Nyquist frequency is positive on the one-sided axis
+    obj.f = np.abs(obj.f[0:nr])
+    obj.onesided = True
+
+    return obj
+
+
+def spectral_matrix(fts, weights, nblock=2048):
+    """
+    Function to calculate the weighted averages of the auto and cross
+    spectra of several components, i.e. the Hermitian spectral matrix at
+    each frequency. All component pairs and all sets of weights (e.g.,
+    good and bad windows) are obtained in a single pass over the windowed
+    Fourier transforms, which are processed in blocks of frequencies to
+    limit the memory used by intermediate products.
+
+    Parameters
+    ----------
+    fts : list
+        List of ncomp :class:`~numpy.ndarray` of shape (nwin, nfreq) with
+        the windowed Fourier transforms of each component
+    weights : :class:`~numpy.ndarray`
+        Real-valued array of shape (nset, nwin) with the weight of each
+        window in each average (e.g., 1/ngood for good windows and 0
+        otherwise)
+    nblock : int, optional
+        Number of frequencies processed at once
+
+    Returns
+    -------
+    S : :class:`~numpy.ndarray`
+        Complex array of shape (nset, ncomp, ncomp, nfreq), where
+        ``S[k, i, j]`` is the weighted average of ``fts[i]*conj(fts[j])``
+        for the k-th set of weights
+
+    """
+
+    ncomp = len(fts)
+    nfreq = fts[0].shape[1]
+    outdtype = np.result_type(fts[0], np.complex64)
+    weights = np.atleast_2d(weights).astype(outdtype)
+
+    # Upper triangle - the lower triangle follows from Hermitian symmetry
+    iu, ju = np.triu_indices(ncomp)
+
+    S = np.empty((weights.shape[0], ncomp, ncomp, nfreq), dtype=outdtype)
+    for f0 in range(0, nfreq, nblock):
+        f1 = min(f0 + nblock, nfreq)
+        X = np.array([ft[:, f0:f1] for ft in fts])
+        R = np.matmul(weights, X[iu]*np.conj(X[ju])).transpose(1, 0, 2)
+        S[:, iu, ju, f0:f1] = R
+        S[:, ju, iu, f0:f1] = np.conj(R)
+
+    return S
+
+
 def calculate_tilt(ft1, ft2, ftZ, ftP, f, goodwins, tiltfreq=[0.005, 0.035]):
     """
     Determines tilt direction from maximum coherence between rotated H1 and Z.
+    The power and cross spectra are averaged over the good windows and
+    passed to :func:`~obstools.atacr.utils.solve_tilt`.
 
     Parameters
     ----------
@@ -405,87 +1185,119 @@ def calculate_tilt(ft1, ft2, ftZ, ftP, f, goodwins, tiltfreq=[0.005, 0.035]):
 
     """
 
-    direc = np.arange(0., 360., 10.)
-    coh = np.zeros(len(direc))
-    ph = np.zeros(len(direc))
-    cZZ = np.abs(np.mean(ftZ[goodwins, :] *
-                         np.conj(ftZ[goodwins, :]), axis=0))[0:len(f)]
-
-    for i, d in enumerate(direc):
-
-        # Rotate horizontals
-        ftH = rotate_dir(ft1, ft2, d)
-
-        # Get transfer functions
-        cHH = np.abs(np.mean(ftH[goodwins, :] *
-                             np.conj(ftH[goodwins, :]), axis=0))[0:len(f)]
-        cHZ = np.mean(ftH[goodwins, :] *
-                      np.conj(ftZ[goodwins, :]), axis=0)[0:len(f)]
-
-        Co = coherence(cHZ, cHH, cZZ)
-        Ph = phase(cHZ)
-
-        # Calculate coherence over frequency band
-        coh[i] = np.mean(Co[(f > tiltfreq[0]) & (f < tiltfreq[1])])
-        ph[i] = np.pi/2. - np.mean(Ph[(f > tiltfreq[0]) & (f < tiltfreq[1])])
+    # Average power and cross spectra over good windows
+    c11 = np.abs(np.mean(ft1[goodwins, :]*np.conj(ft1[goodwins, :]), axis=0))
+    c22 = np.abs(np.mean(ft2[goodwins, :]*np.conj(ft2[goodwins, :]), axis=0))
+    cZZ = np.abs(np.mean(ftZ[goodwins, :]*np.conj(ftZ[goodwins, :]), axis=0))
+    c12 = np.mean(ft1[goodwins, :]*np.conj(ft2[goodwins, :]), axis=0)
+    c1Z = np.mean(ft1[goodwins, :]*np.conj(ftZ[goodwins, :]), axis=0)
+    c2Z = np.mean(ft2[goodwins, :]*np.conj(ftZ[goodwins, :]), axis=0)
+    c1P = None
+    c2P = None
+    if np.any(ftP):
+        c1P = np.mean(ft1[goodwins, :]*np.conj(ftP[goodwins, :]), axis=0)
+        c2P = np.mean(ft2[goodwins, :]*np.conj(ftP[goodwins, :]), axis=0)
 
-    # Index where coherence is max
-    ind = np.argwhere(coh == coh.max())
+    return solve_tilt(c11, c22, cZZ, c12, c1Z, c2Z, f[0:len(c11)],
+                      c1P=c1P, c2P=c2P, tiltfreq=tiltfreq)
 
-    # Phase and direction at maximum coherence
-    phase_value = ph[ind[0]][0]
-    coh_value = coh[ind[0]][0]
-    tilt = direc[ind[0]][0]
 
-    # Refine search
-    rdirec = np.arange(direc[ind[0]][0]-10., direc[ind[0]][0]+10., 1.)
-    rcoh = np.zeros(len(direc))
-    rph = np.zeros(len(direc))
-
-    for i, d in enumerate(rdirec):
+def solve_tilt(c11, c22, cZZ, c12, c1Z, c2Z, f, c1P=None, c2P=None,
+               tiltfreq=[0.005, 0.035], dtilt=1.):
+    """
+    Determines tilt direction from maximum coherence between rotated H1 and
+    Z, using the averaged power and cross spectra. Since the rotation is
+    linear, the power spectrum of the rotated horizontal component H and
+    its cross spectra with Z and P are obtained in closed form for any
+    azimuth from the spectra of H1 and H2, without rotating the windowed
+    Fourier transforms. The coherence is evaluated on a fine grid of
+    azimuths between 0 and 180 degrees (the coherence has a 180-degree
+    periodicity) and the phase is used to resolve the tilt direction.
 
-        # Rotate horizontals
-        ftH = rotate_dir(ft1, ft2, d)
+    Parameters
+    ----------
+    c11, c22, cZZ : :class:`~numpy.ndarray`
+        Power spectral density functions of components H1, H2 and HZ
+    c12, c1Z, c2Z : :class:`~numpy.ndarray`
+        Cross spectral density functions of components H1-H2, H1-HZ and
+        H2-HZ
+    f : :class:`~numpy.ndarray`
+        Frequency axis in Hz
+    c1P, c2P : :class:`~numpy.ndarray`, optional
+        Cross spectral density functions of components H1-HP and H2-HP
+    tiltfreq : list, optional
+        Two floats representing the frequency band at which the tilt is
+        calculated
+    dtilt : float, optional
+        Azimuth increment (in degrees) of the grid used to find the
+        maximum coherence
 
-        # Get transfer functions
-        cHH = np.abs(np.mean(ftH[goodwins, :] *
-                             np.conj(ftH[goodwins, :]), axis=0))[0:len(f)]
-        cHZ = np.mean(ftH[goodwins, :] *
-                      np.conj(ftZ[goodwins, :]), axis=0)[0:len(f)]
+    Returns
+    -------
+    cHH, cHZ, cHP : :class:`~numpy.ndarray`
+        Arrays of power and cross-spectral density functions of components HH
+        (rotated H1 in direction of maximum tilt), HZ, and HP
+    coh : :class:`~numpy.ndarray`
+        Coherence value between rotated H and Z components, as a function of
+        directions (azimuths)
+    ph : :class:`~numpy.ndarray`
+        Phase value between rotated H and Z components, as a function of
+        directions (azimuths)
+    direc : :class:`~numpy.ndarray`
+        Array of directions (azimuths) considered
+    tilt : float
+        Direction (azimuth) of maximum coherence between rotated H1 and Z
+    coh_value : float
+        Coherence value at tilt direction
+    phase_value : float
+        Phase value at tilt direction
 
-        Co = coherence(cHZ, cHH, cZZ)
-        Ph = phase(cHZ)
+    """
 
-        # Calculate coherence over frequency band
-        rcoh[i] = np.mean(Co[(f > tiltfreq[0]) & (f < tiltfreq[1])])
-        rph[i] = np.pi/2. - np.mean(Ph[(f > tiltfreq[0]) & (f < tiltfreq[1])])
+    # Frequency band for tilt calculation
+    band = (f > tiltfreq[0]) & (f < tiltfreq[1])
+
+    def _rotate_spectra(direc, ff):
+        # Rotation coefficients as in rotate_dir (H = a*H1 + b*H2)
+        d = -np.atleast_1d(direc)*np.pi/180. + np.pi/2.
+        a = np.cos(d)[:, np.newaxis]
+        b = np.sin(d)[:, np.newaxis]
+        cHH = np.abs(a**2*c11[ff] + b**2*c22[ff] +
+                     2.*a*b*np.real(c12[ff]))
+        cHZ = a*c1Z[ff] + b*c2Z[ff]
+        return cHH, cHZ, a, b
+
+    def _coh_ph(direc):
+        cHH, cHZ, a, b = _rotate_spectra(direc, band)
+        Co = np.abs(cHZ)**2/(cHH*cZZ[band])
+        Ph = np.angle(cHZ)
+        return np.mean(Co, axis=1), np.pi/2. - np.mean(Ph, axis=1)
+
+    # Coherence and phase as a function of direction
+    direc = np.arange(0., 360., 10.)
+    coh, ph = _coh_ph(direc)
 
-    # Index where coherence is max
-    ind = np.argwhere(rcoh == rcoh.max())
+    # Direction of maximum coherence on fine grid
+    fdirec = np.arange(0., 180., dtilt)
+    fcoh, fph = _coh_ph(fdirec)
+    ind = np.argmax(fcoh)
 
     # Phase and direction at maximum coherence
-    phase_value = rph[ind[0]][0]
-    coh_value = rcoh[ind[0]][0]
-    tilt = rdirec[ind[0]][0]
+    phase_value = fph[ind]
+    coh_value = fcoh[ind]
+    tilt = fdirec[ind]
 
     # Phase has to be close to zero - otherwise add pi
     if phase_value > 0.5*np.pi:
         tilt += 180.
-    if tilt > 360.:
-        tilt -= 360.
-
-    # print('Maximum coherence for tilt = ', tilt)
 
     # Now calculate spectra at tilt direction
-    ftH = rotate_dir(ft1, ft2, tilt)
-
-    # Get transfer functions
-    cHH = np.abs(np.mean(ftH[goodwins, :] *
-                         np.conj(ftH[goodwins, :]), axis=0))[0:len(f)]
-    cHZ = np.mean(ftH[goodwins, :]*np.conj(ftZ[goodwins, :]), axis=0)[0:len(f)]
-    if np.any(ftP):
-        cHP = np.mean(ftH[goodwins, :] *
-                      np.conj(ftP[goodwins, :]), axis=0)[0:len(f)]
+    full = np.repeat([True], len(c11))
+    cHH, cHZ, a, b = _rotate_spectra(tilt, full)
+    cHH = cHH[0]
+    cHZ = cHZ[0]
+    if c1P is not None and c2P is not None:
+        cHP = a[0]*c1P + b[0]*c2P
     else:
         cHP = None
 
@@ -495,7 +1307,10 @@ def calculate_tilt(ft1, ft2, ftZ, ftP, f, goodwins, tiltfreq=[0.005, 0.035]):
 def smooth(data, nd, axis=0):
     """
     Function to smooth power spectral density functions from the convolution
-    of a boxcar function with the PSD
+    of a boxcar function with the PSD. The running mean is calculated along
+    the given axis of an array of any dimension, in a single call. Edges
+    are padded with zeros, as with :func:`~numpy.convolve` using
+    ``mode='same'``.
 
     Parameters
     ----------
@@ -513,22 +1328,113 @@ def smooth(data, nd, axis=0):
 
     """
     if np.any(data):
-        if data.ndim > 1:
-            filt = np.zeros(data.shape)
-            for i in range(data.shape[::-1][axis]):
-                if axis == 0:
-                    filt[:, i] = np.convolve(
-                        data[:, i], np.ones((nd,))/nd, mode='same')
-                elif axis == 1:
-                    filt[i, :] = np.convolve(
-                        data[i, :], np.ones((nd,))/nd, mode='same')
-        else:
-            filt = np.convolve(data, np.ones((nd,))/nd, mode='same')
-        return filt
+        return uniform_filter1d(
+            np.asarray(data, dtype=float), nd, axis=axis,
+            mode='constant', cval=0.)
     else:
         return None
 
 
+def loo_std_norm(dsl):
+    """
+    Function to calculate the leave-one-out standard deviation norms of a
+    set of (log) spectra. For each column `j`, this is the L2 norm (over
+    frequencies) of the standard deviation of all columns except `j`. The
+    running sums and sums of squares over all columns are computed once,
+    so that all leave-one-out norms are obtained in a single pass.
+
+    Parameters
+    ----------
+    dsl : :class:`~numpy.ndarray`
+        Real-valued array of shape (nfreq, nwin). Stacked arrays of shape
+        (ncomp, nfreq, nwin) are also accepted, in which case each
+        component is processed independently
+
+    Returns
+    -------
+    normvar : :class:`~numpy.ndarray`
+        Array of shape (nwin,) (or (ncomp, nwin)) with the norm of the
+        standard deviation obtained when removing each column in turn
+
+    """
+
+    nwin = dsl.shape[-1]
+
+    # Remove mean across columns to reduce round-off in the sums
+    x = dsl - np.mean(dsl, axis=-1, keepdims=True)
+
+    # Running sums and sums of squares for each frequency
+    s1 = np.sum(x, axis=-1, keepdims=True)
+    s2 = np.sum(x**2, axis=-1, keepdims=True)
+
+    # Leave-one-out variance for every column
+    mean_loo = (s1 - x)/(nwin - 1)
+    var_loo = (s2 - x**2)/(nwin - 1) - mean_loo**2
+    var_loo[var_loo < 0.] = 0.
+
+    return np.sqrt(np.sum(var_loo, axis=-2))
+
+
+def QC_outliers(dsls, tol=1.5, alpha=0.05):
+    """
+    Function to iteratively flag outliers (windows or days) from the
+    leave-one-out standard deviation norms of de-meaned log spectra.
+    At each iteration, columns with a penalty larger than `tol` times the
+    standard deviation of all penalties are removed, as long as their
+    removal is significant according to an f-test. This function is used
+    in both :func:`~obstools.atacr.classes.DayNoise.QC_daily_spectra` and
+    :func:`~obstools.atacr.classes.StaNoise.QC_sta_spectra`.
+
+    Parameters
+    ----------
+    dsls : list or :class:`~numpy.ndarray`
+        List of real-valued arrays of shape (nfreq, nwin), one for each
+        component, or stacked array of shape (ncomp, nfreq, nwin)
+    tol : float
+        Tolerance threshold. If penalty > std*tol, column is flagged as bad
+    alpha : float
+        Confidence interval for f-test
+
+    Returns
+    -------
+    good : :class:`~numpy.ndarray`
+        Array of booleans representing whether a column is good (True)
+        or not (False)
+    diagnostics : list
+        List of (ubernorm, penalty) tuples, one for each iteration, where
+        `ubernorm` has shape (ncomp, ngood) and `penalty` has shape (ngood,)
+
+    """
+
+    dsls = np.asarray(dsls)
+
+    good = np.repeat([True], dsls.shape[-1])
+    indwin = np.argwhere(good == True)
+    diagnostics = []
+
+    moveon = False
+    while moveon == False:
+
+        normvar = loo_std_norm(dsls[:, :, good])
+        ubernorm = np.median(normvar, axis=1, keepdims=True) - normvar
+        penalty = np.sum(ubernorm, axis=0)
+        diagnostics.append((ubernorm, penalty))
+
+        kill = penalty > tol*np.std(penalty)
+        if np.sum(kill) == 0:
+            break
+
+        trypenalty = penalty[np.argwhere(kill == False)].T[0]
+
+        if ftest(penalty, 1, trypenalty, 1) < alpha:
+            good[indwin[kill == True]] = False
+            indwin = np.argwhere(good == True)
+        else:
+            moveon = True
+
+    return good, diagnostics
+
+
 def admittance(Gxy, Gxx):
     """
     Calculates admittance between two components
@@ -615,6 +1521,77 @@ def rotate_dir(tr1, tr2, direc):
     return tr_1
 
 
+def correct_spectra(ftZ, ft1, ft2, ftP, transfunc, keys, tilt=None):
+    """
+    Function to remove the noise predicted by transfer functions from the
+    Fourier spectra of the vertical component. The spectra can be stacked
+    along leading axes (e.g., one row per event), with frequency along the
+    last axis. Terms that are shared by several corrections, i.e. the
+    vertical component cleaned from H1 and the horizontal component H2
+    cleaned from H1, or the rotated horizontal component, are only
+    computed once.
+
+    Parameters
+    ----------
+    ftZ, ft1, ft2, ftP : :class:`~numpy.ndarray`
+        Fourier spectra of the vertical, horizontal and pressure
+        components. Unused components can be None
+    transfunc : dict
+        Dictionary of transfer functions, as in the `transfunc` attribute
+        of :class:`~obstools.atacr.classes.TFNoise`
+    keys : list
+        Corrections to carry out (e.g., 'ZP', 'Z1', 'Z2-1', 'ZP-21', 'ZH',
+        'ZP-H')
+    tilt : float, optional
+        Tilt direction (degrees), required for 'ZH' and 'ZP-H'
+
+    Returns
+    -------
+    corrected : dict
+        Dictionary of corrected spectra of the vertical component, in the
+        order of `keys`
+
+    """
+
+    corrected = {}
+
+    if 'ZP' in keys:
+        corrected['ZP'] = ftZ - transfunc['ZP']['TF_ZP']*ftP
+
+    if 'Z1' in keys or 'Z2-1' in keys or 'ZP-21' in keys:
+        tf = transfunc['Z1'] if 'Z1' in transfunc else transfunc['ZP-21']
+        ftZ_1 = ftZ - tf['TF_Z1']*ft1
+        if 'Z1' in keys:
+            corrected['Z1'] = ftZ_1
+
+    if 'Z2-1' in keys or 'ZP-21' in keys:
+        tf = transfunc['Z2-1'] if 'Z2-1' in keys else transfunc['ZP-21']
+        ft2_1 = ft2 - ft1*tf['TF_21']
+        ftZ_21 = ftZ_1 - ft2_1*tf['TF_Z2-1']
+        if 'Z2-1' in keys:
+            corrected['Z2-1'] = ftZ_21
+
+    if 'ZP-21' in keys:
+        tf = transfunc['ZP-21']
+        ftP_21 = ftP - ft1*tf['TF_P1'] - ft2_1*tf['TF_P2-1']
+        corrected['ZP-21'] = ftZ_21 - ftP_21*tf['TF_ZP-21']
+
+    if 'ZH' in keys or 'ZP-H' in keys:
+
+        # Rotate horizontals
+        ftH = rotate_dir(ft1, ft2, tilt)
+
+        ftZ_H = ftZ - transfunc['ZH']['TF_ZH']*ftH
+        if 'ZH' in keys:
+            corrected['ZH'] = ftZ_H
+
+    if 'ZP-H' in keys:
+        tf = transfunc['ZP-H']
+        corrected['ZP-H'] = ftZ_H - (ftP - ftH*tf['TF_PH'])*tf['TF_ZP-H']
+
+    return {key: corrected[key] for key in keys if key in corrected}
+
+
 def ftest(res1, pars1, res2, pars2):
 
     from scipy.stats import f as f_dist
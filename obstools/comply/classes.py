@@ -23,7 +23,8 @@
 
 import numpy as np
 import pickle
-from obstools.atacr import utils, DayNoise, StaNoise
+from obstools.atacr import store, DayNoise, StaNoise, PartialSpectra
+from obstools.comply import wavenumber as wn
 np.seterr(all='ignore')
 
 
@@ -58,6 +59,8 @@ class Comply(object):
     complyfunc : Dict
         Dictionary of compliance and coherence functions given the available
         components.
+    onesided : bool
+        Whether the spectra are one-sided (True) or two-sided (False)
 
     """
 
@@ -95,6 +98,8 @@ class Comply(object):
         self.c2P = objnoise.cross.c2P
         self.cZP = objnoise.cross.cZP
         self.tf_list = objnoise.tf_list
+        self.onesided = getattr(objnoise, 'onesided', False)
+        self._partial = PartialSpectra.of(objnoise)
 
     class ComplyDict(dict):
 
@@ -104,11 +109,19 @@ class Comply(object):
         def add(self, key, value):
             self[key] = value
 
-    def calculate_compliance(self):
+    def calculate_compliance(self, exact=False):
         """
         Method to calculate compliance and coherence functions from the
         averaged (daily or station-averaged) noise spectra.
 
+        Parameters
+        ----------
+        exact : bool, optional
+            Whether to solve the dispersion relation of ocean surface
+            gravity waves exactly, instead of using the rational
+            approximation of :func:`~obstools.comply.wavenumber.approximate`
+            (see :func:`~obstools.comply.wavenumber.wavenumber`)
+
         Attributes
         ----------
         complyfunc : Dict
@@ -148,152 +161,53 @@ class Comply(object):
 
         """
 
-        def wavenumber(omega, H):
-            """
-            Function to approximate wavenumber from dispersion relation
-
-            H is depth below the seafloor, in meters
-            omega is a vector of positive angular frequencies
-
-            Stephen G. Mosher, 2020
-
-            """
-
-            import numpy.polynomial as poly
-
-            g = 9.79329
-            N = len(omega)
-
-            # Approximations for k when k*H is very large (deep case) or
-            # very small (shallow case)
-            k_deep = omega**2 / g
-            k_shal = omega / np.sqrt(g * H)
-
-            """
-            Alternatively, we can use a rational approximation to
-            tanh(x) to solve k for any omega. This approximation gives
-            a quartic equation, we take the positive real roots as the
-            value of k we're interested in. The rational approximation
-            being used is always better than the shallow approximation.
-            However, it's only better than the deep approximation if
-            k*H < 2.96. Therefore, we keep the solutions to k we find,
-            using the rational approximation for k*H < 2.96 and use the
-            deep water approximation to solve for k otherwise. The
-            average error is just under 1% and the maximum error is
-            2.5%.
-            """
-
-            k = np.zeros(len(omega))
-
-            for i, om in enumerate(omega):
-
-                if i == 0:
-                    k[i] = 0.
-                else:
-
-                    a0 = -27 * om**2 / g    # constant terms
-                    a1 = 0.                 # no linear terms
-                    a2 = 27 * H - (9 * om**2 * H**2)/g     # quadratic terms
-                    a3 = 0.                 # no cubic terms
-                    a4 = H**3           # quartic terms
-
-                    p = poly.Polynomial([a0, a1, a2, a3, a4])
-                    solu = poly.Polynomial.roots(p)
-                    positive_roots = solu[solu > 0]
-                    real_positive_root = \
-                        positive_roots[positive_roots.imag == 0].real[0]
-                    k[i] = real_positive_root
-
-            # For k*H >= 2.96, prefer the deep approximation above
-            for i, wavenumber in enumerate(k_deep):
-                if wavenumber * H > 2.96:
-                    k[i] = k_deep[i]
-
-            return k
-
         # Calculate wavenumber - careful here, elevation is negative
-        k = wavenumber(2.*np.pi*self.f, -1.*self.elevation)
+        k = wn.wavenumber(self.f, -1.*self.elevation, exact=exact)
 
         # Initialize empty dictionary
         complyfunc = self.ComplyDict()
 
+        # Conditioned spectra, shared with other objects initialized from
+        # the same noise object
+        partial = PartialSpectra.of(self)
+
         # Cycle through all available transfer functions in the objnoise
         # object
         for key, value in self.tf_list.items():
 
             if key == 'ZP':
                 if value:
-                    admit_ZP = utils.admittance(self.cZP, self.cPP)
-                    compl_ZP = k*admit_ZP
-                    coh_ZP = utils.coherence(self.cZP, self.cPP, self.cZZ)
+                    compl_ZP = k*np.abs(partial.gain('P', 'Z'))
+                    coh_ZP = partial.coherence('P', 'Z')
                     complyfunc.add('ZP', [compl_ZP, coh_ZP])
 
             elif key == 'ZP-21':
                 if value:
-                    lc1cZ = np.conj(self.c1Z)/self.c11
-                    lc1c2 = np.conj(self.c12)/self.c11
-                    lc1cP = np.conj(self.c1P)/self.c11
-
-                    coh_12 = utils.coherence(self.c12, self.c11, self.c22)
-                    coh_1P = utils.coherence(self.c1P, self.c11, self.cPP)
-                    coh_1Z = utils.coherence(self.c1Z, self.c11, self.cZZ)
-
-                    gc2c2_c1 = self.c22*(1. - coh_12)
-                    gcPcP_c1 = self.cPP*(1. - coh_1P)
-                    gcZcZ_c1 = self.cZZ*(1. - coh_1Z)
-
-                    gc2cZ_c1 = np.conj(self.c2Z) - np.conj(lc1c2*self.c1Z)
-                    gcPcZ_c1 = self.cZP - np.conj(lc1cP*self.c1Z)
-
-                    gc2cP_c1 = np.conj(self.c2P) - np.conj(lc1c2*self.c1P)
-
-                    lc2cP_c1 = gc2cP_c1/gc2c2_c1
-                    lc2cZ_c1 = gc2cZ_c1/gc2c2_c1
-
-                    coh_c2cP_c1 = utils.coherence(gc2cP_c1, gc2c2_c1,
-                                                  gcPcP_c1)
-                    coh_c2cZ_c1 = utils.coherence(gc2cZ_c1, gc2c2_c1,
-                                                  gcZcZ_c1)
-
-                    gcPcP_c1c2 = gcPcP_c1*(1. - coh_c2cP_c1)
-                    gcPcZ_c1c2 = gcPcZ_c1 - np.conj(lc2cP_c1)*gc2cZ_c1
-                    gcZcZ_c1c2 = gcZcZ_c1*(1. - coh_c2cZ_c1)
-
-                    admit_ZP_21 = utils.admittance(
-                        gcPcZ_c1c2, gcPcP_c1c2)
-                    compl_ZP_21 = k*admit_ZP_21
-                    coh_ZP_21 = utils.coherence(
-                        gcPcZ_c1c2, gcPcP_c1c2, gcZcZ_c1c2)
-
+                    compl_ZP_21 = k*np.abs(partial.gain('P', 'Z', ('1', '2')))
+                    coh_ZP_21 = partial.coherence('P', 'Z', ('1', '2'))
                     complyfunc.add('ZP-21', [compl_ZP_21, coh_ZP_21])
 
             elif key == 'ZP-H':
                 if value:
-                    lcHcP = np.conj(self.cHP)/self.cHH
-
-                    coh_HP = utils.coherence(self.cHP, self.cHH, self.cPP)
-                    coh_HZ = utils.coherence(self.cHZ, self.cHH, self.cZZ)
-
-                    gcPcP_cH = self.cPP*(1. - coh_HP)
-                    gcZcZ_cH = self.cZZ*(1. - coh_HZ)
-                    gcPcZ_cH = self.cZP - np.conj(lcHcP*self.cHZ)
-
-                    admit_ZP_H = utils.admittance(gcPcZ_cH, gcPcP_cH)
-                    compl_ZP_H = k*admit_ZP_H
-                    coh_ZP_H = utils.coherence(gcPcZ_cH, gcPcP_cH, gcZcZ_cH)
-
+                    compl_ZP_H = k*np.abs(partial.gain('P', 'Z', ('H',)))
+                    coh_ZP_H = partial.coherence('P', 'Z', ('H',))
                     complyfunc.add('ZP-H', [compl_ZP_H, coh_ZP_H])
 
             self.complyfunc = complyfunc
 
     def save(self, filename, form='pkl'):
         """
-        Method to save the object to file using `~Pickle`.
+        Method to save the object to file using `~Pickle`, the binary store
+        format of :mod:`~obstools.atacr.store` or as a csv table. The
+        extension `form` is appended to the file name.
 
         Parameters
         ----------
-        filename : str
+        filename : :class:`~pathlib.Path` object
             File name
+        form : str, optional
+            File format, either 'pkl' (pickle), 'spec' (binary store) or
+            'csv' (compliance and coherence functions only)
 
         Examples
         --------
@@ -316,7 +230,7 @@ class Comply(object):
             print("Warning: saving before having calculated the compliance " +
                   "and coherence functions")
 
-        if form == 'pkl':
+        if form == 'pkl' or form == 'spec':
 
             # Remove traces to save disk space
             del self.c11
@@ -332,10 +246,16 @@ class Comply(object):
             del self.c2Z
             del self.c2P
             del self.cZP
+            del self._partial
 
-            file = open(filename.parent / (filename.name + '.' + form), 'wb')
-            pickle.dump(self, file)
-            file.close()
+            if form == 'spec':
+                store.save(
+                    self, filename.parent / (filename.name + '.' + form))
+            else:
+                file = open(
+                    filename.parent / (filename.name + '.' + form), 'wb')
+                pickle.dump(self, file)
+                file.close()
 
         elif form == 'csv':
 
@@ -0,0 +1,193 @@
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+:mod:`~obstools.comply.wavenumber` contains functions to calculate the
+wavenumber of ocean surface gravity waves from the dispersion relation
+
+.. math::
+
+   \\omega^2 = gk\\tanh(kH)
+
+for a whole frequency axis at once. Results are cached by frequency axis
+and depth, as they are reused for all noise objects of a station.
+
+"""
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# Gravitational acceleration (m/s^2)
+G = 9.79329
+
+# Maximum number of cached wavenumber vectors
+CACHE_SIZE = 16
+
+_cache = OrderedDict()
+
+
+def approximate(omega, H):
+    """
+    Function to approximate wavenumber from dispersion relation
+    (Stephen G. Mosher, 2020).
+
+    A rational approximation to tanh(x) gives the quartic equation
+
+    .. math::
+
+       H^3k^4 + (27H - 9\\omega^2H^2/g)k^2 - 27\\omega^2/g = 0
+
+    which has no odd terms and is therefore a quadratic equation in
+    :math:`k^2`, with a single positive root that is obtained in closed
+    form for all frequencies at once. The rational approximation is always
+    better than the shallow approximation, but only better than the deep
+    approximation :math:`k = \\omega^2/g` if kH < 2.96, which is used
+    otherwise. The average error is just under 1% and the maximum error is
+    2.5%.
+
+    Parameters
+    ----------
+    omega : :class:`~numpy.ndarray`
+        Angular frequencies (rad/s)
+    H : float
+        Depth below the sea surface (m, positive)
+
+    Returns
+    -------
+    k : :class:`~numpy.ndarray`
+        Wavenumbers (rad/m)
+
+    """
+
+    omega2 = np.asarray(omega, dtype=float)**2
+
+    # Coefficients of the quadratic equation a*y**2 + b*y + c = 0 in
+    # y = k**2. Since a > 0 and c <= 0, there is a single positive root,
+    # calculated without cancellation between b and the discriminant
+    a = H**3
+    b = 27.*H - 9.*omega2*H**2/G
+    c = -27.*omega2/G
+    sqdisc = np.sqrt(b**2 - 4.*a*c)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(b > 0., 2.*c/(-b - sqdisc), (-b + sqdisc)/(2.*a))
+    k = np.sqrt(np.abs(y))
+
+    # For k*H >= 2.96, prefer the deep approximation
+    k_deep = omega2/G
+    deep = k_deep*H > 2.96
+    k[deep] = k_deep[deep]
+
+    return k
+
+
+def refine(omega, H, k, rtol=1.e-12, maxiter=50):
+    """
+    Function to refine wavenumbers with Newton iterations on the exact
+    dispersion relation.
+
+    Parameters
+    ----------
+    omega : :class:`~numpy.ndarray`
+        Angular frequencies (rad/s)
+    H : float
+        Depth below the sea surface (m, positive)
+    k : :class:`~numpy.ndarray`
+        Initial wavenumbers (rad/m), e.g. from
+        :func:`~obstools.comply.wavenumber.approximate`
+    rtol : float, optional
+        Relative tolerance on the wavenumber updates
+    maxiter : int, optional
+        Maximum number of iterations
+
+    Returns
+    -------
+    k : :class:`~numpy.ndarray`
+        Wavenumbers (rad/m)
+
+    """
+
+    omega2 = np.asarray(omega, dtype=float)**2
+    k = np.array(k, dtype=float)
+
+    for i in range(maxiter):
+        th = np.tanh(k*H)
+        res = G*k*th - omega2
+        dres = G*th + G*k*H*(1. - th**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dk = np.where(dres > 0., res/dres, 0.)
+
+        # Keep wavenumbers positive
+        k = np.maximum(k - dk, 0.5*k)
+        if np.all(np.abs(dk) <= rtol*k):
+            break
+
+    return k
+
+
+def wavenumber(f, H, exact=False, cache=True):
+    """
+    Function to calculate the wavenumbers of ocean surface gravity waves
+    for a frequency axis, using either the approximation of
+    :func:`~obstools.comply.wavenumber.approximate` or, if `exact`, the
+    exact solution of the dispersion relation obtained from Newton
+    refinement of this approximation.
+
+    Parameters
+    ----------
+    f : :class:`~numpy.ndarray`
+        Frequencies (Hz). Negative frequencies (two-sided spectra) give the
+        same wavenumbers as positive ones
+    H : float
+        Depth below the sea surface (m, positive)
+    exact : bool, optional
+        Whether to solve the dispersion relation exactly
+    cache : bool, optional
+        Whether to reuse and store results for the same frequency axis and
+        depth
+
+    Returns
+    -------
+    k : :class:`~numpy.ndarray`
+        Wavenumbers (rad/m). Cached arrays are read-only
+
+    """
+
+    f = np.asarray(f, dtype=float)
+    if cache:
+        key = (hashlib.sha1(f.tobytes()).hexdigest(), f.shape, float(H),
+               bool(exact))
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    omega = 2.*np.pi*f
+    k = approximate(omega, H)
+    if exact:
+        k = refine(omega, H, k)
+
+    if cache:
+        k.setflags(write=False)
+        _cache[key] = k
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return k
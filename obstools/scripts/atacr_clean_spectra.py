@@ -28,7 +28,7 @@ import numpy as np
 import pickle
 import stdb
 from obstools.atacr import StaNoise, Power, Cross, Rotation
-from obstools.atacr import utils, plotting
+from obstools.atacr import utils, plotting, store
 from pathlib import Path
 
 from argparse import ArgumentParser
@@ -36,6 +36,12 @@ from os.path import exists as exist
 from obspy import UTCDateTime
 from numpy import nan
 
+# File storing the state of incremental station averages
+STATE_FILE = 'sta_state.pkl'
+
+# Suffix of the spectral cubes of station averages on disk
+CUBE_FILE = 'sta_cube.npy'
+
 
 def get_cleanspec_arguments(argv=None):
     """
@@ -81,6 +87,41 @@ def get_cleanspec_arguments(argv=None):
         default=False,
         help="Force the overwriting of pre-existing data. " +
         "[Default False]")
+    parser.add_argument(
+        "--save-format",
+        action="store",
+        type=str,
+        dest="saveformat",
+        default="pkl",
+        help="Specify the format of the output files. Options are: " +
+        "'pkl' (pickle) or 'spec' (binary format of " +
+        "obstools.atacr.store, loaded without copy through a memory " +
+        "map). Files in either format are read by all scripts. " +
+        "[Default 'pkl']")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        default=False,
+        help="Update the station average incrementally. Only the daily " +
+        "spectra that are not in the average from a previous run, or " +
+        "whose file has changed since, are loaded, and days outside of " +
+        "the time range are removed. The " +
+        "state of the average is stored in AVG_STA/<key>/" + STATE_FILE +
+        " and is rebuilt when overwriting. Existing averages are " +
+        "updated. Cannot be used with figures. " +
+        "[Default False]")
+    parser.add_argument(
+        "--cube",
+        action="store_true",
+        dest="cube",
+        default=False,
+        help="Accumulate the daily spectra into a memory-mapped " +
+        "spectral cube on disk (AVG_STA/<key>/<start>-<end>." +
+        CUBE_FILE + ") instead of keeping them in memory, such that " +
+        "averages over many years of data fit in a fixed memory " +
+        "budget. Cannot be used with --incremental, --figCoh or " +
+        "--figCross. [Default False]")
 
     # Event Selection Criteria
     DaysGroup = parser.add_argument_group(
@@ -202,6 +243,20 @@ def get_cleanspec_arguments(argv=None):
     if not exist(args.indb):
         parser.error("Input file " + args.indb + " does not exist")
 
+    # Check output format
+    if args.saveformat not in ['pkl', 'spec']:
+        parser.error(
+            "Error: Specify either 'pkl' or 'spec' for --save-format")
+
+    if args.incremental and (args.fig_QC or args.debug or args.fig_average or
+                             args.fig_coh_ph or args.fig_av_cross):
+        parser.error("Figures cannot be produced with --incremental")
+    if args.cube and (args.incremental or args.fig_coh_ph or
+                      args.fig_av_cross):
+        parser.error(
+            "--cube cannot be used with --incremental, --figCoh or " +
+            "--figCross")
+
     # create station key list
     if len(args.stkeys) > 0:
         args.stkeys = args.stkeys.split(',')
@@ -241,6 +296,81 @@ def get_cleanspec_arguments(argv=None):
     return args
 
 
+def update_sta_average(specpath, avstpath, tstart, tend, args):
+    """
+    Updates the incremental station average stored in `avstpath` with the
+    daily spectra between `tstart` and `tend` that it does not contain yet
+    or that were calculated again since the last update (according to the
+    modification time of their file), and removes the days outside of this
+    time range. All days are removed and added in one go, such that the
+    quality control is only repeated once.
+
+    Returns
+    -------
+    stanoise : :class:`~obstools.atacr.classes.StaNoise`
+        Updated station average, or None if no daily spectra were found
+
+    """
+
+    filestate = avstpath / STATE_FILE
+    if filestate.exists() and not args.ovr:
+        print("*   -> file "+str(filestate)+" found - loading")
+        stanoise = store.load(filestate)
+    else:
+        stanoise = StaNoise()
+    present = getattr(stanoise, 'tkeys', [])
+    stamps = getattr(stanoise, 'stamps', {})
+
+    # Days within time range
+    tkeys = []
+    t1 = tstart
+    while t1 < tend:
+        tkeys.append(str(t1.year)+'.'+str(t1.julday))
+        t1 += 3600.*24.
+
+    old = [tkey for tkey in present if tkey not in tkeys]
+    for tkey in old:
+        print("*   -> removing day "+tkey)
+
+    new = []
+    for tkey in tkeys:
+        year, jday = tkey.split('.')
+        filespec = store.find(
+            specpath / (year.zfill(4)+'.'+jday.zfill(3)+'.spectra'))
+        if filespec is None:
+            if tkey in present:
+                print("*   -> no spectra for day "+tkey+" - removing")
+                old.append(tkey)
+            continue
+        stamp = filespec.stat().st_mtime_ns
+        if tkey in present:
+            if stamps.get(tkey) == stamp:
+                continue
+            print("*   -> file "+str(filespec)+" changed - updating average")
+            old.append(tkey)
+        else:
+            print("*   -> file "+str(filespec)+" found - updating average")
+        new.append((tkey, filespec, stamp))
+
+    if old:
+        stanoise.remove(old)
+    if new:
+        stanoise.update((store.load(filespec) for _, filespec, _ in new),
+                        pd=args.pd, tol=args.tol, alpha=args.alpha)
+        stamps.update({tkey: stamp for tkey, _, stamp in new})
+        stanoise.stamps = stamps
+
+    if not getattr(stanoise, 'tkeys', []):
+        print("*   -> no daily spectra found - continuing")
+        return None
+
+    print("*   -> "+str(sum(stanoise.gooddays))+" good days out of " +
+          str(len(stanoise.tkeys)))
+    stanoise.save(filestate, state=True)
+
+    return stanoise
+
+
 def main(args=None):
 
     if args is None:
@@ -342,13 +472,22 @@ def main(args=None):
         # Filename for output average spectra
         dstart = str(tstart.year).zfill(4)+'.'+str(tstart.julday).zfill(3)+'-'
         dend = str(tend.year).zfill(4)+'.'+str(tend.julday).zfill(3)+'.'
-        fileavst = avstpath / (dstart+dend+'avg_sta.pkl')
+        fileavst = avstpath / (dstart+dend+'avg_sta.'+args.saveformat)
 
-        if fileavst.exists():
+        # Incremental averages are updated in place
+        fileexist = store.find(avstpath / (dstart+dend+'avg_sta'))
+        if fileexist is not None and not args.incremental:
             if not args.ovr:
-                print("*   -> file "+str(fileavst)+" exists - continuing")
+                print("*   -> file "+str(fileexist)+" exists - continuing")
                 continue
 
+        if args.incremental:
+            stanoise = update_sta_average(
+                specpath, avstpath, tstart, tend, args)
+            if stanoise is not None:
+                stanoise.save(fileavst, form=args.saveformat)
+            continue
+
         # Containers for power and cross spectra
         coh_all = []
         ph_all = []
@@ -374,8 +513,22 @@ def main(args=None):
 
         t1 = tstart
 
-        # Initialize StaNoise object
-        stanoise = StaNoise()
+        # Initialize StaNoise object, with the daily spectra on disk if
+        # requested
+        if args.cube:
+            # The cube is sized for the days with daily spectra
+            ndays = 0
+            tday = tstart
+            while tday < tend:
+                tstamp = str(tday.year).zfill(4)+'.' + \
+                    str(tday.julday).zfill(3)
+                if store.find(specpath / (tstamp+'.spectra')) is not None:
+                    ndays += 1
+                tday += 3600.*24.
+            stanoise = StaNoise(
+                cube=avstpath / (dstart+dend+CUBE_FILE), ndays=max(ndays, 1))
+        else:
+            stanoise = StaNoise()
 
         # Loop through each day withing time range
         while t1 < tend:
@@ -384,22 +537,25 @@ def main(args=None):
             jday = str(t1.julday).zfill(3)
 
             tstamp = year+'.'+jday+'.'
-            filespec = specpath / (tstamp + 'spectra.pkl')
+            filespec = store.find(specpath / (tstamp + 'spectra'))
 
             # Load file if it exists
-            if filespec.exists():
+            if filespec is not None:
                 print("\n"+"*"*60)
                 print('* Calculating noise spectra for key ' +
                       stkey+' and day '+year+'.'+jday)
                 print("*   -> file "+str(filespec)+" found - loading")
-                file = open(filespec, 'rb')
-                daynoise = pickle.load(file)
-                file.close()
+                daynoise = store.load(filespec)
                 stanoise += daynoise
             else:
                 t1 += 3600.*24.
                 continue
 
+            # Daily quantities are only kept for the figures
+            if args.cube:
+                t1 += 3600.*24.
+                continue
+
             coh_all.append(daynoise.rotation.coh)
             ph_all.append(daynoise.rotation.ph)
 
@@ -577,7 +733,7 @@ def main(args=None):
                 plot.show()
 
         # Save to file
-        stanoise.save(fileavst)
+        stanoise.save(fileavst, form=args.saveformat)
 
 
 if __name__ == "__main__":
@@ -29,7 +29,7 @@ from obspy import UTCDateTime, Stream
 import pickle
 import stdb
 from obstools.atacr import EventStream
-from obstools.atacr import utils, plotting
+from obstools.atacr import utils, plotting, store
 from pathlib import Path
 
 from argparse import ArgumentParser
@@ -86,6 +86,35 @@ def get_correct_arguments(argv=None):
         default=False,
         help="Force the overwriting of pre-existing data. " +
         "[Default False]")
+    parser.add_argument(
+        "--save-format",
+        action="store",
+        type=str,
+        dest="saveformat",
+        default="pkl",
+        help="Specify the format of the output files. Options are: " +
+        "'pkl' (pickle) or 'spec' (binary format of " +
+        "obstools.atacr.store, loaded without copy through a memory " +
+        "map). Files in either format are read by all scripts. " +
+        "[Default 'pkl']")
+    parser.add_argument(
+        "--catalog-cache",
+        action="store",
+        type=str,
+        dest="catalog_cache",
+        default="",
+        help="Specify the folder in which the catalogs of the SAC files " +
+        "of the data folders are cached to disk, such that the folders " +
+        "are only listed again when files are added or removed. Must " +
+        "be outside of the data folders. [Default obstools/catalogs " +
+        "in the user cache folder, i.e. $XDG_CACHE_HOME or ~/.cache]")
+    parser.add_argument(
+        "--no-catalog-cache",
+        action="store_true",
+        dest="no_catalog_cache",
+        default=False,
+        help="Do not cache the catalogs of the data folders to disk. " +
+        "[Default False]")
 
     # Event Selection Criteria
     DaysGroup = parser.add_argument_group(
@@ -194,6 +223,19 @@ def get_correct_arguments(argv=None):
     if not exist(args.indb):
         parser.error("Input file " + args.indb + " does not exist")
 
+    # Check output format
+    if args.saveformat not in ['pkl', 'spec']:
+        parser.error(
+            "Error: Specify either 'pkl' or 'spec' for --save-format")
+
+    # Folder of the catalogs cached to disk, if any
+    if args.no_catalog_cache:
+        args.catalog_cache = None
+    elif len(args.catalog_cache) > 0:
+        args.catalog_cache = Path(args.catalog_cache)
+    else:
+        args.catalog_cache = utils.CATALOG_CACHE
+
     # create station key list
     if len(args.stkeys) > 0:
         args.stkeys = args.stkeys.split(',')
@@ -227,6 +269,67 @@ def get_correct_arguments(argv=None):
     return args
 
 
+def save_corrected(eventstream, tfnoise, kind, sta, eventpath, plotpath,
+                   args):
+    """
+    Plots and saves to disk the corrected vertical components of an event,
+    obtained from either the "cleaned" spectral averages (`kind='sta'`) or
+    the "daily" spectral averages (`kind='day'`).
+
+    """
+
+    # Check if Trace is from SAC file with event info
+    evlo = None
+    evla = None
+    if hasattr(eventstream.trZ.stats, 'sac'):
+        if hasattr(eventstream.trZ.stats.sac, 'evlo'):
+            evlo = eventstream.trZ.stats.sac.evlo
+            evla = eventstream.trZ.stats.sac.evla
+
+    if args.fig_plot_corrected:
+        fname = eventstream.prefix + '.' + kind + '_corrected'
+        plot = plotting.fig_event_corrected(
+            eventstream, tfnoise.tf_list)
+        # Save or show figure
+        if plotpath:
+            plot.savefig(
+                plotpath / (fname + '.' + args.form),
+                dpi=300, bbox_inches='tight', format=args.form)
+        else:
+            plot.show()
+
+    # Save corrected data to disk
+    correctpath = eventpath / 'CORRECTED'
+    if not correctpath.is_dir():
+        correctpath.mkdir(parents=True)
+    file = correctpath / eventstream.prefix
+    eventstream.save(str(file) + '.' + kind + '.' + args.saveformat,
+                     form=args.saveformat)
+
+    # Now save as SAC files
+    for key, value in tfnoise.tf_list.items():
+        if value and eventstream.ev_list[key]:
+
+            # Postfix
+            nameZ = '.' + kind + '.' + key + '.'
+            nameZ += sta.channel + 'Z.SAC'
+
+            # Add Prefix and Postfix
+            fileZ = str(file) + nameZ
+
+            # Select Z component and update trace
+            trZ = eventstream.trZ.copy()
+            trZ.data = eventstream.correct[key]
+            trZ = utils.update_stats(
+                trZ, sta.latitude, sta.longitude,
+                sta.elevation, sta.channel+'Z',
+                evla=evla,
+                evlo=evlo)
+
+            # Save as SAC file
+            trZ.write(str(fileZ), format='SAC')
+
+
 def main(args=None):
 
     if args is None:
@@ -327,30 +430,23 @@ def main(args=None):
         print("|-----------------------------------------------|")
 
         # Get all components
-        trE1, trE2, trEZ, trEP = utils.get_event(eventpath, tstart, tend)
+        trE1, trE2, trEZ, trEP = utils.get_event(
+            eventpath, tstart, tend, cache_dir=args.catalog_cache)
 
-        # Find all TF files in directory
-        p = list(transpath.glob('*.*'))
-        trans_files = [x for x in p if x.is_file()]
+        # Index all TF files in directory
+        registry = store.TFRegistry(transpath)
 
         # Check if folders contain anything
-        if not trans_files:
+        if not len(registry):
             raise(Exception("There are no transfer functions in folder " +
                             str(transpath)))
 
         # Cycle through available data
+        eventstreams = []
         for tr1, tr2, trZ, trP in zip(trE1, trE2, trEZ, trEP):
 
             eventstream = EventStream(tr1, tr2, trZ, trP)
 
-            # Check if Trace is from SAC file with event info
-            evlo = None
-            evla = None
-            if hasattr(trZ.stats, 'sac'):
-                if hasattr(trZ.stats.sac, 'evlo'):
-                    evlo = trZ.stats.sac.evlo
-                    evla = trZ.stats.sac.evla
-
             if args.fig_event_raw:
                 fname = stkey + '.' + eventstream.tstamp + 'raw'
                 plot = plotting.fig_event_raw(
@@ -364,154 +460,43 @@ def main(args=None):
                 else:
                     plot.show()
 
-            # Cycle through corresponding TF files
-            for transfile in trans_files:
+            eventstreams.append(eventstream)
+
+        # Cycle through the "cleaned" spectral averages ('sta') and the
+        # "daily" spectral averages ('day')
+        for kind in ['sta', 'day']:
+            if kind == 'sta' and args.skip_clean:
+                continue
+            if kind == 'day' and args.skip_daily:
+                continue
+
+            # Group events by corresponding TF file
+            groups = {}
+            for eventstream in eventstreams:
+                for transfile in registry.find(eventstream.evtime, kind):
+                    groups.setdefault(transfile, []).append(eventstream)
+
+            for transfile, group in sorted(groups.items()):
 
-                # Skip hidden files and folders
-                if transfile.name[0] == '.':
+                print(str(transfile) +
+                      " file found - applying transfer functions")
+
+                try:
+                    tfaverage = registry.load(transfile)
+                except Exception:
+                    print("File "+str(transfile) +
+                          " exists but cannot be loaded")
                     continue
 
-                tfprefix = transfile.name.split('transfunc')[0]
-                print(tfprefix)
-
-                # This case refers to the "cleaned" spectral averages
-                if len(tfprefix) > 9:
-                    if not args.skip_clean:
-
-                        yr1 = tfprefix.split('-')[0].split('.')[0]
-                        jd1 = tfprefix.split('-')[0].split('.')[1]
-                        yr2 = tfprefix.split('-')[1].split('.')[0]
-                        jd2 = tfprefix.split('-')[1].split('.')[1]
-                        date1 = UTCDateTime(yr1+'-'+jd1)
-                        date2 = UTCDateTime(yr2+'-'+jd2)
-                        dateev = eventstream.evtime
-
-                        if dateev >= date1 and dateev <= date2:
-                            print(str(transfile) +
-                                  " file found - applying transfer functions")
-
-                            try:
-                                file = open(transfile, 'rb')
-                                tfaverage = pickle.load(file)
-                                file.close()
-                            except Exception:
-                                print("File "+str(transfile) +
-                                      " exists but cannot be loaded")
-                                continue
-
-                            # List of possible transfer functions for station
-                            # average files
-                            eventstream.correct_data(tfaverage)
-
-                            correct_sta = eventstream.correct
-                            if args.fig_plot_corrected:
-                                fname = eventstream.prefix + '.sta_corrected'
-                                plot = plotting.fig_event_corrected(
-                                    eventstream, tfaverage.tf_list)
-                                # Save or show figure
-                                if plotpath:
-                                    plot.savefig(
-                                        plotpath / (fname + '.' + args.form),
-                                        dpi=300, bbox_inches='tight',
-                                        format=args.form)
-                                else:
-                                    plot.show()
-
-                            # Save corrected data to disk
-                            correctpath = eventpath / 'CORRECTED'
-                            if not correctpath.is_dir():
-                                correctpath.mkdir(parents=True)
-                            file = correctpath / eventstream.prefix
-                            eventstream.save(str(file) + '.sta.pkl')
-
-                            # Now save as SAC files
-                            for key, value in tfaverage.tf_list.items():
-                                if value and eventstream.ev_list[key]:
-
-                                    # Postfix
-                                    nameZ = '.sta.' + key + '.'
-                                    nameZ += sta.channel + 'Z.SAC'
-
-                                    # Add Prefix and Postfix
-                                    fileZ = str(file) + nameZ
-
-                                    # Select Z component and update trace
-                                    trZ = eventstream.trZ.copy()
-                                    trZ.data = eventstream.correct[key]
-                                    trZ = utils.update_stats(
-                                        trZ, sta.latitude, sta.longitude,
-                                        sta.elevation, sta.channel+'Z',
-                                        evla=evla,
-                                        evlo=evlo)
-
-                                    # Save as SAC file
-                                    trZ.write(str(fileZ), format='SAC')
-
-                # This case refers to the "daily" spectral averages
-                else:
-                    if not args.skip_daily:
-                        evprefix = eventstream.tstamp.split('.')
-                        evstamp = evprefix[0]+'.'+evprefix[1]+'.'
-                        if tfprefix == evstamp:
-                            print(str(transfile) +
-                                  " file found - applying transfer functions")
-
-                            try:
-                                file = open(transfile, 'rb')
-                                tfaverage = pickle.load(file)
-                                file.close()
-                            except Exception:
-                                print("File "+str(transfile) +
-                                      " exists but cannot be loaded")
-                                continue
-
-                            # List of possible transfer functions for station
-                            # average files
-                            eventstream.correct_data(tfaverage)
-
-                            correct_day = eventstream.correct
-                            if args.fig_plot_corrected:
-                                fname = eventstream.prefix + '.day_corrected'
-                                plot = plotting.fig_event_corrected(
-                                    eventstream, tfaverage.tf_list)
-                                # Save or show figure
-                                if plotpath:
-                                    plot.savefig(
-                                        plotpath / (fname + '.' + args.form),
-                                        dpi=300, bbox_inches='tight',
-                                        format=args.form)
-                                else:
-                                    plot.show()
-
-                            # Save corrected data to disk
-                            correctpath = eventpath / 'CORRECTED'
-                            if not correctpath.is_dir():
-                                correctpath.mkdir(parents=True)
-                            file = correctpath / eventstream.prefix
-                            eventstream.save(str(file) + '.day.pkl')
-
-                            # Now save as SAC files
-                            for key, value in tfaverage.tf_list.items():
-                                if value and eventstream.ev_list[key]:
-
-                                    # Postfix
-                                    nameZ = '.day.' + key + '.'
-                                    nameZ += sta.channel+'Z.SAC'
-
-                                    # Add Prefix and Postfix
-                                    fileZ = str(file) + nameZ
-
-                                    # Select Z component and update trace
-                                    trZ = eventstream.trZ.copy()
-                                    trZ.data = eventstream.correct[key]
-                                    trZ = utils.update_stats(
-                                        trZ, sta.latitude, sta.longitude,
-                                        sta.elevation, sta.channel+'Z',
-                                        evla=evla,
-                                        evlo=evlo)
-
-                                    # Save as SAC file
-                                    trZ.write(str(fileZ), format='SAC')
+                # Correct all events at once
+                EventStream.correct_events(group, tfaverage)
+
+                for eventstream in group:
+                    save_corrected(eventstream, tfaverage, kind, sta,
+                                   eventpath, plotpath, args)
+
+                    # Release corrected traces
+                    del eventstream.correct
 
 
 if __name__ == "__main__":
@@ -28,12 +28,13 @@ import os
 import numpy as np
 import pickle
 import stdb
-from obstools.atacr import utils, DayNoise
+from obstools.atacr import utils, store, DayNoise, SegmentNoise
+from obstools.atacr.sds import SDSArchive, SDSStation
 from pathlib import Path
 
 from argparse import ArgumentParser
 from os.path import exists as exist
-from obspy import UTCDateTime
+from obspy import Trace, UTCDateTime, read_inventory
 from numpy import nan
 
 
@@ -83,6 +84,98 @@ def get_dailyspec_arguments(argv=None):
         default=False,
         help="Force the overwriting of pre-existing data. " +
         "[Default False]")
+    parser.add_argument(
+        "--save-format",
+        action="store",
+        type=str,
+        dest="saveformat",
+        default="pkl",
+        help="Specify the format of the output files. Options are: " +
+        "'pkl' (pickle) or 'spec' (binary format of " +
+        "obstools.atacr.store, loaded without copy through a memory " +
+        "map). Files in either format are read by all scripts. " +
+        "[Default 'pkl']")
+    parser.add_argument(
+        "--catalog-cache",
+        action="store",
+        type=str,
+        dest="catalog_cache",
+        default="",
+        help="Specify the folder in which the catalogs of the SAC files " +
+        "of the data folders are cached to disk, such that the folders " +
+        "are only listed again when files are added or removed. Must " +
+        "be outside of the data folders. [Default obstools/catalogs " +
+        "in the user cache folder, i.e. $XDG_CACHE_HOME or ~/.cache]")
+    parser.add_argument(
+        "--no-catalog-cache",
+        action="store_true",
+        dest="no_catalog_cache",
+        default=False,
+        help="Do not cache the catalogs of the data folders to disk. " +
+        "[Default False]")
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        dest="workers",
+        default=1,
+        help="Specify the number of worker processes used to process " +
+        "days (across all stations) in parallel. Errors for individual " +
+        "days are reported at the end of the run. Figures can only be " +
+        "saved (not shown) when using more than one worker. " +
+        "[Default 1, i.e. serial processing]")
+
+    # Data Settings
+    DataGroup = parser.add_argument_group(
+        title="Data Settings",
+        description="Settings associated with reading data from an SDS " +
+        "archive of MiniSEED files instead of the day-long SAC files " +
+        "in DATA/")
+    DataGroup.add_argument(
+        "--sds-path",
+        action="store",
+        type=str,
+        dest="sdspath",
+        default=None,
+        help="Specify the root folder of an SDS (SeisComP Data " +
+        "Structure) archive to read the data from. [Default None]")
+    DataGroup.add_argument(
+        "--inventory",
+        action="store",
+        type=str,
+        dest="inventory",
+        default="",
+        help="Specify a comma-separated list of StationXML files with " +
+        "the responses of the data in the SDS archive. If given, the " +
+        "archive is assumed to contain raw data, which are processed " +
+        "(detrended, filtered, resampled and response removed) as by " +
+        "atacr_download_data. Otherwise the archive is assumed to " +
+        "contain processed data. [Default None]")
+    DataGroup.add_argument(
+        "--sampling-rate",
+        action="store",
+        type=float,
+        dest="new_sampling_rate",
+        default=5.,
+        help="Specify new sampling rate (float, in Hz) of raw data. " +
+        "[Default 5.]")
+    DataGroup.add_argument(
+        "--units",
+        action="store",
+        type=str,
+        dest="units",
+        default="DISP",
+        help="Choose the output seismogram units of raw data. Options " +
+        "are: 'DISP', 'VEL', 'ACC'. [Default 'DISP']")
+    DataGroup.add_argument(
+        "--pre-filt",
+        action="store",
+        type=str,
+        dest="pre_filt",
+        default=None,
+        help="Specify four comma-separated corner frequencies " +
+        "(float, in Hz) for deconvolution pre-filter of raw data. " +
+        "[Default 0.001,0.005,45.,50.]")
 
     # Event Selection Criteria
     DaysGroup = parser.add_argument_group(
@@ -109,6 +202,34 @@ def get_dailyspec_arguments(argv=None):
         "representing the start time for the data search. " +
         "This will override any station end times. " +
         "[Default end date of each station n database]")
+    DaysGroup.add_argument(
+        "--span",
+        action="store",
+        type=int,
+        dest="span",
+        default=1,
+        help="Specify the number of consecutive days read at once and " +
+        "processed as continuous data, with windows sliding across " +
+        "midnight such that no data are lost at the day boundaries. " +
+        "Each window belongs to the segment (see --cadence) in which " +
+        "it starts, and the spectra are saved for each segment. " +
+        "Requires raw data from " +
+        "an SDS archive (--sds-path and --inventory), which are " +
+        "processed once for the whole block, since day files are " +
+        "processed (and tapered) separately. [Default 1, i.e. " +
+        "windows do not cross midnight]")
+    DaysGroup.add_argument(
+        "--cadence",
+        action="store",
+        type=int,
+        dest="cadence",
+        default=1,
+        help="Specify the number of days of the segments whose spectra " +
+        "are averaged and saved together, within the blocks read with " +
+        "--span (which should be a multiple of it). The spectra of each " +
+        "segment are saved under the name of its first day. Segments " +
+        "are whole days, since the daily spectra and transfer " +
+        "functions are found by day. [Default 1]")
 
     # Constants Settings
     ConstGroup = parser.add_argument_group(
@@ -185,6 +306,23 @@ def get_dailyspec_arguments(argv=None):
         default=True,
         help="Do not rotate horizontal components " +
         "to tilt direction. [Default calculates rotation]")
+    ConstGroup.add_argument(
+        "--one-sided",
+        action="store_true",
+        dest="onesided",
+        default=False,
+        help="Calculate and store spectra for non-negative frequencies " +
+        "only, which halves the computation and the size of the " +
+        "output files. [Default uses two-sided spectra]")
+    ConstGroup.add_argument(
+        "--streaming",
+        action="store_true",
+        dest="streaming",
+        default=False,
+        help="Accumulate the spectra one chunk of windows at a time " +
+        "instead of storing the Fourier transforms of all windows, " +
+        "which reduces memory usage and the size of the output files. " +
+        "[Default stores all Fourier transforms]")
 
     # Constants Settings
     FigureGroup = parser.add_argument_group(
@@ -240,6 +378,65 @@ def get_dailyspec_arguments(argv=None):
     if not exist(args.indb):
         parser.error("Input file " + args.indb + " does not exist")
 
+    # Check output format
+    if args.saveformat not in ['pkl', 'spec']:
+        parser.error(
+            "Error: Specify either 'pkl' or 'spec' for --save-format")
+
+    # Folder of the catalogs cached to disk, if any
+    if args.no_catalog_cache:
+        args.catalog_cache = None
+    elif len(args.catalog_cache) > 0:
+        args.catalog_cache = Path(args.catalog_cache)
+    else:
+        args.catalog_cache = utils.CATALOG_CACHE
+
+    # Check number of workers
+    if args.workers < 1:
+        parser.error("Error: --workers should be a positive integer")
+    if args.workers > 1 and not args.saveplot and (
+            args.fig_QC or args.debug or args.fig_average or
+            args.fig_coh_ph):
+        parser.error(
+            "Error: figures cannot be shown when using more than one " +
+            "worker - use --save-fig")
+
+    # Check number of days per block
+    if args.span < 1:
+        parser.error("Error: --span should be a positive integer")
+    if args.cadence < 1 or args.span % args.cadence != 0:
+        parser.error(
+            "Error: --cadence should be a positive integer that divides " +
+            "--span")
+
+    # Check data settings
+    if args.sdspath is not None and not os.path.isdir(args.sdspath):
+        parser.error("Error: SDS archive " + args.sdspath +
+                     " does not exist")
+    if len(args.inventory) > 0:
+        args.inventory = args.inventory.split(',')
+        for xmlfile in args.inventory:
+            if not exist(xmlfile):
+                parser.error("Error: File " + xmlfile + " does not exist")
+    else:
+        args.inventory = []
+    if args.span > 1 and (args.sdspath is None or not args.inventory):
+        parser.error(
+            "Error: --span requires raw data from an SDS archive - " +
+            "use --sds-path and --inventory")
+    if args.units not in ['DISP', 'VEL', 'ACC']:
+        parser.error(
+            "Error: invalid --units argument. Choose among " +
+            "'DISP', 'VEL', or 'ACC'")
+    if args.pre_filt is None:
+        args.pre_filt = [0.001, 0.005, 45., 50.]
+    else:
+        args.pre_filt = [float(val) for val in args.pre_filt.split(',')]
+        args.pre_filt = sorted(args.pre_filt)
+        if (len(args.pre_filt)) != 4:
+            parser.error(
+                "Error: --pre-filt should contain 4 comma-separated floats")
+
     # create station key list
     if len(args.stkeys) > 0:
         args.stkeys = args.stkeys.split(',')
@@ -285,6 +482,137 @@ def get_dailyspec_arguments(argv=None):
     return args
 
 
+def process_day(tr1, tr2, trZ, trP, stkey, filename, plotpath, args):
+    """
+    Function to calculate and save the noise spectra for a single day.
+
+    Parameters
+    ----------
+    tr1, tr2, trZ, trP : :class:`~obspy.core.Trace` object
+        Corresponding trace objects for components H1, H2, HZ and HP
+    stkey : str
+        Station key
+    filename : :class:`~pathlib.Path` object
+        File name of the saved DayNoise object
+    plotpath : :class:`~pathlib.Path` object
+        Path where figures are saved, or False
+    args : :class:`~argparse.Namespace`
+        Command-line arguments
+
+    Returns
+    -------
+    nwin : int
+        Number of good windows
+
+    """
+
+    # Initialize instance of DayNoise
+    daynoise = DayNoise(tr1, tr2, trZ, trP, args.window, args.overlap,
+                        key=stkey, onesided=args.onesided,
+                        streaming=args.streaming)
+
+    return process_daynoise(daynoise, filename, plotpath, args)
+
+
+def process_daynoise(daynoise, filename, plotpath, args):
+    """
+    Function to calculate and save the noise spectra of a DayNoise object.
+
+    Returns
+    -------
+    nwin : int
+        Number of good windows
+
+    """
+
+    # Quality control to identify outliers
+    daynoise.QC_daily_spectra(
+        pd=args.pd, tol=args.tol, alpha=args.alpha,
+        smooth=args.smooth, fig_QC=args.fig_QC,
+        save=plotpath, form=args.form, debug=args.debug)
+
+    # Average spectra for good windows
+    daynoise.average_daily_spectra(
+        calc_rotation=args.calc_rotation,
+        fig_average=args.fig_average,
+        fig_coh_ph=args.fig_coh_ph,
+        save=plotpath, form=args.form)
+
+    # Save to file
+    daynoise.save(filename, form=args.saveformat)
+
+    return np.sum(daynoise.goodwins)
+
+
+def process_day_path(datapath, tday, stkey, filename, plotpath, args):
+    """
+    Function to load the data for a single day from `datapath` and
+    calculate its noise spectra, such that only the data of the days
+    being processed are held in memory.
+
+    Returns
+    -------
+    nwin : int
+        Number of good windows, or None if no data are available
+
+    """
+
+    trN1, trN2, trNZ, trNP = utils.get_data(
+        datapath, tday, tday + 3600.*24., cache_dir=args.catalog_cache)
+    if len(trNZ) == 0:
+        return None
+
+    return process_day(
+        trN1[0], trN2[0], trNZ[0], trNP[0], stkey, filename, plotpath, args)
+
+
+def process_block(datapath, tstart, tend, stkey, specpath, plotpath, args):
+    """
+    Function to load consecutive days of raw data from `datapath` (an
+    :class:`~obstools.atacr.sds.SDSStation` object with an inventory),
+    processed once for the whole block, and calculate the noise spectra of
+    each day, with windows sliding continuously across midnight (see
+    :class:`~obstools.atacr.classes.SegmentNoise`). If the data of the
+    block cannot be processed as one stream (e.g., because of gaps), the
+    days are processed separately.
+
+    Returns
+    -------
+    nwins : list of tuple
+        Time stamp and number of good windows of each day, or None if its
+        spectra already exist
+
+    """
+
+    traces = datapath.get_span(tstart, tend)
+    if 'Z' in traces:
+        spans = [tuple(traces.get(comp, Trace())
+                       for comp in ['1', '2', 'Z', 'H'])]
+    else:
+        print("* Block "+str(tstart)+" - "+str(tend)+" is not " +
+              "continuous - processing days separately")
+        spans = zip(*utils.get_data(datapath, tstart, tend))
+
+    nwins = []
+    for tr1, tr2, trZ, trP in spans:
+        segnoise = SegmentNoise(
+            tr1, tr2, trZ, trP, args.window, args.overlap, key=stkey,
+            cadence=args.cadence*3600.*24., onesided=args.onesided,
+            streaming=args.streaming)
+        for daynoise in segnoise:
+            tstamp = str(daynoise.year).zfill(4)+'.' + \
+                str(daynoise.julday).zfill(3)
+            filename = specpath / (tstamp+'.spectra.'+args.saveformat)
+            if store.find(specpath / (tstamp+'.spectra')) is not None \
+                    and not args.ovr:
+                nwins.append((tstamp, None))
+                continue
+            nwins.append((tstamp, process_daynoise(
+                daynoise, filename, plotpath, args)))
+
+    return nwins
+
+
 def main(args=None):
 
     if args is None:
@@ -313,6 +641,23 @@ def main(args=None):
             stkeys = db.keys()
             sorted(stkeys)
 
+    # SDS archive and station metadata, if any
+    archive = None
+    inventory = None
+    if args.sdspath is not None:
+        archive = SDSArchive(args.sdspath)
+        for xmlfile in args.inventory:
+            if inventory is None:
+                inventory = read_inventory(xmlfile)
+            else:
+                inventory += read_inventory(xmlfile)
+
+    # Days queued for parallel processing
+    tasks = []
+
+    # Blocks of consecutive days queued for processing
+    blocks = []
+
     # Loop over station keys
     for stkey in list(stkeys):
 
@@ -320,10 +665,17 @@ def main(args=None):
         sta = db[stkey]
 
         # Path where data are located
-        datapath = Path('DATA') / stkey
-        if not datapath.is_dir():
-            print("\nPath to "+str(datapath)+" doesn`t exist - continuing")
-            continue
+        if archive is not None:
+            datapath = SDSStation(
+                archive, sta, inventory=inventory,
+                new_sampling_rate=args.new_sampling_rate,
+                pre_filt=args.pre_filt, units=args.units)
+        else:
+            datapath = Path('DATA') / stkey
+            if not datapath.is_dir():
+                print("\nPath to "+str(datapath)+" doesn`t exist - " +
+                      "continuing")
+                continue
 
         # Path where spectra will be saved
         specpath = Path('SPECTRA') / stkey
@@ -382,21 +734,40 @@ def main(args=None):
             sta.enddate.strftime("%Y-%m-%d %H:%M:%S")))
         print("|-----------------------------------------------|")
 
-        # Get all components
-        trN1, trN2, trNZ, trNP = utils.get_data(datapath, tstart, tend)
-
-        # Window size
-        window = args.window
-        overlap = args.overlap
-
         # minimum numer of windows
         minwin = args.minwin
 
-        # Time axis
-        taxis = np.arange(0., window, trNZ[0].stats.delta)
+        if args.span > 1:
+            # Only queue the blocks of days here
+            t1 = tstart
+            while t1 < tend:
+                t2 = min(t1 + args.span*3600.*24., tend)
+                blocks.append(
+                    (datapath, t1, t2, stkey, specpath, plotpath, args))
+                t1 += args.span*3600.*24.
+            continue
 
-        # Cycle through available data
-        for tr1, tr2, trZ, trP in zip(trN1, trN2, trNZ, trNP):
+        if args.workers > 1:
+            # Only queue the days here - data are loaded by the workers
+            t1 = tstart
+            while t1 < tend:
+                tstamp = str(t1.year).zfill(4)+'.' + \
+                    str(t1.julday).zfill(3)+'.'
+                filename = specpath / (tstamp+'spectra.'+args.saveformat)
+                filespec = store.find(specpath / (tstamp+'spectra'))
+                if filespec is not None and not args.ovr:
+                    print("*   -> file "+str(filespec)+" exists - continuing")
+                else:
+                    tasks.append(
+                        (datapath, t1, stkey, filename, plotpath, args))
+                t1 += 3600.*24.
+            continue
+
+        # Cycle through available data one day at a time, reading the
+        # next day in the background
+        for tr1, tr2, trZ, trP in utils.iter_data(
+                datapath, tstart, tend, prefetch=1,
+                cache_dir=args.catalog_cache):
 
             year = str(trZ.stats.starttime.year).zfill(4)
             jday = str(trZ.stats.starttime.julday).zfill(3)
@@ -405,40 +776,111 @@ def main(args=None):
             print("* Calculating noise spectra for key " +
                   stkey+" and day "+year+"."+jday)
             tstamp = year+'.'+jday+'.'
-            filename = specpath / (tstamp+'spectra.pkl')
+            filename = specpath / (tstamp+'spectra.'+args.saveformat)
+            filespec = store.find(specpath / (tstamp+'spectra'))
 
-            if filename.exists():
+            if filespec is not None:
                 if not args.ovr:
-                    print("*   -> file "+str(filename)+" exists - continuing")
+                    print("*   -> file "+str(filespec)+" exists - continuing")
                     continue
 
-            # Initialize instance of DayNoise
-            daynoise = DayNoise(tr1, tr2, trZ, trP, window, overlap, key=stkey)
-
-            # Quality control to identify outliers
-            daynoise.QC_daily_spectra(
-                pd=args.pd, tol=args.tol, alpha=args.alpha,
-                smooth=args.smooth, fig_QC=args.fig_QC,
-                save=plotpath, form=args.form, debug=args.debug)
+            # Calculate, average and save spectra
+            nwin = process_day(
+                tr1, tr2, trZ, trP, stkey, filename, plotpath, args)
 
             # Check if we have enough good windows
-            nwin = np.sum(daynoise.goodwins)
             if nwin < minwin:
                 print("*   Too few good data segments to calculate " +
                       "average day spectra")
-                # continue
             else:
-                print("*   {0} good windows. Proceeding...".format(nwin))
+                print("*   {0} good windows".format(nwin))
+
+    if args.workers > 1:
+        run_parallel(tasks, args)
+
+    if blocks:
+        run_blocks(blocks, args)
+
+
+def run_parallel(tasks, args):
+    """
+    Function to process the queued days in a pool of worker processes,
+    with progress reporting and a report of the days that failed.
+
+    """
+
+    ntask = len(tasks)
+    print("\n"+"*"*60)
+    print("* Processing {0} day(s) with {1} workers".format(
+        ntask, args.workers))
+
+    failed = []
+    for i, (task, nwin, error) in enumerate(utils.imap_bounded(
+            process_day_path, tasks, workers=args.workers)):
+        datapath, tday, stkey, filename, plotpath, _ = task
+        label = stkey + " " + str(tday.year).zfill(4) + "." + \
+            str(tday.julday).zfill(3)
+        if error is not None:
+            failed.append((label, error))
+            status = "FAILED ({0})".format(error)
+        elif nwin is None:
+            status = "no data"
+        elif nwin < args.minwin:
+            status = "{0} good windows - too few".format(nwin)
+        else:
+            status = "{0} good windows".format(nwin)
+        print("* [{0}/{1}] {2}: {3}".format(i + 1, ntask, label, status))
+
+    if failed:
+        print("\n"+"*"*60)
+        print("* {0} day(s) failed:".format(len(failed)))
+        for label, error in failed:
+            print("*   "+label+": "+type(error).__name__+": "+str(error))
 
-            # Average spectra for good windows
-            daynoise.average_daily_spectra(
-                calc_rotation=args.calc_rotation,
-                fig_average=args.fig_average,
-                fig_coh_ph=args.fig_coh_ph,
-                save=plotpath, form=args.form)
 
-            # Save to file
-            daynoise.save(filename)
+def run_blocks(tasks, args):
+    """
+    Function to process the queued blocks of consecutive days, in a pool
+    of worker processes if more than one worker is used, with progress
+    reporting and a report of the blocks that failed.
+
+    """
+
+    ntask = len(tasks)
+    print("\n"+"*"*60)
+    print("* Processing {0} block(s) of up to {1} days with {2} worker(s)"
+          .format(ntask, args.span, args.workers))
+
+    failed = []
+    for i, (task, nwins, error) in enumerate(utils.imap_bounded(
+            process_block, tasks, workers=args.workers)):
+        datapath, tstart, tend, stkey = task[:4]
+        label = stkey + " " + str(tstart.year).zfill(4) + "." + \
+            str(tstart.julday).zfill(3) + "-" + \
+            str((tend - 1.).year).zfill(4) + "." + \
+            str((tend - 1.).julday).zfill(3)
+        if error is not None:
+            failed.append((label, error))
+            print("* [{0}/{1}] {2}: FAILED ({3})".format(
+                i + 1, ntask, label, error))
+            continue
+        if not nwins:
+            print("* [{0}/{1}] {2}: no data".format(i + 1, ntask, label))
+        for tstamp, nwin in nwins:
+            if nwin is None:
+                status = "file exists"
+            elif nwin < args.minwin:
+                status = "{0} good windows - too few".format(nwin)
+            else:
+                status = "{0} good windows".format(nwin)
+            print("* [{0}/{1}] {2} {3}: {4}".format(
+                i + 1, ntask, stkey, tstamp, status))
+
+    if failed:
+        print("\n"+"*"*60)
+        print("* {0} block(s) failed:".format(len(failed)))
+        for label, error in failed:
+            print("*   "+label+": "+type(error).__name__+": "+str(error))
 
 
 if __name__ == "__main__":
@@ -28,9 +28,10 @@ import numpy as np
 import os.path
 import pickle
 import stdb
-from obspy.clients.fdsn import Client
 from obspy import Stream, UTCDateTime
 from obstools.atacr import utils
+from obstools.atacr import sources
+from obstools.atacr.download import RequestPool
 from pathlib import Path
 
 from argparse import ArgumentParser
@@ -95,6 +96,16 @@ def get_daylong_arguments(argv=None):
         default=False,
         help="Force the overwriting of pre-existing data. " +
         "[Default False]")
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        dest="workers",
+        default=1,
+        help="Specify the number of worker processes used to process " +
+        "(detrend, filter, resample, remove responses and save) the " +
+        "downloaded days in parallel, while further days are being " +
+        "downloaded. [Default 1, i.e. serial processing]")
 
     # Server Settings
     ServerGroup = parser.add_argument_group(
@@ -120,6 +131,76 @@ def get_daylong_arguments(argv=None):
         help="Enter your IRIS Authentification Username and Password " +
         "(--User-Auth='username:authpassword') to access and download " +
         "restricted data. [Default no user and password]")
+    ServerGroup.add_argument(
+        "--requests",
+        action="store",
+        type=int,
+        dest="nrequests",
+        default=4,
+        help="Specify the maximum number of concurrent requests sent to " +
+        "the data center. [Default 4]")
+    ServerGroup.add_argument(
+        "--retries",
+        action="store",
+        type=int,
+        dest="retries",
+        default=3,
+        help="Specify the number of times a failed request is repeated " +
+        "(requests for which there are no data are not repeated). " +
+        "[Default 3]")
+    ServerGroup.add_argument(
+        "--backoff",
+        action="store",
+        type=float,
+        dest="backoff",
+        default=2.,
+        help="Specify the waiting time (in sec) before repeating a failed " +
+        "request. The waiting time is doubled for each further attempt. " +
+        "[Default 2.]")
+
+    # Data Source Settings
+    SourceGroup = parser.add_argument_group(
+        title="Data Source Settings",
+        description="Settings associated with reading data from a local " +
+        "archive, or recording and replaying requests, instead of " +
+        "requesting data from the datacenter.")
+    SourceGroup.add_argument(
+        "--sds-path",
+        action="store",
+        type=str,
+        dest="sdspath",
+        default=None,
+        help="Specify the root folder of a local SDS (SeisComP Data " +
+        "Structure) archive of MiniSEED files to read data from, " +
+        "instead of the datacenter. Requires --inventory. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--inventory",
+        action="store",
+        type=str,
+        dest="inventory",
+        default="",
+        help="Specify a comma-separated list of StationXML files with " +
+        "the station metadata and responses of the SDS archive. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--replay",
+        action="store",
+        type=str,
+        dest="replay",
+        default=None,
+        help="Specify a folder in which requests are recorded. Requests " +
+        "already recorded are replayed from this folder instead of being " +
+        "sent again, such that the script can be run again offline. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--latency",
+        action="store",
+        type=float,
+        dest="latency",
+        default=0.,
+        help="Specify a time (in sec) added to each replayed request, to " +
+        "emulate the response time of a datacenter. [Default 0.]")
 
     """
     # Database Settings
@@ -207,6 +288,14 @@ def get_daylong_arguments(argv=None):
     if not exist(args.indb):
         parser.error("Input file " + args.indb + " does not exist")
 
+    # Check pool sizes
+    if args.workers < 1:
+        parser.error("Error: --workers should be a positive integer")
+    if args.nrequests < 1:
+        parser.error("Error: --requests should be a positive integer")
+    if args.retries < 0:
+        parser.error("Error: --retries should be a non-negative integer")
+
     # create station key list
     if len(args.stkeys) > 0:
         args.stkeys = args.stkeys.split(',')
@@ -254,6 +343,23 @@ def get_daylong_arguments(argv=None):
     else:
         args.UserAuth = []
 
+    # Check data source
+    if len(args.inventory) > 0:
+        args.inventory = args.inventory.split(',')
+    else:
+        args.inventory = []
+    for xmlfile in args.inventory:
+        if not exist(xmlfile):
+            parser.error("Error: File " + xmlfile + " does not exist")
+    if args.sdspath is not None:
+        if not os.path.isdir(args.sdspath):
+            parser.error("Error: SDS archive " + args.sdspath +
+                         " does not exist")
+        if len(args.inventory) == 0:
+            parser.error("Error: --sds-path requires --inventory")
+    if args.latency < 0.:
+        parser.error("Error: --latency should be non-negative")
+
     # # Parse Local Data directories
     # if args.localdata is not None:
     #     args.localdata = args.localdata.split(',')
@@ -310,6 +416,9 @@ def main(args=None):
             stkeys = db.keys()
             sorted(stkeys)
 
+    # Days to download, for all stations
+    tasks = []
+
     # Loop over station keys
     for stkey in list(stkeys):
 
@@ -322,13 +431,6 @@ def main(args=None):
             print('\nPath to '+str(datapath)+' doesn`t exist - creating it')
             datapath.mkdir(parents=True)
 
-        # Establish client
-        if len(args.UserAuth) == 0:
-            client = Client(args.Server)
-        else:
-            client = Client(
-                args.Server, user=args.UserAuth[0], password=args.UserAuth[1])
-
         # Get catalogue search start time
         if args.startT is None:
             tstart = sta.startdate
@@ -388,236 +490,243 @@ def main(args=None):
             # Time stamp
             tstamp = str(t1.year).zfill(4)+'.'+str(t1.julday).zfill(3)+'.'
 
-            print("\n"+"*"*60)
-            print("* Downloading day-long data for key "+stkey +
-                  " and day "+str(t1.year)+"."+str(t1.julday))
-            print("*")
-            print("* Channels selected: "+str(args.channels)+' and vertical')
-
             # Define file names (to check if files already exist)
-            # Horizontal 1 channel
-            file1 = datapath / (tstamp+'.'+sta.channel+'1.SAC')
-            # Horizontal 2 channel
-            file2 = datapath / (tstamp+'.'+sta.channel+'2.SAC')
-            # Vertical channel
-            fileZ = datapath / (tstamp+'.'+sta.channel+'Z.SAC')
-            # Pressure channel
-            fileP = datapath / (tstamp+'.'+sta.channel[0]+'DH.SAC')
-
-            if "P" not in args.channels:
-
-                # If data files exist, continue
-                if fileZ.exists() and file1.exists() and file2.exists():
-                    if not args.ovr:
-                        print(
-                            "*   "+tstamp +
-                            "*SAC                                 ")
-                        print(
-                            "*   -> Files already exist, " +
-                            "continuing            ")
-                        t1 += dt
-                        t2 += dt
-                        continue
-
-                channels = sta.channel.upper()+'1,'+sta.channel.upper() + \
-                    '2,'+sta.channel.upper()+'Z'
-
-                # Get waveforms from client
-                try:
-                    print("*   "+tstamp +
-                          "*SAC                                 ")
-                    print("*   -> Downloading Seismic data... ")
-                    sth = client.get_waveforms(
-                        network=sta.network, station=sta.station,
-                        location=sta.location[0], channel=channels,
-                        starttime=t1, endtime=t2, attach_response=True)
-                    print("*      ...done")
-
-                except Exception:
-                    print(" Error: Unable to download ?H? components - " +
-                          "continuing")
-                    t1 += dt
-                    t2 += dt
-                    continue
-
-                st = sth
-
-            elif "12" not in args.channels:
-
-                # If data files exist, continue
-                if fileZ.exists() and fileP.exists():
-                    if not args.ovr:
-                        print("*   "+tstamp +
-                              "*SAC                                 ")
-                        print("*   -> Files already exist, " +
-                              "continuing            ")
-                        t1 += dt
-                        t2 += dt
-                        continue
-
-                channels = sta.channel.upper() + 'Z'
-
-                # Get waveforms from client
-                try:
-                    print("*   "+tstamp +
-                          "*SAC                                 ")
-                    print("*   -> Downloading Seismic data... ")
-                    sth = client.get_waveforms(
-                        network=sta.network, station=sta.station,
-                        location=sta.location[0], channel=channels,
-                        starttime=t1, endtime=t2, attach_response=True)
-                    print("*      ...done")
-
-                except Exception:
-                    print(" Error: Unable to download ?H? components - " +
-                          "continuing")
-                    t1 += dt
-                    t2 += dt
-                    continue
-                try:
-                    print("*   -> Downloading Pressure data...")
-                    stp = client.get_waveforms(
-                        network=sta.network, station=sta.station,
-                        location=sta.location[0], channel='?DH',
-                        starttime=t1, endtime=t2, attach_response=True)
-                    print("*      ...done")
-                    if len(stp) > 1:
-                        print("WARNING: There are more than one ?DH trace")
-                        print("*   -> Keeping the highest sampling rate")
-                        print(
-                            "*   -> Renaming channel to " +
-                            sta.channel[0]+"DH")
-                        if stp[0].stats.sampling_rate > \
-                                stp[1].stats.sampling_rate:
-                            stp = Stream(traces=stp[0])
-                        else:
-                            stp = Stream(traces=stp[1])
-
-                except Exception:
-                    print(" Error: Unable to download ?DH component - " +
-                          "continuing")
-                    t1 += dt
-                    t2 += dt
-                    continue
-
-                st = sth + stp
-
-            else:
-
-                # If data files exist, continue
-                if (fileZ.exists() and file1.exists() and
-                        file2.exists() and fileP.exists()):
-                    if not args.ovr:
-                        print("*   "+tstamp +
-                              "*SAC                                 ")
-                        print("*   -> Files already exist, " +
-                              "continuing            ")
-                        t1 += dt
-                        t2 += dt
-                        continue
-
-                channels = sta.channel.upper()+'1,'+sta.channel.upper() + \
-                    '2,'+sta.channel.upper()+'Z'
-
-                # Get waveforms from client
-                try:
-                    print("*   "+tstamp +
-                          "*SAC                                 ")
-                    print("*   -> Downloading Seismic data... ")
-                    sth = client.get_waveforms(
-                        network=sta.network, station=sta.station,
-                        location=sta.location[0], channel=channels,
-                        starttime=t1, endtime=t2, attach_response=True)
-                    print("*      ...done")
-
-                except Exception:
-                    print(" Error: Unable to download ?H? components - " +
-                          "continuing")
-                    t1 += dt
-                    t2 += dt
-                    continue
-                try:
-                    print("*   -> Downloading Pressure data...")
-                    stp = client.get_waveforms(
-                        network=sta.network, station=sta.station,
-                        location=sta.location[0], channel='?DH',
-                        starttime=t1, endtime=t2, attach_response=True)
-                    print("*      ...done")
-                    if len(stp) > 1:
-                        print("WARNING: There are more than one ?DH trace")
-                        print("*   -> Keeping the highest sampling rate")
-                        print(
-                            "*   -> Renaming channel to " +
-                            sta.channel[0]+"DH")
-                        if stp[0].stats.sampling_rate > \
-                                stp[1].stats.sampling_rate:
-                            stp = Stream(traces=stp[0])
-                        else:
-                            stp = Stream(traces=stp[1])
-
-                except Exception:
-                    print(" Error: Unable to download ?DH component - " +
-                          "continuing")
-                    t1 += dt
-                    t2 += dt
-                    continue
-
-                st = sth + stp
-
-            # Detrend, filter
-            st.detrend('demean')
-            st.detrend('linear')
-            st.filter(
-                'lowpass', freq=0.5*args.new_sampling_rate,
-                corners=2, zerophase=True)
-            st.resample(args.new_sampling_rate)
-
-            # Check streams
-            is_ok, st = utils.QC_streams(t1, t2, st)
-            if not is_ok:
-                continue
-
-            sth = st.select(component='1') + st.select(component='2') + \
-                st.select(component='Z')
-
-            # Remove responses
-            print("*   -> Removing responses - Seismic data")
-            sth.remove_response(pre_filt=args.pre_filt, output=args.units)
-
-            # Extract traces - Z
-            trZ = sth.select(component='Z')[0]
-            trZ = utils.update_stats(
-                trZ, sta.latitude, sta.longitude, sta.elevation,
-                sta.channel+'Z')
-            trZ.write(str(fileZ), format='SAC')
-
-            # Extract traces - H
+            files = {
+                # Horizontal 1 channel
+                '1': datapath / (tstamp+'.'+sta.channel+'1.SAC'),
+                # Horizontal 2 channel
+                '2': datapath / (tstamp+'.'+sta.channel+'2.SAC'),
+                # Vertical channel
+                'Z': datapath / (tstamp+'.'+sta.channel+'Z.SAC'),
+                # Pressure channel
+                'P': datapath / (tstamp+'.'+sta.channel[0]+'DH.SAC')}
+
+            comps = ['Z']
             if "12" in args.channels:
-                tr1 = sth.select(component='1')[0]
-                tr2 = sth.select(component='2')[0]
-                tr1 = utils.update_stats(
-                    tr1, sta.latitude, sta.longitude, sta.elevation,
-                    sta.channel+'1')
-                tr2 = utils.update_stats(
-                    tr2, sta.latitude, sta.longitude, sta.elevation,
-                    sta.channel+'2')
-                tr1.write(str(file1), format='SAC')
-                tr2.write(str(file2), format='SAC')
-
-            # Extract traces - P
+                comps.extend(['1', '2'])
             if "P" in args.channels:
-                stp = st.select(component='H')
-                print("*   -> Removing responses - Pressure data")
-                stp.remove_response(pre_filt=args.pre_filt)
-                trP = stp[0]
-                trP = utils.update_stats(
-                    trP, sta.latitude, sta.longitude, sta.elevation,
-                    sta.channel[0]+'DH')
-                trP.write(str(fileP), format='SAC')
+                comps.append('P')
+
+            # If data files exist, continue
+            if all(files[comp].exists() for comp in comps) and not args.ovr:
+                print("*   "+tstamp+"*SAC -> Files already exist, " +
+                      "continuing")
+            else:
+                tasks.append((sta, t1, t2, files))
 
             t1 += dt
             t2 += dt
 
+    if not tasks:
+        return
+
+    # Pool of threads sending requests to the data center
+    pool = RequestPool(nrequests=args.nrequests, retries=args.retries,
+                       backoff=args.backoff)
+
+    # Establish client
+    user, password = args.UserAuth or [None, None]
+    client = sources.get_source(
+        args.Server, user=user, password=password,
+        sds_path=args.sdspath, inventory=args.inventory,
+        replay_path=args.replay, latency=args.latency)
+
+    run_pipeline(pool, client, tasks, args)
+
+
+def download_day(pool, client, sta, t1, t2, args):
+    """
+    Function to download the seismic and pressure data of a station for
+    one day. Requests are sent through the pool, which bounds the number of
+    concurrent requests and repeats failed requests.
+
+    """
+
+    if "12" in args.channels:
+        channels = sta.channel.upper()+'1,'+sta.channel.upper() + \
+            '2,'+sta.channel.upper()+'Z'
+    else:
+        channels = sta.channel.upper() + 'Z'
+
+    # Get waveforms from client
+    try:
+        st = pool.request(
+            args.Server, client.get_waveforms, network=sta.network,
+            station=sta.station, location=sta.location[0],
+            channel=channels, starttime=t1, endtime=t2)
+    except Exception as e:
+        raise(Exception("Unable to download ?H? components (" +
+                        type(e).__name__ + ")"))
+
+    if "P" in args.channels:
+        try:
+            stp = pool.request(
+                args.Server, client.get_waveforms, network=sta.network,
+                station=sta.station, location=sta.location[0],
+                channel='?DH', starttime=t1, endtime=t2)
+        except Exception as e:
+            raise(Exception("Unable to download ?DH component (" +
+                            type(e).__name__ + ")"))
+
+        # Keep the highest sampling rate if there is more than one trace
+        if len(stp) > 1:
+            stp = Stream(traces=max(
+                stp, key=lambda tr: tr.stats.sampling_rate))
+        st += stp
+
+    return st
+
+
+def download_inventory(pool, client, sta, tstart, tend, args):
+    """
+    Function to download the station metadata, with instrument responses,
+    of the seismic and pressure channels of a station for a time span. The
+    metadata are requested once for all days of the station, and the
+    responses are evaluated once per channel epoch by
+    :func:`~obstools.atacr.utils.remove_response`.
+
+    """
+
+    channels = sta.channel.upper() + '?'
+    if "P" in args.channels:
+        channels += ',?DH'
+
+    return pool.request(
+        args.Server, client.get_stations, network=sta.network,
+        station=sta.station, location=sta.location[0], channel=channels,
+        starttime=tstart, endtime=tend, level='response')
+
+
+def process_day(st, sta, t1, t2, files, args, inventory=None):
+    """
+    Function to detrend, filter, resample and remove the responses of the
+    data of one day, and save them as SAC files. Responses are taken from
+    `inventory` if they are not attached to the traces. Returns whether the
+    data have passed the quality control.
+
+    """
+
+    is_ok, st = utils.preprocess_stream(
+        st, t1, t2, args.new_sampling_rate, pre_filt=args.pre_filt,
+        units=args.units, inventory=inventory)
+    if not is_ok:
+        return False
+
+    # Extract traces - Z
+    trZ = st.select(component='Z')[0]
+    trZ = utils.update_stats(
+        trZ, sta.latitude, sta.longitude, sta.elevation,
+        sta.channel+'Z')
+    trZ.write(str(files['Z']), format='SAC')
+
+    # Extract traces - H
+    if "12" in args.channels:
+        tr1 = st.select(component='1')[0]
+        tr2 = st.select(component='2')[0]
+        tr1 = utils.update_stats(
+            tr1, sta.latitude, sta.longitude, sta.elevation,
+            sta.channel+'1')
+        tr2 = utils.update_stats(
+            tr2, sta.latitude, sta.longitude, sta.elevation,
+            sta.channel+'2')
+        tr1.write(str(files['1']), format='SAC')
+        tr2.write(str(files['2']), format='SAC')
+
+    # Extract traces - P
+    if "P" in args.channels:
+        trP = st.select(component='H')[0]
+        trP = utils.update_stats(
+            trP, sta.latitude, sta.longitude, sta.elevation,
+            sta.channel[0]+'DH')
+        trP.write(str(files['P']), format='SAC')
+
+    return True
+
+
+def run_pipeline(pool, client, tasks, args):
+    """
+    Function to download and process the queued days. The station metadata
+    are downloaded first, once per station, and days are then downloaded
+    by the pool of threads (with a bounded number of concurrent requests)
+    and handed over, as they arrive, to a pool of worker processes that
+    processes and saves them, such that downloading and processing
+    overlap. Failed days are reported at the end of the run.
+
+    """
+
+    ntask = len(tasks)
+    print("\n"+"*"*60)
+    print("* Downloading {0} day(s) with up to {1} concurrent requests".format(
+        ntask, args.nrequests))
+    print("* Processing with {0} worker(s)".format(args.workers))
+
+    failed = []
+
+    def label(sta, t1):
+        return sta.network + "." + sta.station + " " + \
+            str(t1.year).zfill(4) + "." + str(t1.julday).zfill(3)
+
+    def station(sta):
+        return (sta.network, sta.station, sta.location[0], sta.channel)
+
+    # Time spans of the days to download, for each station
+    spans = {}
+    for sta, t1, t2, files in tasks:
+        if station(sta) in spans:
+            _, tstart, tend = spans[station(sta)]
+            t1, t2 = min(t1, tstart), max(t2, tend)
+        spans[station(sta)] = (sta, t1, t2)
+
+    # Station metadata, with responses
+    inventories = {}
+
+    def inventory(sta, tstart, tend):
+        return download_inventory(pool, client, sta, tstart, tend, args)
+
+    for task, inv, error in pool.imap(inventory, spans.values()):
+        if error is not None:
+            sta = task[0]
+            print("* {0}.{1}: Unable to download station metadata "
+                  "({2})".format(sta.network, sta.station,
+                                 type(error).__name__))
+        inventories[station(task[0])] = (inv, error)
+
+    def download(sta, t1, t2, files):
+        inv, error = inventories[station(sta)]
+        if error is not None:
+            raise(Exception("Unable to download station metadata (" +
+                            type(error).__name__ + ")"))
+        return download_day(pool, client, sta, t1, t2, args), inv
+
+    def downloaded():
+        # Downloaded days, in order of arrival
+        for task, result, error in pool.imap(download, tasks):
+            sta, t1, t2, files = task
+            if error is not None:
+                failed.append((label(sta, t1), error))
+                print("* {0}: FAILED ({1})".format(label(sta, t1), error))
+            else:
+                st, inv = result
+                yield st, sta, t1, t2, files, args, inv
+
+    for task, is_ok, error in utils.imap_bounded(
+            process_day, downloaded(), workers=args.workers):
+        st, sta, t1, t2, files = task[:5]
+        if error is not None:
+            failed.append((label(sta, t1), error))
+            status = "FAILED ({0})".format(error)
+        elif not is_ok:
+            status = "failed QC - skipping"
+        else:
+            status = "saved"
+        print("* {0}: {1}".format(label(sta, t1), status))
+
+    if failed:
+        print("\n"+"*"*60)
+        print("* {0} day(s) failed:".format(len(failed)))
+        for name, error in failed:
+            print("*   "+name+": "+type(error).__name__+": "+str(error))
+
 
 if __name__ == "__main__":
 
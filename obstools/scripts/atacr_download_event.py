@@ -28,7 +28,7 @@ import numpy as np
 import os.path
 import pickle
 import stdb
-from obspy.clients.fdsn import Client
+from obstools.atacr import sources
 from obspy.geodetics.base import gps2dist_azimuth as epi
 from obspy.geodetics import kilometer2degrees as k2d
 from obspy.core import Stream, UTCDateTime
@@ -123,6 +123,59 @@ def get_event_arguments(argv=None):
         "(--User-Auth='username:authpassword') to access and download " +
         "restricted data. [Default no user and password]")
 
+    # Data Source Settings
+    SourceGroup = parser.add_argument_group(
+        title="Data Source Settings",
+        description="Settings associated with reading data from a local " +
+        "archive, or recording and replaying requests, instead of " +
+        "requesting data from the datacenter.")
+    SourceGroup.add_argument(
+        "--sds-path",
+        action="store",
+        type=str,
+        dest="sdspath",
+        default=None,
+        help="Specify the root folder of a local SDS (SeisComP Data " +
+        "Structure) archive of MiniSEED files to read data from, " +
+        "instead of the datacenter. Requires --inventory. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--inventory",
+        action="store",
+        type=str,
+        dest="inventory",
+        default="",
+        help="Specify a comma-separated list of StationXML files with " +
+        "the station metadata and responses of the SDS archive. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--catalog",
+        action="store",
+        type=str,
+        dest="catalog",
+        default="",
+        help="Specify a comma-separated list of QuakeML files with the " +
+        "events to search for, when reading data from an SDS archive. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--replay",
+        action="store",
+        type=str,
+        dest="replay",
+        default=None,
+        help="Specify a folder in which requests are recorded. Requests " +
+        "already recorded are replayed from this folder instead of being " +
+        "sent again, such that the script can be run again offline. " +
+        "[Default None]")
+    SourceGroup.add_argument(
+        "--latency",
+        action="store",
+        type=float,
+        dest="latency",
+        default=0.,
+        help="Specify a time (in sec) added to each replayed request, to " +
+        "emulate the response time of a datacenter. [Default 0.]")
+
     # Constants Settings
     FreqGroup = parser.add_argument_group(
         title='Frequency Settings',
@@ -296,6 +349,29 @@ def get_event_arguments(argv=None):
     else:
         args.UserAuth = []
 
+    # Check data source
+    if len(args.inventory) > 0:
+        args.inventory = args.inventory.split(',')
+    else:
+        args.inventory = []
+    if len(args.catalog) > 0:
+        args.catalog = args.catalog.split(',')
+    else:
+        args.catalog = []
+    for xmlfile in args.inventory + args.catalog:
+        if not exist(xmlfile):
+            parser.error("Error: File " + xmlfile + " does not exist")
+    if args.sdspath is not None:
+        if not os.path.isdir(args.sdspath):
+            parser.error("Error: SDS archive " + args.sdspath +
+                         " does not exist")
+        if len(args.inventory) == 0:
+            parser.error("Error: --sds-path requires --inventory")
+        if len(args.catalog) == 0:
+            parser.error("Error: --sds-path requires --catalog")
+    if args.latency < 0.:
+        parser.error("Error: --latency should be non-negative")
+
     if args.pre_filt is None:
         args.pre_filt = [0.001, 0.005, 45., 50.]
     else:
@@ -337,6 +413,14 @@ def main(args=None):
             stkeys = db.keys()
             sorted(stkeys)
 
+    # Establish client
+    user, password = args.UserAuth or [None, None]
+    client = sources.get_source(
+        args.Server, user=user, password=password,
+        sds_path=args.sdspath, inventory=args.inventory,
+        catalog=args.catalog, replay_path=args.replay,
+        latency=args.latency)
+
     # Loop over station keys
     for stkey in list(stkeys):
 
@@ -349,13 +433,6 @@ def main(args=None):
             print('\nPath to '+str(eventpath)+' doesn`t exist - creating it')
             eventpath.mkdir(parents=True)
 
-        # Establish client
-        if len(args.UserAuth) == 0:
-            client = Client(args.Server)
-        else:
-            client = Client(
-                args.Server, user=args.UserAuth[0], password=args.UserAuth[1])
-
         # Get catalogue search start time
         if args.startT is None:
             tstart = sta.startdate
@@ -623,27 +700,16 @@ def main(args=None):
 
                 st = sth + stp
 
-            # Detrend, filter
-            st.detrend('demean')
-            st.detrend('linear')
-            st.filter('lowpass', freq=0.5*args.new_sampling_rate,
-                      corners=2, zerophase=True)
-            st.resample(args.new_sampling_rate)
-
-            # Check streams
-            is_ok, st = utils.QC_streams(t1, t2, st)
+            # Detrend, filter, resample and remove responses
+            print("*   -> Removing responses")
+            is_ok, st = utils.preprocess_stream(
+                st, t1, t2, args.new_sampling_rate, pre_filt=args.pre_filt,
+                units=args.units)
             if not is_ok:
                 continue
 
-            sth = st.select(component='1') + st.select(component='2') + \
-                st.select(component='Z')
-
-            # Remove responses
-            print("*   -> Removing responses - Seismic data")
-            sth.remove_response(pre_filt=args.pre_filt, output=args.units)
-
             # Extract traces - Z
-            trZ = sth.select(component='Z')[0]
+            trZ = st.select(component='Z')[0]
             trZ = utils.update_stats(
                 trZ, sta.latitude, sta.longitude, sta.elevation,
                 sta.channel+'Z', evla=lat, evlo=lon)
@@ -652,8 +718,8 @@ def main(args=None):
             # Extract traces and write out in SAC format
             # Seismic channels
             if "12" in args.channels:
-                tr1 = sth.select(component='1')[0]
-                tr2 = sth.select(component='2')[0]
+                tr1 = st.select(component='1')[0]
+                tr2 = st.select(component='2')[0]
                 tr1 = utils.update_stats(
                     tr1, sta.latitude, sta.longitude, sta.elevation,
                     sta.channel+'1', evla=lat, evlo=lon)
@@ -665,10 +731,7 @@ def main(args=None):
 
             # Pressure channel
             if "P" in args.channels:
-                stp = st.select(component='H')
-                print("*   -> Removing responses - Pressure data")
-                stp.remove_response(pre_filt=args.pre_filt)
-                trP = stp[0]
+                trP = st.select(component='H')[0]
                 trP = utils.update_stats(
                     trP, sta.latitude, sta.longitude, sta.elevation,
                     sta.channel[0]+'DH', evla=lat, evlo=lon)
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+
+# Copyright 2019 Pascal Audet & Helen Janiszewski
+#
+# This file is part of OBStools.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Import modules and functions
+import stdb
+from obspy import read, read_inventory, Stream, UTCDateTime
+from obstools.atacr import utils
+from obstools.scripts.atacr_download_data import process_day
+from pathlib import Path
+
+from argparse import ArgumentParser
+from os.path import exists as exist
+
+# Inventories read by the current process, keyed by StationXML files
+_inventories = {}
+
+
+def get_preprocess_arguments(argv=None):
+    """
+    Get Options from :class:`~optparse.OptionParser` objects.
+
+    Calling options for the script `atacr_preprocess_data.py` that accompany
+    this package.
+
+    """
+
+    parser = ArgumentParser(
+        usage="%(prog)s [options] <indb>",
+        description="Script used " +
+        "to pre-process up to four-component " +
+        "(H1, H2, Z and P), day-long seismograms from raw data " +
+        "(MiniSEED, SAC or any format read by obspy) and StationXML " +
+        "metadata stored on disk, to use in " +
+        "noise corrections of vertical component of OBS data. " +
+        "The processing is the same as in atacr_download_data, and " +
+        "days are processed in parallel by a pool of processes.")
+    parser.add_argument(
+        "indb",
+        help="Station Database to process from.",
+        type=str)
+
+    # General Settings
+    parser.add_argument(
+        "--keys",
+        action="store",
+        type=str,
+        dest="stkeys",
+        default="",
+        help="Specify a comma-separated list of station keys " +
+        "for which to perform the analysis. These must be " +
+        "contained within the station database. Partial keys " +
+        "will be used to match against those in the dictionary. " +
+        "For instance, providing IU will match with all stations " +
+        "in the IU network. " +
+        "[Default processes all stations in the database]")
+    parser.add_argument(
+        "-C", "--channels",
+        action="store",
+        type=str,
+        dest="channels",
+        default="",
+        help="Specify a comma-separated list of channels for " +
+        "which to perform the transfer function analysis. " +
+        "Possible options are '12' (for horizontal channels 1 and 2) " +
+        "and/or 'P' (for pressure channel). Specifying '12' allows " +
+        "for tilt correction. Specifying 'P' allows for compliance " +
+        "correction. [Default '12,P' looks for both horizontal and " +
+        "pressure and allows for both tilt AND compliance corrections]")
+    parser.add_argument(
+        "-O", "--overwrite",
+        action="store_true",
+        dest="ovr",
+        default=False,
+        help="Force the overwriting of pre-existing data. " +
+        "[Default False]")
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        dest="workers",
+        default=1,
+        help="Specify the number of worker processes used to process " +
+        "the days in parallel. [Default 1, i.e. serial processing]")
+
+    # Raw Data Settings
+    RawGroup = parser.add_argument_group(
+        title="Raw Data Settings",
+        description="Settings associated with the raw data and " +
+        "metadata stored on disk")
+    RawGroup.add_argument(
+        "--raw-path",
+        action="store",
+        type=str,
+        dest="rawpath",
+        default="RAW",
+        help="Specify the folder containing the raw data. The raw " +
+        "files of each station are searched (recursively) in a sub-folder " +
+        "named after the station key (e.g., RAW/7D.M08A/), and may " +
+        "span any length of time. [Default 'RAW']")
+    RawGroup.add_argument(
+        "--inventory",
+        action="store",
+        type=str,
+        dest="inventory",
+        default="",
+        help="Specify a comma-separated list of StationXML files with " +
+        "the instrument responses of the raw data. [Default uses the " +
+        "*.xml files found with the raw data of each station]")
+
+    # Constants Settings
+    FreqGroup = parser.add_argument_group(
+        title='Frequency Settings',
+        description="Miscellaneous frequency settings")
+    FreqGroup.add_argument(
+        "--sampling-rate",
+        action="store",
+        type=float,
+        dest="new_sampling_rate",
+        default=5.,
+        help="Specify new sampling rate (float, in Hz). [Default 5.]")
+    FreqGroup.add_argument(
+        "--units",
+        action="store",
+        type=str,
+        dest="units",
+        default="DISP",
+        help="Choose the output seismogram units. Options are: " +
+        "'DISP', 'VEL', 'ACC'. [Default 'DISP']")
+    FreqGroup.add_argument(
+        "--pre-filt",
+        action="store",
+        type=str,
+        dest="pre_filt",
+        default=None,
+        help="Specify four comma-separated corner frequencies " +
+        "(float, in Hz) for deconvolution pre-filter. " +
+        "[Default 0.001,0.005,45.,50.]")
+
+    # Event Selection Criteria
+    DaysGroup = parser.add_argument_group(
+        title="Time Search Settings",
+        description="Time settings associated with searching " +
+        "for day-long seismograms")
+    DaysGroup.add_argument(
+        "--start",
+        action="store",
+        type=str,
+        dest="startT",
+        default="",
+        help="Specify a UTCDateTime compatible string representing " +
+        "the start day for the data search. This will override any " +
+        "station start times. " +
+        "[Default start date for each station in database]")
+    DaysGroup.add_argument(
+        "--end",
+        action="store",
+        type=str,
+        dest="endT",
+        default="",
+        help="Specify a UTCDateTime compatible string representing " +
+        "the end day for the data search. This will override any " +
+        "station end times [Default end date for each station in database]")
+
+    args = parser.parse_args(argv)
+
+    # Check inputs
+    if not exist(args.indb):
+        parser.error("Input file " + args.indb + " does not exist")
+    if not Path(args.rawpath).is_dir():
+        parser.error("Raw data folder " + args.rawpath + " does not exist")
+
+    # Check pool size
+    if args.workers < 1:
+        parser.error("Error: --workers should be a positive integer")
+
+    # create station key list
+    if len(args.stkeys) > 0:
+        args.stkeys = args.stkeys.split(',')
+
+    # create channel list
+    if len(args.channels) > 0:
+        args.channels = args.channels.split(',')
+    else:
+        args.channels = ["12", "P"]
+    for cha in args.channels:
+        if cha not in ["12", "P"]:
+            parser.error("Error: Channel not recognized " + str(cha))
+
+    # create inventory list
+    if len(args.inventory) > 0:
+        args.inventory = args.inventory.split(',')
+        for xmlfile in args.inventory:
+            if not exist(xmlfile):
+                parser.error("StationXML file " + xmlfile +
+                             " does not exist")
+    else:
+        args.inventory = []
+
+    # construct start time
+    if len(args.startT) > 0:
+        try:
+            args.startT = UTCDateTime(args.startT)
+        except Exception:
+            parser.error(
+                "Error: Cannot construct UTCDateTime from start time: " +
+                args.startT)
+    else:
+        args.startT = None
+
+    # construct end time
+    if len(args.endT) > 0:
+        try:
+            args.endT = UTCDateTime(args.endT)
+        except Exception:
+            parser.error(
+                "Error: Cannot construct UTCDateTime from end time: " +
+                args.endT)
+    else:
+        args.endT = None
+
+    if args.units not in ['DISP', 'VEL', 'ACC']:
+        raise(Exception(
+            "Error: invalid --units argument. Choose among " +
+            "'DISP', 'VEL', or 'ACC'"))
+    if args.pre_filt is None:
+        args.pre_filt = [0.001, 0.005, 45., 50.]
+    else:
+        args.pre_filt = [float(val) for val in args.pre_filt.split(',')]
+        args.pre_filt = sorted(args.pre_filt)
+        if (len(args.pre_filt)) != 4:
+            raise(Exception(
+                "Error: --pre-filt should contain 4 comma-separated floats"))
+
+    return args
+
+
+def main(args=None):
+
+    if args is None:
+        # Run Input Parser
+        args = get_preprocess_arguments()
+
+    # Load Database
+    # stdb>0.1.3
+    try:
+        db, stkeys = stdb.io.load_db(fname=args.indb, keys=args.stkeys)
+
+    # stdb=0.1.3
+    except Exception:
+        db = stdb.io.load_db(fname=args.indb)
+
+        # Construct station key loop
+        allkeys = db.keys()
+        sorted(allkeys)
+
+        # Extract key subset
+        if len(args.stkeys) > 0:
+            stkeys = []
+            for skey in args.stkeys:
+                stkeys.extend([s for s in allkeys if skey in s])
+        else:
+            stkeys = db.keys()
+            sorted(stkeys)
+
+    # Days to process, for all stations
+    tasks = []
+
+    # Loop over station keys
+    for stkey in list(stkeys):
+
+        # Extract station information from dictionary
+        sta = db[stkey]
+
+        # Raw data and metadata of the station
+        rawpath = Path(args.rawpath) / Path(stkey)
+        if not rawpath.is_dir():
+            print("\nPath to "+str(rawpath)+" doesn`t exist - continuing")
+            continue
+        if args.inventory:
+            xmlfiles = [str(Path(xmlfile)) for xmlfile in args.inventory]
+        else:
+            xmlfiles = sorted(str(f) for f in rawpath.rglob('*.xml'))
+        if not xmlfiles:
+            print("\nNo StationXML file for "+stkey+" - continuing")
+            continue
+        catalog = raw_catalog(rawpath)
+
+        # Define path to see if it exists
+        datapath = Path('DATA') / Path(stkey)
+        if not datapath.is_dir():
+            print('\nPath to '+str(datapath)+' doesn`t exist - creating it')
+            datapath.mkdir(parents=True)
+
+        # Get catalogue search start time
+        if args.startT is None:
+            tstart = sta.startdate
+        else:
+            tstart = args.startT
+
+        # Get catalogue search end time
+        if args.endT is None:
+            tend = sta.enddate
+        else:
+            tend = args.endT
+
+        if tstart > sta.enddate or tend < sta.startdate:
+            continue
+
+        # Update Display
+        print("\n|===============================================|")
+        print("|===============================================|")
+        print("|                   {0:>8s}                    |".format(
+            sta.station))
+        print("|===============================================|")
+        print("|===============================================|")
+        print("|  Station: {0:>2s}.{1:5s}                            |".format(
+            sta.network, sta.station))
+        print("|      Raw files: {0:<6d}                        |".format(
+            len(catalog)))
+        print("|-----------------------------------------------|")
+        print("| Searching day-long files:                     |")
+        print("|   Start: {0:19s}                  |".format(
+            tstart.strftime("%Y-%m-%d")))
+        print("|   End:   {0:19s}                  |".format(
+            tend.strftime("%Y-%m-%d")))
+
+        # Split into 24-hour long segments
+        dt = 3600.*24.
+
+        t1 = tstart
+        t2 = tstart + dt
+
+        while t2 <= tend:
+
+            # Time stamp
+            tstamp = str(t1.year).zfill(4)+'.'+str(t1.julday).zfill(3)+'.'
+
+            # Define file names (to check if files already exist)
+            files = {
+                # Horizontal 1 channel
+                '1': datapath / (tstamp+'.'+sta.channel+'1.SAC'),
+                # Horizontal 2 channel
+                '2': datapath / (tstamp+'.'+sta.channel+'2.SAC'),
+                # Vertical channel
+                'Z': datapath / (tstamp+'.'+sta.channel+'Z.SAC'),
+                # Pressure channel
+                'P': datapath / (tstamp+'.'+sta.channel[0]+'DH.SAC')}
+
+            comps = ['Z']
+            if "12" in args.channels:
+                comps.extend(['1', '2'])
+            if "P" in args.channels:
+                comps.append('P')
+
+            # Raw files overlapping the day
+            rawfiles = sorted(set(
+                fname for fname, starttime, endtime in catalog
+                if starttime <= t2 and endtime >= t1))
+
+            # If data files exist, continue
+            if all(files[comp].exists() for comp in comps) and not args.ovr:
+                print("*   "+tstamp+"*SAC -> Files already exist, " +
+                      "continuing")
+            elif not rawfiles:
+                print("*   "+tstamp+"*SAC -> No raw data, continuing")
+            else:
+                tasks.append((rawfiles, xmlfiles, sta, t1, t2, files, args))
+
+            t1 += dt
+            t2 += dt
+
+    if not tasks:
+        return
+
+    print("\n"+"*"*60)
+    print("* Processing {0} day(s) with {1} worker(s)".format(
+        len(tasks), args.workers))
+
+    failed = []
+    for task, is_ok, error in utils.imap_bounded(
+            preprocess_day, tasks, workers=args.workers):
+        sta, t1 = task[2], task[3]
+        name = sta.network + "." + sta.station + " " + \
+            str(t1.year).zfill(4) + "." + str(t1.julday).zfill(3)
+        if error is not None:
+            failed.append((name, error))
+            status = "FAILED ({0})".format(error)
+        elif not is_ok:
+            status = "failed QC - skipping"
+        else:
+            status = "saved"
+        print("* {0}: {1}".format(name, status))
+
+    if failed:
+        print("\n"+"*"*60)
+        print("* {0} day(s) failed:".format(len(failed)))
+        for name, error in failed:
+            print("*   "+name+": "+type(error).__name__+": "+str(error))
+
+
+def raw_catalog(path):
+    """
+    Function to list the time spans of the raw files in a folder (and its
+    sub-folders), from their headers only. StationXML files and files
+    that obspy cannot read are ignored.
+
+    """
+
+    catalog = []
+    for fname in sorted(Path(path).rglob('*')):
+        if not fname.is_file() or fname.suffix.lower() == '.xml':
+            continue
+        try:
+            st = read(str(fname), headonly=True)
+        except Exception:
+            continue
+        for tr in st:
+            catalog.append(
+                (str(fname), tr.stats.starttime, tr.stats.endtime))
+
+    return catalog
+
+
+def get_inventory(xmlfiles):
+    """
+    Function to read the StationXML files once per process.
+
+    """
+
+    key = tuple(xmlfiles)
+    if key not in _inventories:
+        inv = read_inventory(xmlfiles[0])
+        for xmlfile in xmlfiles[1:]:
+            inv += read_inventory(xmlfile)
+        _inventories[key] = inv
+
+    return _inventories[key]
+
+
+def preprocess_day(rawfiles, xmlfiles, sta, t1, t2, files, args):
+    """
+    Function to read the raw data of a station for one day, and process and
+    save them with
+    :func:`~obstools.scripts.atacr_download_data.process_day`. Returns
+    whether the data have passed the quality control.
+
+    """
+
+    location = sta.location[0] if len(sta.location) > 0 else ''
+    location = location.replace('--', '')
+
+    st = Stream()
+    for fname in rawfiles:
+        st += read(fname, starttime=t1, endtime=t2).select(
+            network=sta.network, station=sta.station, location=location)
+
+    # Merge contiguous traces across files
+    st.merge(method=1)
+    st = st.split()
+
+    sth = Stream()
+    for comp in (['1', '2', 'Z'] if "12" in args.channels else ['Z']):
+        sth += st.select(channel=sta.channel.upper()+comp)
+    if len(sth) == 0:
+        raise(Exception("No raw data for ?H? components"))
+
+    if "P" in args.channels:
+        stp = st.select(channel='?DH')
+        if len(stp) == 0:
+            raise(Exception("No raw data for ?DH component"))
+
+        # Keep the highest sampling rate if there is more than one channel
+        sr = max(tr.stats.sampling_rate for tr in stp)
+        stp = stp.select(sampling_rate=sr)
+        sth += stp
+
+    return process_day(sth, sta, t1, t2, files, args,
+                       inventory=get_inventory(xmlfiles))
+
+
+if __name__ == "__main__":
+
+    # Run main program
+    main()
@@ -29,7 +29,7 @@ from obspy import UTCDateTime
 import pickle
 import stdb
 from obstools.atacr import StaNoise, Power, Cross, Rotation, TFNoise
-from obstools.atacr import utils, plotting
+from obstools.atacr import utils, plotting, store
 from pathlib import Path
 
 from argparse import ArgumentParser
@@ -86,6 +86,17 @@ def get_transfer_arguments(argv=None):
         default=False,
         help="Force the overwriting of pre-existing data. " +
         "[Default False]")
+    parser.add_argument(
+        "--save-format",
+        action="store",
+        type=str,
+        dest="saveformat",
+        default="pkl",
+        help="Specify the format of the output files. Options are: " +
+        "'pkl' (pickle) or 'spec' (binary format of " +
+        "obstools.atacr.store, loaded without copy through a memory " +
+        "map). Files in either format are read by all scripts. " +
+        "[Default 'pkl']")
 
     # Event Selection Criteria
     DaysGroup = parser.add_argument_group(
@@ -168,6 +179,11 @@ def get_transfer_arguments(argv=None):
     if not exist(args.indb):
         parser.error("Input file " + args.indb + " does not exist")
 
+    # Check output format
+    if args.saveformat not in ['pkl', 'spec']:
+        parser.error(
+            "Error: Specify either 'pkl' or 'spec' for --save-format")
+
     # create station key list
     if len(args.stkeys) > 0:
         args.stkeys = args.stkeys.split(',')
@@ -313,17 +329,10 @@ def main(args=None):
             sta.enddate.strftime("%Y-%m-%d %H:%M:%S")))
         print("|-----------------------------------------------|")
 
-        # Filename for output transfer functions
-        dstart = str(tstart.year).zfill(4)+'.'+str(tstart.julday).zfill(3)+'-'
-        dend = str(tend.year).zfill(4)+'.'+str(tend.julday).zfill(3)+'.'
-        fileavst = avstpath / (dstart+dend+'avg_sta.pkl')
-
-        # Find all files in directories
-        p = specpath.glob('*spectra.pkl')
-        spectra_files = [x for x in p if x.is_file()]
+        # Find all files in directories, in either output format
+        spectra_files = store.glob(specpath, '*spectra')
         if not args.skip_clean:
-            p = avstpath.glob('*avg_sta.pkl')
-            average_files = [x for x in p if x.is_file()]
+            average_files = store.glob(avstpath, '*avg_sta')
 
         if not args.skip_daily:
 
@@ -339,12 +348,10 @@ def main(args=None):
                 print("* Calculating transfer functions for key " +
                       stkey+" and day "+year+"."+jday)
                 tstamp = year+'.'+jday+'.'
-                filename = tfpath / (tstamp + 'transfunc.pkl')
+                filename = tfpath / (tstamp + 'transfunc.' + args.saveformat)
 
                 # Load file
-                file = open(filespec, 'rb')
-                daynoise = pickle.load(file)
-                file.close()
+                daynoise = store.load(filespec)
 
                 # Load spectra into TFNoise object
                 daytransfer = TFNoise(daynoise)
@@ -359,7 +366,7 @@ def main(args=None):
                 day_transfer_functions.append(daytransfer.transfunc)
 
                 # Save daily transfer functions to file
-                daytransfer.save(filename)
+                daytransfer.save(filename, form=args.saveformat)
 
         if not args.skip_clean:
 
@@ -371,12 +378,11 @@ def main(args=None):
                 print("\n"+"*"*60)
                 print("* Calculating transfer functions for key " +
                       stkey+" and range "+name[0])
-                filename = tfpath / (name[0] + 'transfunc.pkl')
+                filename = tfpath / (
+                    name[0] + 'transfunc.' + args.saveformat)
 
                 # Load file
-                file = open(fileavst, 'rb')
-                stanoise = pickle.load(file)
-                file.close()
+                stanoise = store.load(fileavst)
 
                 # Load spectra into TFNoise object - no Rotation object
                 # for station averages
@@ -393,7 +399,7 @@ def main(args=None):
                 sta_transfer_functions = statransfer.transfunc
 
                 # Save average transfer functions to file
-                statransfer.save(filename)
+                statransfer.save(filename, form=args.saveformat)
 
         if args.fig_TF:
             fname = stkey + '.' + 'transfer_functions'
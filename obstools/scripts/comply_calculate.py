@@ -29,7 +29,7 @@ import numpy as np
 from obspy import UTCDateTime
 import pickle
 import stdb
-from obstools.atacr import Rotation, plotting
+from obstools.atacr import Rotation, plotting, store
 from obstools.comply import Comply
 from pathlib import Path
 from argparse import ArgumentParser
@@ -92,7 +92,8 @@ def get_comply_arguments(argv=None):
         dest="saveformat",
         default="pkl",
         help="Specify the format of the output files. Options are: " +
-        "'pkl' or 'csv'. [Default 'pkl']")
+        "'pkl', 'spec' (binary format of obstools.atacr.store) or " +
+        "'csv'. [Default 'pkl']")
 
     # Event Selection Criteria
     DaysGroup = parser.add_argument_group(
@@ -141,6 +142,14 @@ def get_comply_arguments(argv=None):
         "construction of compliance and coherence functions. Defaults " +
         "to True if data cannot be found in default " +
         "directory. [Default False]")
+    ConstGroup.add_argument(
+        "--exact-wavenumber",
+        action="store_true",
+        dest="exact_wavenumber",
+        default=False,
+        help="Solve the dispersion relation of ocean surface gravity " +
+        "waves exactly instead of using a rational approximation " +
+        "(max. error 2.5%%). [Default False]")
 
     # Constants Settings
     FigureGroup = parser.add_argument_group(
@@ -213,9 +222,10 @@ def get_comply_arguments(argv=None):
         parser.error(
             "Error: cannot skip both daily and clean averages")
 
-    if args.saveformat not in ['pkl', 'csv']:
+    if args.saveformat not in ['pkl', 'spec', 'csv']:
         parser.error(
-            "Error: Specify either 'pkl' or 'csv' for --save-format")
+            "Error: Specify either 'pkl', 'spec' or 'csv' for " +
+            "--save-format")
 
     return args
 
@@ -332,17 +342,10 @@ def main(args=None):
             sta.enddate.strftime("%Y-%m-%d %H:%M:%S")))
         print("|-----------------------------------------------|")
 
-        # Filename for output transfer functions
-        dstart = str(tstart.year).zfill(4)+'.'+str(tstart.julday).zfill(3)+'-'
-        dend = str(tend.year).zfill(4)+'.'+str(tend.julday).zfill(3)+'.'
-        fileavst = avstpath / (dstart+dend+'avg_sta.pkl')
-
-        # Find all files in directories
-        p = specpath.glob('*spectra.pkl')
-        spectra_files = [x for x in p if x.is_file()]
+        # Find all files in directories, in either output format
+        spectra_files = store.glob(specpath, '*spectra')
         if not args.skip_clean:
-            p = avstpath.glob('*avg_sta.pkl')
-            average_files = [x for x in p if x.is_file()]
+            average_files = store.glob(avstpath, '*avg_sta')
 
         if not args.skip_daily:
 
@@ -355,16 +358,16 @@ def main(args=None):
                 jday = filespec.name.split('.')[1]
 
                 tstamp = year+'.'+jday+'.'
-                filepkl = complpath / (tstamp + 'compliance.pkl')
                 filename = complpath / (tstamp + 'compliance')
+                filepkl = store.find(filename)
 
-                if filepkl.exists():
+                if filepkl is not None:
                     if not args.ovr:
                         print("*   -> file " + str(filepkl) +
                               " exists - loading")
 
                         # Load Comply objects and append to list
-                        daycomply = pickle.load(open(filepkl, 'rb'))
+                        daycomply = store.load(filepkl)
                         f = daycomply.f
                         day_comply_functions.append(daycomply.complyfunc)
                         continue
@@ -374,15 +377,14 @@ def main(args=None):
                       stkey+" and day "+year+"."+jday)
 
                 # Load file
-                file = open(filespec, 'rb')
-                daynoise = pickle.load(file)
-                file.close()
+                daynoise = store.load(filespec)
 
                 # Load spectra into TFNoise object
                 daycomply = Comply(objnoise=daynoise, elev=sta.elevation*1.e3)
 
                 # Calculate the transfer functions
-                daycomply.calculate_compliance()
+                daycomply.calculate_compliance(
+                    exact=args.exact_wavenumber)
 
                 # Store the frequency axis
                 f = daycomply.f
@@ -400,16 +402,16 @@ def main(args=None):
 
                 name = fileavst.name.split('avg_sta')
 
-                filepkl = complpath / (name[0] + 'compliance.pkl')
                 filename = complpath / (name[0] + 'compliance')
+                filepkl = store.find(filename)
 
-                if filepkl.exists():
+                if filepkl is not None:
                     if not args.ovr:
                         print("*   -> file " + str(filepkl) +
                               " exists - loading")
 
                         # Load Comply object and append to list
-                        stacomply = pickle.load(open(filepkl, 'rb'))
+                        stacomply = store.load(filepkl)
                         f = stacomply.f
                         sta_comply_functions = stacomply.complyfunc
                         continue
@@ -418,9 +420,7 @@ def main(args=None):
                 print("* Calculating compliance functions for key " +
                       stkey+" and range "+name[0])
                 # Load file
-                file = open(fileavst, 'rb')
-                stanoise = pickle.load(file)
-                file.close()
+                stanoise = store.load(fileavst)
 
                 # Load spectra into TFNoise object - no Rotation object
                 # for station averages
@@ -428,7 +428,8 @@ def main(args=None):
                 stacomply = Comply(objnoise=stanoise, elev=sta.elevation*1.e3)
 
                 # Calculate the transfer functions
-                stacomply.calculate_compliance()
+                stacomply.calculate_compliance(
+                    exact=args.exact_wavenumber)
 
                 # Store the frequency axis
                 f = stacomply.f
@@ -0,0 +1,177 @@
+import io
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from obspy import Stream, Trace, UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel
+from obspy.core.inventory.response import Response
+
+# Minimal WADL files, as used by the client for service discovery
+WADL = """<?xml version="1.0" encoding="UTF-8"?>
+<application xmlns="http://wadl.dev.java.net/2009/02"
+             xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <resources base="http://localhost/fdsnws/{0}/1">
+    <resource path="query">
+      <method name="GET" id="query">
+        <request>
+{1}
+        </request>
+      </method>
+    </resource>
+  </resources>
+</application>
+"""
+PARAM = '          <param name="{0}" style="query" type="xs:{1}"/>'
+PARAMS = {
+    'dataselect': [('starttime', 'date'), ('endtime', 'date'),
+                   ('network', 'string'), ('station', 'string'),
+                   ('location', 'string'), ('channel', 'string')],
+    'station': [('starttime', 'date'), ('endtime', 'date'),
+                ('network', 'string'), ('station', 'string'),
+                ('location', 'string'), ('channel', 'string'),
+                ('minlatitude', 'float'), ('maxlatitude', 'float'),
+                ('minlongitude', 'float'), ('maxlongitude', 'float'),
+                ('level', 'string'), ('format', 'string')]}
+
+
+def get_stream(sta, tstart, ndays, sr=2.):
+    """
+    Synthetic continuous data for the four channels of a station.
+
+    """
+
+    rng = np.random.default_rng(42)
+    npts = int(ndays*86400*sr)
+    st = Stream()
+    for cha in [sta.channel + '1', sta.channel + '2', sta.channel + 'Z',
+                sta.channel[0] + 'DH']:
+        st.append(Trace(
+            rng.standard_normal(npts).astype(np.float32)*1.e3,
+            header={'network': sta.network, 'station': sta.station,
+                    'location': '', 'channel': cha, 'sampling_rate': sr,
+                    'starttime': tstart}))
+    return st
+
+
+def get_inventory(st):
+    """
+    Station metadata with a simple response for all channels of a stream.
+
+    """
+
+    channels = []
+    for tr in st:
+        units = 'PA' if tr.stats.channel.endswith('DH') else 'M/S'
+        response = Response.from_paz(
+            zeros=[0j, 0j], poles=[-0.037+0.037j, -0.037-0.037j],
+            stage_gain=1.e9, input_units=units, output_units='COUNTS',
+            normalization_frequency=1.)
+        channels.append(Channel(
+            tr.stats.channel, '', latitude=0., longitude=0., elevation=0.,
+            depth=0., sample_rate=tr.stats.sampling_rate,
+            start_date=tr.stats.starttime - 86400., response=response))
+    station = Station(st[0].stats.station, latitude=0., longitude=0.,
+                      elevation=0., channels=channels)
+    return Inventory(networks=[Network(st[0].stats.network,
+                                       stations=[station])], source='mock')
+
+
+class MockFDSN(object):
+    """
+    Local FDSN web service (dataselect and station) serving a stream and
+    its metadata. The first `nfail` data requests fail with HTTP 503, and
+    the number of data requests and the maximum number of concurrent data
+    requests are recorded.
+
+    """
+
+    def __init__(self, st, nfail=0, delay=0.):
+
+        self.st = st
+        self.inventory = get_inventory(st)
+        self.nfail = nfail
+        self.delay = delay
+        self.nrequests = 0
+        self.active = 0
+        self.maxactive = 0
+        self._lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                code, body = mock.respond(self.path)
+                self.send_response(code)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path):
+        url = urlparse(path)
+        parts = url.path.strip('/').split('/')
+        service = parts[1]
+        query = {key: value[0] for key, value in parse_qs(url.query).items()}
+
+        if parts[-1] == 'application.wadl':
+            if service not in PARAMS:
+                return 404, b''
+            params = "\n".join(PARAM.format(*p) for p in PARAMS[service])
+            return 200, WADL.format(service, params).encode()
+        elif parts[-1] != 'query':
+            return 404, b''
+
+        select = {key: query.get(key, '*').replace('--', '')
+                  for key in ['network', 'station', 'location', 'channel']}
+        t1 = UTCDateTime(query['starttime'])
+        t2 = UTCDateTime(query['endtime'])
+
+        if service == 'station':
+            inv = Inventory(networks=[], source='mock')
+            for cha in select['channel'].split(','):
+                inv += self.inventory.select(
+                    network=select['network'], station=select['station'],
+                    channel=cha)
+            buf = io.BytesIO()
+            inv.write(buf, format='STATIONXML')
+            return 200, buf.getvalue()
+
+        with self._lock:
+            self.nrequests += 1
+            self.active += 1
+            self.maxactive = max(self.maxactive, self.active)
+            fail = self.nrequests <= self.nfail
+        try:
+            if self.delay:
+                threading.Event().wait(self.delay)
+            if fail:
+                return 503, b''
+            st = Stream()
+            for cha in select['channel'].split(','):
+                st += self.st.select(
+                    network=select['network'], station=select['station'],
+                    channel=cha)
+            st = st.slice(t1, t2)
+            if len(st) == 0:
+                return 204, b''
+            buf = io.BytesIO()
+            st.write(buf, format='MSEED')
+            return 200, buf.getvalue()
+        finally:
+            with self._lock:
+                self.active -= 1
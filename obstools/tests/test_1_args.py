@@ -61,6 +61,33 @@ def test_get_daylong_arguments():
     return args0
 
 
+def test_get_preprocess_arguments(tmp_path):
+    from obstools.scripts import atacr_preprocess_data as atacr
+    # no stdb
+    with pytest.raises(SystemExit):
+        atacr.get_preprocess_arguments([])
+    # no raw data folder
+    with pytest.raises(SystemExit):
+        atacr.get_preprocess_arguments([
+            dbfile, '--raw-path', str(tmp_path / 'RAW')])
+    # defaults
+    args = atacr.get_preprocess_arguments([
+        dbfile, '--raw-path', str(tmp_path)])
+    assert args.inventory == []
+    # inventory
+    with pytest.raises(SystemExit):
+        atacr.get_preprocess_arguments([
+            dbfile, '--raw-path', str(tmp_path), '--inventory', 'abcd.xml'])
+    # workers
+    with pytest.raises(SystemExit):
+        atacr.get_preprocess_arguments([
+            dbfile, '--raw-path', str(tmp_path), '--workers', '0'])
+    # pre-filt
+    with pytest.raises(Exception):
+        atacr.get_preprocess_arguments([
+            dbfile, '--raw-path', str(tmp_path), '--pre-filt', '0.1,0.2'])
+
+
 def test_get_event_arguments():
     from obstools.scripts import atacr_download_event as atacr
     # no stdb
@@ -123,7 +150,7 @@ def test_get_event_arguments():
     return args0
 
 
-def test_get_dailyspec_arguments():
+def test_get_dailyspec_arguments(tmp_path):
     from obstools.scripts import atacr_daily_spectra as atacr
     # no stdb
     with pytest.raises(SystemExit):
@@ -154,6 +181,48 @@ def test_get_dailyspec_arguments():
     with pytest.raises(Exception):
         atacr.get_dailyspec_arguments([
             dbfile, '--freq-band', '0.1'])
+    # catalog cache
+    assert args0.catalog_cache is not None
+    args = atacr.get_dailyspec_arguments([
+        dbfile, '--catalog-cache', str(tmp_path)])
+    assert args.catalog_cache == tmp_path
+    args = atacr.get_dailyspec_arguments([dbfile, '--no-catalog-cache'])
+    assert args.catalog_cache is None
+    # output format
+    args = atacr.get_dailyspec_arguments([
+        dbfile, '--save-format', 'spec'])
+    assert args.saveformat == 'spec'
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--save-format', 'csv'])
+    # days per block
+    xmlfile = tmp_path / 'inv.xml'
+    xmlfile.touch()
+    args = atacr.get_dailyspec_arguments([
+        dbfile, '--span', '7', '--sds-path', str(tmp_path),
+        '--inventory', str(xmlfile)])
+    assert args.span == 7
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--span', '7'])
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--span', '7', '--sds-path', str(tmp_path)])
+    # days per segment
+    args = atacr.get_dailyspec_arguments([
+        dbfile, '--span', '6', '--cadence', '2', '--sds-path',
+        str(tmp_path), '--inventory', str(xmlfile)])
+    assert args.cadence == 2
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--span', '7', '--cadence', '2', '--sds-path',
+            str(tmp_path), '--inventory', str(xmlfile)])
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--cadence', '0'])
+    with pytest.raises(SystemExit):
+        atacr.get_dailyspec_arguments([
+            dbfile, '--span', '0'])
 
     return args0
 
@@ -186,6 +255,16 @@ def test_get_cleanspec_arguments():
     with pytest.raises(Exception):
         atacr.get_cleanspec_arguments([
             dbfile, '--freq-band', '0.1'])
+    # spectral cube
+    args = atacr.get_cleanspec_arguments([
+        dbfile, '--cube', '--figQC', '--figAverage'])
+    assert args.cube
+    with pytest.raises(SystemExit):
+        atacr.get_cleanspec_arguments([
+            dbfile, '--cube', '--incremental'])
+    with pytest.raises(SystemExit):
+        atacr.get_cleanspec_arguments([
+            dbfile, '--cube', '--figCross'])
     return args0
 
 
@@ -225,6 +304,9 @@ def test_get_correct_arguments():
         atacr.get_correct_arguments([])
     # defaults
     args0 = atacr.get_correct_arguments([dbfile])
+    assert args0.catalog_cache is not None
+    args = atacr.get_correct_arguments([dbfile, '--no-catalog-cache'])
+    assert args.catalog_cache is None
     # keys
     args = atacr.get_correct_arguments([
         dbfile, '--keys', '7D.MM08'])
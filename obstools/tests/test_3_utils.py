@@ -1,3 +1,5 @@
+import pytest
+import numpy as np
 from obspy import UTCDateTime, read
 from obstools.atacr import utils
 from pkg_resources import resource_filename
@@ -86,6 +88,83 @@ def test_get_P_data_sr2(tmp_path):
     trN1, trN2, trNZ, trNP = utils.get_data(tmp_path, tstart, tend)
 
 
+def test_sac_catalog(tmp_path, monkeypatch):
+    datapath = tmp_path / 'data'
+    cachepath = tmp_path / 'cache'
+    datapath.mkdir()
+    for filename in glob.glob(str(exmpl_path / 'data' / '2012.06[34]*.SAC')):
+        shutil.copy(filename, datapath)
+
+    # Recently modified folders are listed again and never cached
+    catalog = utils.sac_catalog(datapath, cache_dir=cachepath)
+    assert len(catalog) == 8
+    assert catalog[(2012, 64, 'Z')] == ['2012.064..BHZ.SAC']
+    assert str(datapath.resolve()) not in utils._catalogs
+    assert not cachepath.exists()
+
+    # Nothing is written to the data folder
+    monkeypatch.setattr(utils, 'CATALOG_RACY', 0)
+    assert utils.sac_catalog(datapath) == catalog
+    assert sorted(os.listdir(datapath)) == sorted(
+        name for names in catalog.values() for name in names)
+
+    # Cached catalog is reused, then rebuilt when files are removed
+    utils._catalogs.clear()
+    assert utils.sac_catalog(datapath, cache_dir=cachepath) == catalog
+    assert len(os.listdir(cachepath)) == 1
+    utils._catalogs.clear()
+    assert utils.sac_catalog(datapath, cache_dir=cachepath) == catalog
+    os.remove(datapath / '2012.063..BH1.SAC')
+    assert (2012, 63, '1') not in utils.sac_catalog(
+        datapath, cache_dir=cachepath)
+    trN1, trN2, trNZ, trNP = utils.get_data(
+        datapath, UTCDateTime('2012-03-03'), UTCDateTime('2012-03-05'))
+    assert len(trN1) == 1
+    assert len(trNZ) == 2
+
+    # The readers pass the cache folder on to the catalog
+    for i, read_data in enumerate([
+            lambda cache: utils.get_data(
+                datapath, UTCDateTime('2012-03-04'),
+                UTCDateTime('2012-03-05'), cache_dir=cache),
+            lambda cache: list(utils.iter_data(
+                datapath, UTCDateTime('2012-03-04'),
+                UTCDateTime('2012-03-05'), cache_dir=cache))]):
+        utils._catalogs.clear()
+        read_data(tmp_path / ('cache' + str(i)))
+        assert len(os.listdir(tmp_path / ('cache' + str(i)))) == 1
+    eventpath = tmp_path / 'event'
+    eventpath.mkdir()
+    shutil.copy(datapath / '2012.064..BHZ.SAC',
+                eventpath / '2012.064.01.02.BHZ.SAC')
+    utils._catalogs.clear()
+    tr1, tr2, trZ, trP = utils.get_event(
+        eventpath, UTCDateTime('2012-03-04'), UTCDateTime('2012-03-05'),
+        cache_dir=tmp_path / 'cache_event')
+    assert len(trZ) == 1
+    assert len(os.listdir(tmp_path / 'cache_event')) == 1
+
+
+def test_iter_data(tmp_path):
+    for filename in glob.glob(str(exmpl_path / 'data' / '2012.06[34]*.SAC')):
+        shutil.copy(filename, tmp_path)
+    os.remove(tmp_path / '2012.063..BDH.SAC')
+    tstart = UTCDateTime('2012-03-01')
+    tend = UTCDateTime('2012-03-10')
+    for prefetch in [0, 2]:
+        days = list(utils.iter_data(tmp_path, tstart, tend, prefetch=prefetch))
+        assert len(days) == 2
+        for tr1, tr2, trZ, trP in days:
+            assert tr1.stats.starttime.julday == trZ.stats.starttime.julday
+        assert days[0][3].stats.npts == 0
+        assert days[1][3].stats.npts == days[1][2].stats.npts
+
+    # Closing the generator early stops the reader thread
+    days = utils.iter_data(tmp_path, tstart, tend, prefetch=1)
+    next(days)
+    days.close()
+
+
 def test_get_event():
     datapath = Path('EVENTS') / '7D.M08A'
     tstart = UTCDateTime('2012-03-08')
@@ -160,3 +239,420 @@ def test_get_P_event_sr2(tmp_path):
     tstart = UTCDateTime('2012-03-08')
     tend = UTCDateTime('2012-03-10')
     tr1, tr2, trZ, trP = utils.get_event(tmp_path, tstart, tend)
+
+
+def test_loo_std_norm():
+    dsl = np.random.rand(100, 12)
+    normvar = utils.loo_std_norm(dsl)
+    for ii in range(dsl.shape[1]):
+        ind = np.delete(np.arange(dsl.shape[1]), ii)
+        assert np.isclose(
+            normvar[ii], np.linalg.norm(np.std(dsl[:, ind], axis=1)))
+
+
+def test_QC_outliers():
+    dsls = np.random.rand(3, 100, 20)
+    dsls[:, :, 5] += 10.*np.sin(np.arange(100)/10.)
+    good, diagnostics = utils.QC_outliers(dsls, tol=1.5, alpha=0.05)
+    assert len(good) == 20
+    assert not good[5]
+    assert len(diagnostics) > 0
+
+
+def test_windowed_fft():
+    from scipy.signal import stft
+    data = np.random.rand(2, 4000)
+    ws, ss = 400, 120
+    wind = np.hanning(ws)
+    f, t, ft = utils.windowed_fft(data, 5., wind, ws, ss)
+    _f, _t, _ft = stft(
+        data[1], 5., return_onesided=False, boundary=None, padded=False,
+        window=wind, nperseg=ws, noverlap=ss, detrend='constant')
+    assert ft.shape == (2, len(_t), ws)
+    assert np.allclose(f, _f)
+    assert np.allclose(t, _t)
+    assert np.allclose(ft[1], _ft.T*ws)
+
+
+def test_iter_windowed_fft():
+    data = np.random.rand(2, 4000)
+    ws, ss = 400, 120
+    wind = np.hanning(ws)
+    f, t, ft = utils.windowed_fft(data, 5., wind, ws, ss)
+    chunks = list(utils.iter_windowed_fft(
+        list(data), 5., wind, ws, ss, nchunk=4))
+    assert len(chunks) == int(np.ceil(len(t)/4))
+    assert np.allclose(np.concatenate([c[1] for c in chunks]), t)
+    assert np.allclose(np.concatenate([c[2] for c in chunks], axis=1), ft)
+
+
+def test_smooth():
+    data = np.random.rand(200, 6)
+    filt = utils.smooth(data, 50, axis=0)
+    for i in range(data.shape[1]):
+        assert np.allclose(
+            filt[:, i], np.convolve(data[:, i], np.ones(50)/50, mode='same'))
+    filt = utils.smooth(data.T, 50, axis=1)
+    assert np.allclose(filt.T, utils.smooth(data, 50, axis=0))
+    assert utils.smooth(np.zeros(10), 5) is None
+
+
+def test_solve_tilt():
+    ft1, ft2, ftZ, ftP = np.random.randn(4, 100, 200) + \
+        1j*np.random.randn(4, 100, 200)
+    ftZ += 2.*utils.rotate_dir(ft1, ft2, 60.)
+    f = np.linspace(0., 0.05, 200)
+    goodwins = np.repeat([True], 100)
+    cHH, cHZ, cHP, coh, ph, direc, tilt, coh_value, phase_value = \
+        utils.calculate_tilt(ft1, ft2, ftZ, ftP, f, goodwins)
+    assert len(coh) == len(direc)
+    assert np.isclose(tilt % 180., 60., atol=2.)
+    ftH = utils.rotate_dir(ft1, ft2, tilt)
+    assert np.allclose(cHH, np.abs(np.mean(ftH*np.conj(ftH), axis=0)))
+    assert np.allclose(cHZ, np.mean(ftH*np.conj(ftZ), axis=0))
+    assert np.allclose(cHP, np.mean(ftH*np.conj(ftP), axis=0))
+
+
+def test_spectral_matrix():
+    fts = list(np.random.randn(3, 8, 300) + 1j*np.random.randn(3, 8, 300))
+    goodwins = np.repeat([True], 8)
+    goodwins[[2, 5]] = False
+    weights = [goodwins/6., ~goodwins/2.]
+    S = utils.spectral_matrix(fts, weights, nblock=128)
+    assert S.shape == (2, 3, 3, 300)
+    for i in range(3):
+        for j in range(3):
+            assert np.allclose(S[0, i, j], np.mean(
+                fts[i][goodwins]*np.conj(fts[j][goodwins]), axis=0))
+            assert np.allclose(S[1, i, j], np.mean(
+                fts[i][~goodwins]*np.conj(fts[j][~goodwins]), axis=0))
+
+
+def test_imap_bounded():
+    import math
+    tasks = [(4.,), (-1.,), (9.,)]
+    for workers in [1, 2]:
+        out = {task: (result, error) for task, result, error in
+               utils.imap_bounded(math.sqrt, tasks, workers=workers,
+                                  ninflight=2)}
+        assert out[(4.,)] == (2., None)
+        assert out[(9.,)] == (3., None)
+        assert isinstance(out[(-1.,)][1], ValueError)
+
+
+def test_streamshift():
+    from obspy import Trace, Stream
+    rng = np.random.default_rng(0)
+    st = Stream([Trace(rng.standard_normal(n), header={'delta': 0.5})
+                 for n in [100, 101, 100]])
+    st_shift = utils.streamshift(st, [1., 0.5, -1.])
+
+    # Shifts by whole samples are circular
+    assert np.allclose(st_shift[0].data, np.roll(st[0].data, 2))
+    assert np.allclose(st_shift[2].data, np.roll(st[2].data, -2))
+    assert np.allclose(st_shift[1].data, np.roll(st[1].data, 1))
+    assert st_shift[0].stats.starttime == st[0].stats.starttime - 1.
+    assert np.allclose(utils.traceshift(st[1], 0.5).data, st_shift[1].data)
+
+
+def test_request_pool():
+    from obstools.atacr.download import RequestPool
+    from obspy.clients.fdsn.header import FDSNNoDataException
+    calls = []
+
+    def flaky(i):
+        calls.append(i)
+        if calls.count(i) < 3:
+            raise IOError("Service unavailable")
+        return i
+
+    def nodata(i):
+        calls.append(i)
+        raise FDSNNoDataException("No data")
+
+    pool = RequestPool(nrequests=2, retries=2, backoff=0.)
+    out = {task: (result, error) for task, result, error in pool.imap(
+        lambda i: pool.request('mock', flaky, i), [(1,), (2,)])}
+    assert out == {(1,): (1, None), (2,): (2, None)}
+
+    # Permanent errors are not repeated, others only `retries` times
+    calls.clear()
+    pool.retries = 1
+    for func, i in [(nodata, 3), (flaky, 4)]:
+        task, result, error = next(pool.imap(
+            lambda i: pool.request('mock', func, i), [(i,)]))
+        assert result is None and error is not None
+    assert calls == [3, 4, 4]
+
+
+def test_download_mock(tmp_path, monkeypatch):
+    from obstools.tests import get_meta, fdsn_server
+    from obstools.scripts import atacr_download_data as atacr
+    dbfile = resource_filename('obstools', 'examples/meta/M08A.pkl')
+    sta = get_meta.get_stdb()
+    st = fdsn_server.get_stream(sta, UTCDateTime('2012-03-08'), 3)
+    monkeypatch.chdir(tmp_path)
+    with fdsn_server.MockFDSN(st, nfail=1) as server:
+        args = atacr.get_daylong_arguments([
+            dbfile, '--keys', '7D.M08A', '-O',
+            '--start', '2012-03-08', '--end', '2012-03-10',
+            '--sampling-rate', '1.0', '-S', server.url, '--requests', '2',
+            '--backoff', '0.'])
+        atacr.main(args=args)
+        assert server.maxactive <= 2
+        assert server.nrequests == 5
+    files = sorted((tmp_path / 'DATA' / '7D.M08A').glob('*.SAC'))
+    assert len(files) == 8
+    tr = read(str(files[0]))[0]
+    assert tr.stats.npts == 86400
+
+
+def test_remove_response():
+    from obstools.tests import get_meta, fdsn_server
+    sta = get_meta.get_stdb()
+    st = fdsn_server.get_stream(sta, UTCDateTime('2012-03-08'), 0.5)
+    inv = fdsn_server.get_inventory(st)
+    pre_filt = [0.001, 0.005, 0.8, 1.]
+    st1 = st.copy().remove_response(inventory=inv, pre_filt=pre_filt,
+                                    output='DISP')
+    # Second call reuses the evaluated responses
+    utils._responses.clear()
+    for i in range(2):
+        st2 = utils.remove_response(st.copy(), pre_filt=pre_filt,
+                                    output='DISP', inventory=inv)
+        for tr1, tr2 in zip(st1, st2):
+            assert np.array_equal(tr1.data, tr2.data)
+        assert len(utils._responses) == 4
+
+    # Responses attached to the traces, as copies of the same epoch
+    for i in range(2):
+        st2 = st.copy()
+        st2.attach_response(inv.copy())
+        utils.remove_response(st2, pre_filt=pre_filt, output='DISP')
+        for tr1, tr2 in zip(st1, st2):
+            assert np.array_equal(tr1.data, tr2.data)
+        assert len(utils._responses) == 8
+
+
+def test_preprocess_raw(tmp_path, monkeypatch):
+    from obstools.tests import get_meta, fdsn_server
+    from obstools.scripts import atacr_download_data as download
+    from obstools.scripts import atacr_preprocess_data as preprocess
+    dbfile = resource_filename('obstools', 'examples/meta/M08A.pkl')
+    sta = get_meta.get_stdb()
+    st = fdsn_server.get_stream(sta, UTCDateTime('2012-03-08'), 2)
+    monkeypatch.chdir(tmp_path)
+
+    # Raw data split in files of 12 hours, and metadata
+    rawpath = tmp_path / 'RAW' / '7D.M08A'
+    rawpath.mkdir(parents=True)
+    for i in range(4):
+        t1 = UTCDateTime('2012-03-08') + i*43200.
+        st.slice(t1, t1 + 43200. - 0.5).write(
+            str(rawpath / '{0}.mseed'.format(i)), format='MSEED')
+    fdsn_server.get_inventory(st).write(
+        str(rawpath / 'meta.xml'), format='STATIONXML')
+
+    args = preprocess.get_preprocess_arguments([
+        dbfile, '--keys', '7D.M08A', '--start', '2012-03-08',
+        '--end', '2012-03-10', '--sampling-rate', '1.0', '--workers', '2'])
+    preprocess.main(args=args)
+    files = sorted((tmp_path / 'DATA' / '7D.M08A').glob('*.SAC'))
+    assert len(files) == 8
+    processed = [read(str(f))[0] for f in files]
+    shutil.rmtree(tmp_path / 'DATA')
+
+    # Same data as downloaded and processed from a data center
+    with fdsn_server.MockFDSN(st) as server:
+        args = download.get_daylong_arguments([
+            dbfile, '--keys', '7D.M08A', '--start', '2012-03-08',
+            '--end', '2012-03-10', '--sampling-rate', '1.0',
+            '-S', server.url])
+        download.main(args=args)
+    files = sorted((tmp_path / 'DATA' / '7D.M08A').glob('*.SAC'))
+    assert len(files) == 8
+    for tr, f in zip(processed, files):
+        assert np.allclose(tr.data, read(str(f))[0].data)
+
+
+def test_download_sources(tmp_path, monkeypatch):
+    from obstools.tests import get_meta, fdsn_server
+    from obstools.scripts import atacr_download_data as atacr
+    dbfile = resource_filename('obstools', 'examples/meta/M08A.pkl')
+    sta = get_meta.get_stdb()
+    st = fdsn_server.get_stream(sta, UTCDateTime('2012-03-08'), 2)
+    monkeypatch.chdir(tmp_path)
+    options = [dbfile, '--keys', '7D.M08A', '-O', '--start', '2012-03-08',
+               '--end', '2012-03-10', '--sampling-rate', '1.0']
+
+    def results():
+        files = sorted((tmp_path / 'DATA' / '7D.M08A').glob('*.SAC'))
+        assert len(files) == 8
+        data = [read(str(f))[0].data for f in files]
+        shutil.rmtree(tmp_path / 'DATA')
+        return data
+
+    # Requests to a data center, recorded
+    with fdsn_server.MockFDSN(st) as server:
+        atacr.main(args=atacr.get_daylong_arguments(
+            options + ['-S', server.url, '--replay', 'REPLAY']))
+        nrequests = server.nrequests
+    data = results()
+
+    # Replayed offline, with latency
+    t0 = UTCDateTime()
+    atacr.main(args=atacr.get_daylong_arguments(
+        options + ['-S', 'http://127.0.0.1:9', '--replay', 'REPLAY',
+                   '--latency', '0.2', '--requests', '1']))
+    assert UTCDateTime() - t0 > 0.2*(nrequests + 1)
+    for data1, data2 in zip(data, results()):
+        assert np.array_equal(data1, data2)
+
+    # Local SDS archive
+    sdspath = tmp_path / 'SDS'
+    for tr in st:
+        for i in range(2):
+            t1 = UTCDateTime('2012-03-08') + i*86400.
+            stats = tr.stats
+            path = sdspath / str(t1.year) / stats.network / stats.station / \
+                (stats.channel + '.D')
+            path.mkdir(parents=True, exist_ok=True)
+            fname = '{0}.D.{1}.{2:03d}'.format(tr.id, t1.year, t1.julday)
+            tr.slice(t1, t1 + 86400. - 0.5).write(
+                str(path / fname), format='MSEED')
+    fdsn_server.get_inventory(st).write('meta.xml', format='STATIONXML')
+    atacr.main(args=atacr.get_daylong_arguments(
+        options + ['--sds-path', 'SDS', '--inventory', 'meta.xml']))
+    for data1, data2 in zip(data, results()):
+        assert np.allclose(data1, data2)
+
+
+def test_sds_archive(tmp_path):
+    from obstools.tests import get_meta, fdsn_server
+    from obstools.atacr.sds import SDSArchive, SDSStation
+    sta = get_meta.get_stdb()
+    tstart = UTCDateTime('2012-03-08')
+    st = fdsn_server.get_stream(sta, tstart, 2, sr=1.)
+
+    # Day files of the SDS archive
+    for tr in st:
+        for i in range(2):
+            t1 = tstart + i*86400.
+            stats = tr.stats
+            path = tmp_path / str(t1.year) / stats.network / \
+                stats.station / (stats.channel + '.D')
+            path.mkdir(parents=True, exist_ok=True)
+            fname = '{0}.D.{1}.{2:03d}'.format(tr.id, t1.year, t1.julday)
+            tr.slice(t1, t1 + 86400. - 0.5).write(
+                str(path / fname), format='MSEED', reclen=512)
+    archive = SDSArchive(tmp_path)
+
+    # Window across midnight, read from the records of two files
+    t1 = tstart + 86400. - 3600.
+    t2 = tstart + 86400. + 3600.
+    stz = archive.get_waveforms('7D', 'M08A', '', 'BHZ', t1, t2)
+    assert len(stz) == 1
+    assert len(archive.indices) == 2
+    assert np.array_equal(stz[0].data,
+                          st.select(channel='BHZ').slice(t1, t2)[0].data)
+    for index in archive.indices.values():
+        assert np.all(np.diff(index[1]['starttime']) > 0)
+
+    # Raw data processed for DayNoise
+    inv = fdsn_server.get_inventory(st)
+    station = SDSStation(archive, sta, inventory=inv, new_sampling_rate=0.5,
+                         pre_filt=[0.001, 0.005, 0.2, 0.25])
+    tr1, tr2, trZ, trP = utils.get_data(station, tstart, tstart + 86400.)
+    assert len(trZ) == 1
+    is_ok, stp = utils.preprocess_stream(
+        st.slice(tstart, tstart + 86400.), tstart, tstart + 86400., 0.5,
+        pre_filt=[0.001, 0.005, 0.2, 0.25], inventory=inv)
+    for tr in [tr1[0], tr2[0], trZ[0], trP[0]]:
+        assert tr.stats.npts == 43200
+        expected = stp.select(channel=tr.stats.channel)[0]
+        assert np.allclose(tr.data, expected.data)
+
+    # Processed data, with pressure at a lower sampling rate
+    proc_path = tmp_path / 'proc'
+    for tr in stp:
+        if tr.stats.channel == 'BDH':
+            tr.decimate(2, no_filter=True)
+        path = proc_path / str(tstart.year) / tr.stats.network / \
+            tr.stats.station / (tr.stats.channel + '.D')
+        path.mkdir(parents=True, exist_ok=True)
+        fname = '{0}.D.{1}.{2:03d}'.format(
+            tr.id, tstart.year, tstart.julday)
+        tr.write(str(path / fname), format='MSEED')
+    station = SDSStation(SDSArchive(proc_path), sta)
+    tr1, tr2, trZ, trP = utils.get_data(station, tstart, tstart + 86400.)
+    assert len(trZ) == 1
+    for tr in [tr1[0], tr2[0], trZ[0], trP[0]]:
+        assert tr.stats.sampling_rate == 0.25
+
+
+def test_sds_span(tmp_path):
+    from obstools.tests import get_meta, fdsn_server
+    from obstools.atacr import SegmentNoise
+    from obstools.atacr.sds import SDSArchive, SDSStation
+    sta = get_meta.get_stdb()
+    tstart = UTCDateTime('2012-03-08')
+    st = fdsn_server.get_stream(sta, tstart - 86400., 4, sr=1.)
+    for tr in st:
+        for i in range(4):
+            t1 = tstart + (i - 1)*86400.
+            path = tmp_path / str(t1.year) / tr.stats.network / \
+                tr.stats.station / (tr.stats.channel + '.D')
+            path.mkdir(parents=True, exist_ok=True)
+            fname = '{0}.D.{1}.{2:03d}'.format(tr.id, t1.year, t1.julday)
+            tr.slice(t1, t1 + 86400. - 0.5).write(
+                str(path / fname), format='MSEED', reclen=512)
+    inv = fdsn_server.get_inventory(st)
+    pre_filt = [0.001, 0.005, 0.2, 0.25]
+
+    # Processed data cannot be read as spans
+    with pytest.raises(Exception):
+        SDSStation(SDSArchive(tmp_path), sta).get_span(
+            tstart, tstart + 2*86400.)
+
+    # Two days of raw data processed as one stream
+    station = SDSStation(SDSArchive(tmp_path), sta, inventory=inv,
+                         new_sampling_rate=0.5, pre_filt=pre_filt)
+    traces = station.get_span(tstart, tstart + 2*86400.)
+    trZ = traces['Z']
+    assert trZ.stats.starttime == tstart
+    assert trZ.stats.npts == 86400
+
+    # Same data as the processing of all four days, whose tapers are far
+    # from the span
+    is_ok, stp = utils.preprocess_stream(
+        st.copy(), tstart - 86400., tstart + 3*86400., 0.5,
+        pre_filt=pre_filt, inventory=inv)
+    expected = stp.select(component='Z')[0].slice(
+        tstart, tstart + 2*86400. - 2.).data
+
+    # Windows across midnight are not tapered, unlike the day files
+    segnoise = SegmentNoise(traces['1'], traces['2'], trZ, traces['H'])
+    starts, segs = segnoise.windows()
+    ws = int(segnoise.window/segnoise.dt)
+    spliced = [i for i in starts if i < 43200 < i + ws]
+    assert len(spliced) > 0
+    trN1, trN2, trNZ, trNP = utils.get_data(
+        station, tstart, tstart + 2*86400.)
+    days = np.concatenate([trNZ[0].data, trNZ[1].data])
+    for i in spliced:
+        win = trZ.data[i:i + ws]
+        ref = expected[i:i + ws]
+        assert np.sqrt(np.mean((win - ref)**2)) < 0.05*np.std(ref)
+        assert np.sqrt(np.mean((days[i:i + ws] - ref)**2)) > \
+            0.2*np.std(ref)
+        assert np.std(days[43200 - 60:43200 + 60]) < 0.2*np.std(
+            win[43200 - i - 60:43200 - i + 60])
+
+    # Margins are limited to the available data at the start of the archive
+    trZ = station.get_span(tstart - 86400., tstart + 86400.)['Z']
+    assert trZ.stats.starttime == tstart - 86400.
+    assert trZ.stats.npts == 86400
+    ref = stp.select(component='Z')[0].slice(
+        tstart - 43200., tstart + 43200. - 2.).data
+    win = trZ.data[21600:64800]
+    assert np.sqrt(np.mean((win - ref)**2)) < 0.05*np.std(ref)
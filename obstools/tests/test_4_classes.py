@@ -1,7 +1,12 @@
-from obstools.atacr import DayNoise, StaNoise, TFNoise, EventStream
+from obstools.atacr import DayNoise, SegmentNoise, StaNoise, TFNoise
+from obstools.atacr import EventStream
 from obstools.comply import Comply
+from obstools.atacr import utils, store
 from . import get_meta
+import numpy as np
 import pytest
+from obspy import read
+from pkg_resources import resource_filename
 
 
 def test_daynoise_demo():
@@ -27,6 +32,8 @@ def test_day_average(tmp_path):
     daynoise.average_daily_spectra(
         fig_average=True, fig_coh_ph=True,
         save=tmp_path)
+    # Cross spectra do not keep the spectral matrix alive
+    assert daynoise.cross.c1Z.base is None
     return daynoise
 
 
@@ -36,6 +43,167 @@ def test_day_save(tmp_path):
     daynoise.save(d)
 
 
+def test_day_onesided():
+    daynoise = test_daynoise_demo()
+    daynoise.average_daily_spectra()
+    tfnoise = TFNoise(daynoise)
+    tfnoise.transfer_func()
+    evstream = EventStream('demo')
+    evstream.correct_data(tfnoise)
+
+    daynoise_os = test_daynoise_demo()
+    daynoise_os.onesided = True
+    daynoise_os.average_daily_spectra()
+    tfnoise_os = TFNoise(daynoise_os)
+    tfnoise_os.transfer_func()
+    evstream_os = EventStream('demo')
+    evstream_os.correct_data(tfnoise_os)
+    assert len(daynoise_os.f) == len(daynoise.f)//2 + 1
+    for key in evstream.correct:
+        assert np.allclose(
+            evstream.correct[key], evstream_os.correct[key],
+            atol=1.e-5*np.max(np.abs(evstream.correct[key])))
+
+    # Conversion of two-sided objects
+    utils.to_onesided(tfnoise)
+    assert tfnoise.onesided
+    assert np.allclose(tfnoise.f, tfnoise_os.f)
+    assert np.allclose(tfnoise.cZZ, tfnoise_os.cZZ)
+
+
+def test_day_streaming():
+    daynoise = test_daynoise_demo()
+    daynoise.average_daily_spectra()
+
+    daynoise_st = DayNoise('demo', streaming=True)
+    daynoise_st.QC_daily_spectra()
+    daynoise_st.average_daily_spectra()
+    assert daynoise_st.ftZ is None
+    assert np.all(daynoise_st.goodwins == daynoise.goodwins)
+    assert np.allclose(daynoise_st.power.cZZ, daynoise.power.cZZ,
+                       rtol=1.e-5)
+    assert np.allclose(daynoise_st.cross.c1Z, daynoise.cross.c1Z,
+                       atol=1.e-5*np.max(np.abs(daynoise.cross.c1Z)))
+    assert daynoise_st.rotation.tilt == daynoise.rotation.tilt
+
+
+def test_day_store(tmp_path, monkeypatch):
+    daynoise = test_daynoise_demo()
+    daynoise.average_daily_spectra()
+    tfnoise = TFNoise(daynoise)
+    tfnoise.transfer_func()
+    evstream = EventStream('demo')
+    evstream.correct_data(tfnoise)
+    cZZ = daynoise.power.cZZ.copy()
+
+    daynoise.save(tmp_path / 'day.spec', form='spec')
+    tfnoise.save(tmp_path / 'tf.spec', form='spec')
+    evstream.save(tmp_path / 'ev.spec', form='spec')
+    daynoise_ld = store.load(tmp_path / 'day.spec')
+    tfnoise_ld = store.load(tmp_path / 'tf.spec')
+    evstream_ld = store.load(tmp_path / 'ev.spec')
+    assert isinstance(daynoise_ld, DayNoise)
+    assert isinstance(daynoise_ld.ftZ, np.memmap)
+    assert not isinstance(daynoise_ld.power.cZZ, np.memmap)
+    assert np.array_equal(daynoise_ld.power.cZZ, cZZ)
+    assert np.array_equal(daynoise_ld.goodwins, daynoise.goodwins)
+    assert daynoise_ld.tf_list == daynoise.tf_list
+    assert np.array_equal(
+        store.read(tmp_path / 'tf.spec', 'transfunc/ZP/TF_ZP'),
+        tfnoise.transfunc['ZP']['TF_ZP'])
+    assert evstream_ld.trZ.stats == evstream.trZ.stats
+    assert evstream_ld.evtime == evstream.evtime
+
+    # Corrections from the loaded objects are identical
+    evstream_ld.correct_data(tfnoise_ld)
+    for key in evstream.correct:
+        assert np.allclose(evstream.correct[key], evstream_ld.correct[key])
+
+    # Pickles are still loaded
+    evstream.save(tmp_path / 'ev.pkl')
+    assert evstream_ld.trZ == store.load(tmp_path / 'ev.pkl').trZ
+
+    # Files in either format are found, the most recent one first
+    assert store.find(tmp_path / 'ev').suffix == '.pkl'
+    assert store.find(tmp_path / 'day').suffix == '.spec'
+    assert store.find(tmp_path / 'none') is None
+    assert [f.name for f in store.glob(tmp_path, '*')] == [
+        'day.spec', 'ev.pkl', 'tf.spec']
+
+    # The number of memory mapped files is bounded, and released
+    del daynoise_ld, tfnoise_ld, evstream_ld
+    monkeypatch.setattr(store, 'MAX_MMAPS', store._nmaps[0] + 1)
+    loaded = [store.load(tmp_path / 'day.spec') for i in range(3)]
+    assert isinstance(loaded[0].ftZ, np.memmap)
+    assert not isinstance(loaded[1].ftZ, np.memmap)
+    assert np.array_equal(loaded[1].ftZ, loaded[0].ftZ)
+    del loaded
+    assert isinstance(store.load(tmp_path / 'day.spec').ftZ, np.memmap)
+
+
+def test_segnoise():
+    # One day gives the same windows and spectra as DayNoise
+    daynoise = test_daynoise_demo()
+    daynoise.QC_daily_spectra()
+    daynoise.average_daily_spectra()
+    segs = list(SegmentNoise(daynoise.tr1, daynoise.tr2, daynoise.trZ,
+                             daynoise.trP, key=daynoise.key))
+    assert len(segs) == 1
+    segs[0].QC_daily_spectra()
+    segs[0].average_daily_spectra()
+    assert segs[0].tkey == daynoise.tkey
+    assert np.array_equal(segs[0].goodwins, daynoise.goodwins)
+    assert np.array_equal(segs[0].power.cZZ, daynoise.power.cZZ)
+    assert np.array_equal(segs[0].cross.c1Z, daynoise.cross.c1Z)
+
+    # Four days of continuous data, with windows crossing midnight
+    st = read(resource_filename('obstools', 'examples/data/2012.06*.SAC'))
+    traces = [st.select(component=comp) for comp in ['1', '2', 'Z', 'H']]
+    for trs in traces:
+        trs.merge()
+    segnoise = SegmentNoise(*[trs[0] for trs in traces], key='7D.M08A')
+    starts, segs = segnoise.windows()
+    assert np.array_equal(np.unique(segs), np.arange(4))
+    assert len(starts) > 4*len(daynoise.goodwins)
+    stanoise = StaNoise()
+    for dn in segnoise:
+        assert dn.trZ.stats.starttime.julday == int(dn.tkey[-2:])
+        dn.QC_daily_spectra()
+        dn.average_daily_spectra()
+        stanoise.append(dn)
+    assert [dn.tkey for dn in stanoise] == [
+        '2012.61', '2012.62', '2012.63', '2012.64']
+    assert sum(len(dn.goodwins) for dn in stanoise) == len(starts)
+    stanoise.QC_sta_spectra()
+    stanoise.average_sta_spectra()
+
+    # Shorter segments have distinct keys and are averaged as days
+    segnoise.cadence = 43200.
+    stanoise = StaNoise()
+    incremental = StaNoise()
+    for dn in segnoise:
+        dn.QC_daily_spectra()
+        dn.average_daily_spectra()
+        stanoise.append(dn)
+        incremental.update(dn)
+    tkeys = [dn.tkey for dn in stanoise]
+    assert tkeys == [day + hour for day in [
+        '2012.61', '2012.62', '2012.63', '2012.64'] for hour in [
+        '.000000', '.120000']]
+    assert sum(len(dn.goodwins) for dn in stanoise) == len(starts)
+    stanoise.QC_sta_spectra()
+    stanoise.average_sta_spectra()
+    assert len(stanoise.gooddays) == 8
+    assert incremental.tkeys == tkeys
+    assert np.array_equal(incremental.gooddays, stanoise.gooddays)
+    assert np.allclose(incremental.power.cZZ, stanoise.power.cZZ,
+                       rtol=1.e-10)
+
+    # Segments of two days are keyed by their first day
+    segnoise.cadence = 2*86400.
+    assert [dn.tkey for dn in segnoise] == ['2012.61', '2012.63']
+
+
 def test_stanoise_demo():
     return StaNoise('demo')
 
@@ -100,6 +268,100 @@ def test_sta_save(tmp_path):
     stanoise.save(d)
 
 
+def test_sta_cube(tmp_path):
+    stanoise = test_stanoise_demo()
+    stanoise.QC_sta_spectra()
+    stanoise.average_sta_spectra()
+
+    sn = StaNoise(cube=tmp_path / 'cube.npy', ndays=10)
+    sn.cube_block = 3
+    for dn in test_stanoise_demo().daylist[:2]:
+        sn += dn
+    sn += StaNoise(test_stanoise_demo().daylist[2:])
+
+    # Days in the cube are not kept in memory, so the operators that
+    # would copy them refuse the object instead of dropping its days
+    dn = test_stanoise_demo().daylist[0]
+    with pytest.raises(TypeError):
+        sn + dn
+    with pytest.raises(TypeError):
+        StaNoise() + sn
+    with pytest.raises(TypeError):
+        list(sn)
+    with pytest.raises(TypeError):
+        StaNoise().extend(sn)
+    with pytest.raises(TypeError):
+        StaNoise(cube=tmp_path / 'cube4.npy', ndays=10).extend(sn)
+    assert sn._nday + len(sn._buffer) == 4
+
+    sn.QC_sta_spectra()
+    sn.average_sta_spectra()
+    assert isinstance(sn.cZP, np.memmap)
+    assert np.array_equal(sn.gooddays, stanoise.gooddays)
+    assert np.array_equal(sn.power.cZZ, stanoise.power.cZZ)
+    assert np.array_equal(sn.cross.c1Z, stanoise.cross.c1Z)
+    assert np.array_equal(sn.rotation.cHZ, stanoise.rotation.cHZ)
+    sn.save(tmp_path / 'sta.pkl')
+
+    with pytest.raises(Exception):
+        assert StaNoise(cube=tmp_path / 'cube2.npy')
+    sn = StaNoise(cube=tmp_path / 'cube3.npy', ndays=2)
+    with pytest.raises(Exception):
+        assert sn.extend(test_stanoise_demo())
+
+
+def test_sta_incremental(tmp_path):
+    stanoise = test_stanoise_demo()
+    stanoise.QC_sta_spectra()
+    stanoise.average_sta_spectra()
+
+    sn = StaNoise()
+    for dn in test_stanoise_demo():
+        sn.update(dn)
+    assert sn.QC and sn.av
+    assert np.array_equal(sn.gooddays, stanoise.gooddays)
+    assert np.allclose(sn.power.cZZ, stanoise.power.cZZ, rtol=1.e-10)
+    assert np.allclose(sn.cross.c1Z, stanoise.cross.c1Z, rtol=1.e-10)
+    assert sn.tf_list == stanoise.tf_list
+    with pytest.raises(Exception):
+        assert sn.update(test_stanoise_demo().daylist[0])
+
+    # Adding all days in one call gives the same average
+    sb = StaNoise()
+    sb.update(dn for dn in test_stanoise_demo())
+    assert sb.tkeys == sn.tkeys
+    assert np.array_equal(sb.gooddays, sn.gooddays)
+    assert np.allclose(sb.power.cZZ, sn.power.cZZ, rtol=1.e-10)
+
+    # Repeated removals and additions do not accumulate rounding errors
+    daylist = test_stanoise_demo().daylist
+    for i in range(20):
+        sb.remove(['2012.61', '2012.62'])
+        sb.update(daylist[:2])
+    good = np.flatnonzero(sb.gooddays)
+    sums = sum(sb.nwins[i]*sb._spectra[i]['cZZ'] for i in good)
+    assert sb._nsub <= 16
+    assert np.allclose(sb._sums['cZZ'], sums, rtol=1.e-12)
+
+    # Removing a day is the same as averaging the remaining days
+    sn.remove('2012.61')
+    stanoise = StaNoise(test_stanoise_demo().daylist[1:])
+    stanoise.QC_sta_spectra()
+    stanoise.average_sta_spectra()
+    assert sn.tkeys == ['2012.62', '2012.63', '2012.64']
+    assert np.allclose(sn.rotation.cHZ, stanoise.rotation.cHZ, rtol=1.e-10)
+    with pytest.raises(Exception):
+        assert sn.remove('2012.61')
+
+    # The state is kept on file and the loaded object can be updated
+    sn.save(tmp_path / 'state.pkl', state=True)
+    sn = store.load(tmp_path / 'state.pkl')
+    sn.update(test_stanoise_demo().daylist[0])
+    assert len(sn.tkeys) == 4
+    sn.save(tmp_path / 'sta.pkl')
+    assert not hasattr(sn, '_spectra')
+
+
 def test_evstream_demo(tmp_path):
     eventstream = EventStream('demo')
     d = tmp_path / "tmp"
@@ -128,6 +390,79 @@ def test_tfnoise_sta_demo(tmp_path):
     return tfnoise_sta
 
 
+def test_partial_spectra(tmp_path):
+    from obstools.atacr import PartialSpectra
+    stanoise = test_sta_average(tmp_path)
+    tfnoise = TFNoise(stanoise)
+    comply = Comply(objnoise=stanoise, elev=-126.4)
+    partial = PartialSpectra.of(stanoise)
+    assert PartialSpectra.of(tfnoise) is partial
+    assert PartialSpectra.of(comply) is partial
+
+    # Same as conditioning one component at a time
+    p, c = stanoise.power, stanoise.cross
+    lc1c2 = np.conj(c.c12)/p.c11
+    lc1cP = np.conj(c.c1P)/p.c11
+    gc2c2_c1 = p.c22 - np.abs(c.c12)**2/p.c11
+    gcPcP_c1 = p.cPP - np.abs(c.c1P)**2/p.c11
+    gc2cP_c1 = np.conj(c.c2P) - np.conj(lc1c2*c.c1P)
+    gcPcZ_c1 = c.cZP - np.conj(lc1cP*c.c1Z)
+    gc2cZ_c1 = np.conj(c.c2Z) - np.conj(lc1c2*c.c1Z)
+    gcPcP_c1c2 = gcPcP_c1 - np.abs(gc2cP_c1)**2/gc2c2_c1
+    gcPcZ_c1c2 = gcPcZ_c1 - np.conj(gc2cP_c1)*gc2cZ_c1/gc2c2_c1
+    assert np.allclose(partial.spectrum('2', '2', ('1',)), gc2c2_c1)
+    assert np.allclose(partial.gain('2', 'P', ('1',)), gc2cP_c1/gc2c2_c1)
+    assert np.allclose(partial.spectrum('P', 'P', ('1', '2')), gcPcP_c1c2)
+    assert np.allclose(partial.gain('P', 'Z', ('1', '2')),
+                       gcPcZ_c1c2/gcPcP_c1c2)
+    assert np.all(partial.coherence('P', 'Z', ('1', '2')) <= 1. + 1.e-10)
+    with pytest.raises(Exception):
+        assert partial.gain('H', 'Z', ('1',))
+
+    # Changed spectra are not shared
+    tfnoise.cZZ = tfnoise.cZZ.copy()
+    assert PartialSpectra.of(tfnoise) is not partial
+
+
+def test_evstream_correct_events(tmp_path):
+    tfnoise = test_tfnoise_day_demo(tmp_path)
+    evstream = EventStream('demo')
+    evstream.correct_data(tfnoise)
+
+    # Events are corrected in chunks of stacked arrays
+    evstreams = [EventStream('demo') for i in range(3)]
+    for i, ev in enumerate(evstreams):
+        ev.trZ.data = ev.trZ.data*(i + 1)
+    EventStream.correct_events(evstreams, tfnoise, nchunk=2)
+    for i, ev in enumerate(evstreams):
+        assert list(ev.correct) == list(evstream.correct)
+        for key in evstream.correct:
+            assert np.allclose(
+                ev.correct[key], evstream.correct[key] + i*evstream.trZ.data,
+                atol=1.e-6*np.max(np.abs(evstream.trZ.data)))
+
+
+def test_tf_registry(tmp_path):
+    import shutil
+    test_tfnoise_day_demo(tmp_path)
+    for name in ['2012.061-2012.065', '2012.064-2012.070', '2012.069']:
+        shutil.copy(tmp_path / 'tmp', tmp_path / (name + '.transfunc.pkl'))
+    registry = store.TFRegistry(tmp_path, maxsize=1)
+    assert len(registry) == 3
+
+    evtime = EventStream('demo').evtime
+    sta_files = registry.find(evtime, 'sta')
+    assert [f.name for f in sta_files] == ['2012.064-2012.070.transfunc.pkl']
+    assert registry.find(evtime, 'day') == [tmp_path / '2012.069.transfunc.pkl']
+    assert registry.find(evtime + 86400., 'sta') == []
+
+    # Loaded objects are cached
+    tf_sta = registry.load(sta_files[0])
+    assert registry.load(sta_files[0]) is tf_sta
+    registry.load(registry.find(evtime, 'day')[0])
+    assert registry.load(sta_files[0]) is not tf_sta
+
+
 def test_comply_day_demo(tmp_path):
     daynoise = test_day_average(tmp_path)
     sta = get_meta.get_stdb()
@@ -144,6 +479,31 @@ def test_comply_sta_demo(tmp_path):
     return comply_sta
 
 
+def test_comply_wavenumber():
+    import numpy.polynomial as poly
+    from obstools.comply import wavenumber as wn
+    f = np.fft.fftfreq(2000, d=0.2)
+    H = 126.4
+    k = wn.wavenumber(f, H)
+    assert wn.wavenumber(f, H) is k
+    assert np.allclose(wn.wavenumber(-f, H, cache=False), k)
+
+    # Same positive roots of the quartic as before
+    g = wn.G
+    for i in [1, 5, 20]:
+        om = 2.*np.pi*f[i]
+        roots = poly.Polynomial(
+            [-27*om**2/g, 0., 27*H - 9*om**2*H**2/g, 0., H**3]).roots()
+        root = roots[(roots.real > 0) & (roots.imag == 0)].real[0]
+        assert np.isclose(k[i], root, rtol=1.e-10)
+
+    # Exact solution of the dispersion relation
+    ke = wn.wavenumber(f, H, exact=True)
+    omega2 = (2.*np.pi*f)**2
+    assert np.allclose(g*ke*np.tanh(ke*H), omega2, rtol=1.e-10, atol=0.)
+    assert np.max(np.abs(k[1:] - ke[1:])/ke[1:]) < 0.025
+
+
 def test_comply_fail(tmp_path):
     import pytest
     import pickle
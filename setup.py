@@ -34,7 +34,7 @@ setup(
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9'],
-    install_requires=['numpy', 'obspy', 'stdb', 'pandas'],
+    install_requires=['numpy>=1.20', 'obspy', 'stdb', 'pandas'],
     python_requires='>=3.6',
     packages=setuptools.find_packages(),
     include_package_data=True,
@@ -44,6 +44,7 @@ setup(
     entry_points={
         'console_scripts':
         ['atacr_download_data=obstools.scripts.atacr_download_data:main',
+         'atacr_preprocess_data=obstools.scripts.atacr_preprocess_data:main',
          'atacr_download_event=obstools.scripts.atacr_download_event:main',
          'atacr_daily_spectra=obstools.scripts.atacr_daily_spectra:main',
          'atacr_clean_spectra=obstools.scripts.atacr_clean_spectra:main',